@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measure listing of local branches in a synthetic repository with many branches,
+half of them merged into main: wall time, time to the first branch
+and peak memory of collecting all the branches compared to streaming them.
+
+    python3 benchmarks/bench_branches.py --branches 50000
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from upsint.utils import iter_local_branches, list_local_branches
+
+
+def create_repo(directory: Path, branches: int):
+    """ create `branches` branches, every other one is merged into main """
+    lines = []
+    mark = 0
+    for idx in range(branches):
+        mark += 1
+        message = f"commit {idx}"
+        lines += [
+            "commit refs/heads/main",
+            f"mark :{mark}",
+            f"committer Bench <bench@example.com> {1600000000 + idx} +0200",
+            f"data {len(message)}",
+            message,
+            "",
+        ]
+        if idx % 2:
+            # unmerged: a commit on top of main which main doesn't contain
+            mark += 1
+            message = f"unmerged {idx}"
+            lines += [
+                f"commit refs/heads/branch-{idx}",
+                f"mark :{mark}",
+                f"committer Bench <bench@example.com> {1600000000 + idx} +0200",
+                f"data {len(message)}",
+                message,
+                f"from :{mark - 1}",
+                "",
+            ]
+        else:
+            lines += [f"reset refs/heads/branch-{idx}", f"from :{mark}", ""]
+    subprocess.check_call(["git", "init", "-q", "-b", "main", str(directory)])
+    subprocess.run(
+        ["git", "fast-import", "--quiet"],
+        input="\n".join(lines).encode(),
+        cwd=directory,
+        check=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--branches", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        create_repo(Path(tmp), args.branches)
+        os.chdir(tmp)
+        for _ in range(args.repeat):
+            start = time.monotonic()
+            branches = list_local_branches("main")
+            elapsed = time.monotonic() - start
+            merged = sum(1 for b in branches if b.merged)
+            print(f"list: branches={len(branches)} merged={merged} wall={elapsed:.2f}s")
+        del branches
+
+        tracemalloc.start()
+        list_local_branches("main")
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"list: peak memory={peak / 2 ** 20:.1f} MiB")
+
+        tracemalloc.start()
+        start = time.monotonic()
+        first = None
+        for branch in iter_local_branches("main"):
+            if first is None:
+                first = time.monotonic() - start
+        elapsed = time.monotonic() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"stream: first branch={first:.2f}s wall={elapsed:.2f}s "
+            f"peak memory={peak / 2 ** 20:.1f} MiB"
+        )
+
+        start = time.monotonic()
+        top = list(iter_local_branches("main", limit=10))
+        print(f"limit=10: branches={len(top)} wall={time.monotonic() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measure how `get-changes` scales with the number of workers resolving PRs
+and how long an incremental run takes.
+
+A local HTTP server stands in for the forge API and delays every response.
+
+    python3 benchmarks/bench_get_changes.py --prs 100 --latency 0.05
+
+With --incremental, a changelog of the whole range is stored first and then
+a single merge is added on top, e.g. for a 5k commit range:
+
+    python3 benchmarks/bench_get_changes.py --incremental --prs 500 --commits-per-pr 9
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from upsint.changelog import ChangelogStore, generate_changelog
+
+
+def serve_fake_api(latency: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            pr_id = int(self.path.rsplit("/", 1)[-1])
+            body = json.dumps({"number": pr_id, "body": f"PR {pr_id}"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        # the default backlog of 5 makes concurrent clients wait for SYN retries
+        request_queue_size = 128
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class PullRequest:
+    def __init__(self, data):
+        self.id = data["number"]
+        self.description = data["body"]
+
+
+class Project:
+    namespace = "packit"
+    repo = "upsint"
+    service = None
+
+    def __init__(self, api_url):
+        self.api_url = api_url
+
+    def get_pr(self, pr_id):
+        with urllib.request.urlopen(f"{self.api_url}/pulls/{pr_id}") as response:
+            return PullRequest(json.load(response))
+
+
+def fast_import(directory: Path, first_pr: int, prs: int, commits_per_pr: int):
+    """
+    add `prs` merges of pull requests, each bringing `commits_per_pr` commits,
+    on top of the main branch (or create it) using git fast-import
+    """
+    lines = []
+
+    def commit(ref, mark, message, parents):
+        lines.extend(
+            [
+                f"commit {ref}",
+                f"mark :{mark}",
+                "committer Bench <bench@example.com> 1600000000 +0000",
+                f"data {len(message.encode())}",
+                message,
+            ]
+        )
+        if parents:
+            lines.append(f"from {parents[0]}")
+        lines.extend(f"merge {p}" for p in parents[1:])
+        lines.append("")
+
+    mark = 0
+    if first_pr == 0:
+        mark += 1
+        commit("refs/heads/main", mark, "initial commit", [])
+        main = f":{mark}"
+        lines += ["reset refs/tags/start", f"from {main}", ""]
+    else:
+        main = "refs/heads/main^0"
+    for pr_id in range(first_pr, first_pr + prs):
+        head = main
+        for idx in range(commits_per_pr):
+            mark += 1
+            commit(f"refs/heads/b{pr_id}", mark, f"change {pr_id}.{idx}", [head])
+            head = f":{mark}"
+        mark += 1
+        message = f"Merge pull request #{pr_id} from user/b{pr_id}\n\nPR {pr_id}"
+        commit("refs/heads/main", mark, message, [main, head])
+        main = f":{mark}"
+
+    subprocess.run(
+        ["git", "fast-import", "--quiet"],
+        input="\n".join(lines).encode(),
+        cwd=directory,
+        check=True,
+    )
+
+
+def bench_jobs(project, jobs_list):
+    for jobs in jobs_list:
+        start = time.monotonic()
+        entries = list(generate_changelog(project, "start", "HEAD", jobs=jobs))
+        elapsed = time.monotonic() - start
+        print(f"jobs={jobs:3} entries={len(entries)} wall={elapsed:.2f}s")
+
+
+def bench_incremental(project, directory: Path, prs: int, commits_per_pr: int):
+    store = ChangelogStore(path=directory.joinpath("changelog.sqlite"))
+    start = time.monotonic()
+    entries = list(generate_changelog(project, "start", "HEAD", store=store))
+    print(f"cold run: entries={len(entries)} wall={time.monotonic() - start:.2f}s")
+
+    fast_import(directory, prs, 1, commits_per_pr)
+    start = time.monotonic()
+    entries = list(generate_changelog(project, "start", "HEAD", store=store))
+    print(f"one new merge: entries={len(entries)} wall={time.monotonic() - start:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prs", type=int, default=100)
+    parser.add_argument("--commits-per-pr", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="measure a run with one new merge on top of a stored changelog",
+    )
+    args = parser.parse_args()
+
+    server = serve_fake_api(args.latency)
+    project = Project(f"http://127.0.0.1:{server.server_address[1]}")
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.check_call(["git", "init", "-q", "-b", "main", tmp])
+        fast_import(Path(tmp), 0, args.prs, args.commits_per_pr)
+        os.chdir(tmp)
+        if args.incremental:
+            bench_incremental(project, Path(tmp), args.prs, args.commits_per_pr)
+        else:
+            bench_jobs(project, args.jobs)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measure the output formats of the listing commands on many synthetic rows:
+wall time, rows per second and peak memory of every machine-readable writer
+compared to the fancy_grid table.
+
+    python3 benchmarks/bench_output.py --rows 100000
+"""
+
+import argparse
+import datetime
+import io
+import time
+import tracemalloc
+
+from upsint.constant import OUTPUT_FORMATS
+from upsint.output import get_writer
+
+FIELDS = ("id", "title", "author", "url", "updated")
+
+
+def iter_rows(count: int):
+    updated = datetime.datetime(2020, 1, 1)
+    for idx in range(count):
+        yield (
+            idx,
+            f"Pull request number {idx}, with a title of usual length",
+            f"author-{idx % 50}",
+            f"https://github.com/packit/upsint/pull/{idx}",
+            updated + datetime.timedelta(minutes=idx),
+        )
+
+
+def measure(output: str, rows: int):
+    stream = io.StringIO()
+    tracemalloc.start()
+    start = time.monotonic()
+    with get_writer(output, FIELDS, stream) as writer:
+        for row in iter_rows(rows):
+            writer.write(row)
+    elapsed = time.monotonic() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{output}: wall={elapsed:.2f}s rows/s={rows / elapsed:.0f} "
+        f"size={len(stream.getvalue()) / 2 ** 20:.1f} MiB "
+        f"peak memory={peak / 2 ** 20:.1f} MiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        default=["table", *OUTPUT_FORMATS],
+    )
+    args = parser.parse_args()
+
+    for output in args.formats:
+        measure(output, args.rows)
+
+
+if __name__ == "__main__":
+    main()
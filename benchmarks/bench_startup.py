@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measure how long importing the CLI takes using `python -X importtime`
+and which modules cost the most. Fails if heavy modules are imported
+at startup or if the import takes longer than --max-ms.
+
+    python3 benchmarks/bench_startup.py --max-ms 150
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+# these are needed only by the commands talking to the forges
+HEAVY_MODULES = ("ogr", "github", "gitlab", "requests", "tabulate", "yaml")
+
+
+def import_times(module: str):
+    """ {module: (self us, cumulative us)} of importing the module in a new process """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        if not self_us.strip().isdigit():
+            # the header
+            continue
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="upsint.cli")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    best = min(runs, key=lambda times: times[args.module][1])
+    total_ms = best[args.module][1] / 1000
+    print(f"import {args.module}: {total_ms:.1f} ms (best of {args.repeat})")
+    print(f"top {args.top} modules by self time:")
+    by_self_time = sorted(best.items(), key=lambda item: -item[1][0])
+    for name, (self_us, _) in by_self_time[: args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    start = time.monotonic()
+    subprocess.run(
+        [sys.executable, "-m", args.module, "--help"],
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    print(f"{args.module} --help: {(time.monotonic() - start) * 1000:.0f} ms wall")
+
+    failed = False
+    heavy = sorted(name for name in best if name.split(".")[0] in HEAVY_MODULES)
+    if heavy:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(heavy)}")
+        failed = True
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(f"FAIL: import takes more than {args.max_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
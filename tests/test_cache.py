@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+
+import pytest
+import requests
+
+from upsint.cache import (
+    BranchPRIndex,
+    HTTPCache,
+    install_http_cache,
+    uninstall_http_cache,
+)
+from upsint.exceptions import OfflineError
+
+
+def serve(fake_api, path, document, extra_headers=None):
+    """
+    answer GET requests of the path with the JSON document, honouring If-None-Match
+
+    :return: list of the If-None-Match headers of the requests, None if not sent
+    """
+    etag = f'"{hash(json.dumps(document))}"'
+    conditions = []
+
+    def handler(query, payload, headers):
+        conditions.append(headers.get("If-None-Match"))
+        response_headers = dict(extra_headers or {}, ETag=etag)
+        if headers.get("If-None-Match") == etag:
+            return 304, response_headers, None
+        return 200, response_headers, document
+
+    fake_api.routes[("GET", path)] = handler
+    return conditions
+
+
+def get_paths(fake_api):
+    return [path for _, path, _ in fake_api.requests]
+
+
+@pytest.fixture()
+def http_cache(tmp_path):
+    cache = HTTPCache(path=tmp_path / "http.sqlite")
+    install_http_cache(cache)
+    yield cache
+    uninstall_http_cache()
+
+
+def test_fresh_response_is_served_from_cache(fake_api, http_cache):
+    serve(fake_api, "/repos/packit/upsint", {"name": "upsint"})
+    first = requests.get(f"{fake_api.url}/repos/packit/upsint")
+    second = requests.get(f"{fake_api.url}/repos/packit/upsint")
+    assert first.json() == second.json() == {"name": "upsint"}
+    assert len(fake_api.requests) == 1
+    assert (http_cache.hits, http_cache.misses) == (1, 1)
+
+
+def test_stale_response_is_revalidated(fake_api, http_cache):
+    http_cache.ttl = 0
+    conditions = serve(fake_api, "/labels", ["bug"])
+    assert requests.get(f"{fake_api.url}/labels").json() == ["bug"]
+    assert requests.get(f"{fake_api.url}/labels").json() == ["bug"]
+    assert http_cache.revalidated == 1
+    assert conditions[1] is not None
+
+    serve(fake_api, "/labels", ["bug", "feature"])
+    assert requests.get(f"{fake_api.url}/labels").json() == ["bug", "feature"]
+    assert http_cache.misses == 2
+
+
+def test_credentials_are_part_of_the_key(fake_api, http_cache):
+    serve(fake_api, "/user", {"login": "me"})
+    requests.get(f"{fake_api.url}/user", headers={"Authorization": "token a"})
+    requests.get(f"{fake_api.url}/user", headers={"Authorization": "token b"})
+    assert len(fake_api.requests) == 2
+
+
+def test_errors_and_other_methods_are_not_cached(fake_api, http_cache):
+    assert requests.get(f"{fake_api.url}/missing").status_code == 404
+    assert requests.get(f"{fake_api.url}/missing").status_code == 404
+    assert http_cache.stats()["entries"] == 0
+    assert http_cache.misses == 2
+
+
+def test_lru_eviction(fake_api, http_cache):
+    http_cache.max_size = 250
+    for idx in range(3):
+        serve(fake_api, f"/{idx}", {"padding": "x" * 100, "idx": idx})
+    requests.get(f"{fake_api.url}/0")
+    requests.get(f"{fake_api.url}/1")
+    # touch the first one, so the second one is the least recently used
+    requests.get(f"{fake_api.url}/0")
+    requests.get(f"{fake_api.url}/2")
+    stats = http_cache.stats()
+    assert stats["entries"] == 2
+    assert stats["size"] <= 250
+    requests.get(f"{fake_api.url}/0")
+    requests.get(f"{fake_api.url}/1")
+    assert get_paths(fake_api) == ["/0", "/1", "/2", "/1"]
+
+
+def test_clear(fake_api, http_cache):
+    serve(fake_api, "/tags", [])
+    requests.get(f"{fake_api.url}/tags")
+    http_cache.clear()
+    assert http_cache.stats()["entries"] == 0
+    requests.get(f"{fake_api.url}/tags")
+    assert len(fake_api.requests) == 2
+
+
+def test_offline_serves_responses_of_any_age(fake_api, http_cache):
+    serve(fake_api, "/labels", ["bug"])
+    requests.get(f"{fake_api.url}/labels")
+    http_cache.ttl, http_cache.offline = 0, True
+    assert requests.get(f"{fake_api.url}/labels").json() == ["bug"]
+    assert len(fake_api.requests) == 1
+    assert http_cache.offline_age is not None
+    with pytest.raises(OfflineError):
+        requests.get(f"{fake_api.url}/tags")
+
+
+def test_unreachable_forge_falls_back_to_cache(fake_api, http_cache):
+    http_cache.ttl = 0
+    # no kept-alive connection may outlive the server
+    serve(fake_api, "/labels", ["bug"], extra_headers={"Connection": "close"})
+    requests.get(f"{fake_api.url}/labels")
+    assert http_cache.offline_age is None
+    fake_api.shutdown()
+    assert requests.get(f"{fake_api.url}/labels").json() == ["bug"]
+    assert http_cache.offline_age is not None
+    with pytest.raises(requests.ConnectionError):
+        requests.get(f"{fake_api.url}/tags")
+
+
+def test_graphql_queries_are_cached(fake_api, http_cache):
+    fake_api.routes[("POST", "/graphql")] = lambda *_: (200, {}, {"data": {}})
+    for query in ("query { a }", "query { a }", "query { b }"):
+        requests.post(f"{fake_api.url}/graphql", json={"query": query})
+    assert len(fake_api.requests) == 2
+    for _ in range(2):
+        requests.post(f"{fake_api.url}/graphql", json={"query": "mutation { c }"})
+    assert len(fake_api.requests) == 4
+
+
+def test_branch_pr_index(tmp_path):
+    index = BranchPRIndex(path=tmp_path / "branch-prs.json")
+    assert index.get("github.com/packit/upsint", "feature", "aaa") is None
+    index.set("github.com/packit/upsint", "feature", "aaa", 12)
+    index.set("github.com/packit/ogr", "feature", "aaa", 34)
+    assert index.get("github.com/packit/upsint", "feature", "aaa") == 12
+    assert index.get("github.com/packit/ogr", "feature", "aaa") == 34
+    # the branch moved, the PR needs to be looked up again
+    assert index.get("github.com/packit/upsint", "feature", "bbb") is None
+    index.clear()
+    assert index.get("github.com/packit/upsint", "feature", "aaa") is None
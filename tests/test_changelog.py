@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import re
+import subprocess
+import threading
+import time
+
+import pytest
+from ogr.abstract import PRStatus
+from ogr.services.github import GithubProject, GithubService
+
+from upsint import forge
+from upsint.changelog import (
+    ChangelogStore,
+    GithubPullRequestResolver,
+    generate_changelog,
+    iter_changelog,
+)
+from upsint.exceptions import UpsintException
+from upsint.forge import GithubAPI
+from tests.test_integration import GIT_TAG, initiate_git_repo
+
+
+def graphql_prs(pr_count):
+    """ stand-in for GitHub GraphQL API which knows pull requests 1..N """
+
+    def graphql(query, payload, headers):
+        repository, errors = {}, []
+        for alias, number in re.findall(
+            r"(\w+): pullRequest\(number: (\d+)\)", payload["query"]
+        ):
+            number = int(number)
+            if number > pr_count:
+                repository[alias] = None
+                errors.append({"type": "NOT_FOUND", "path": ["repository", alias]})
+                continue
+            repository[alias] = {
+                "number": number,
+                "title": f"PR {number}",
+                "body": f"description of #{number}",
+                "author": {"login": "packit"} if number % 2 else None,
+                "mergeCommit": {"oid": f"{number:040x}"},
+            }
+        return 200, {}, {"data": {"repository": repository}, "errors": errors}
+
+    return graphql
+
+
+class FakePullRequest:
+    def __init__(self, pr_id, status=PRStatus.open):
+        self.id = pr_id
+        self.description = f"description of #{pr_id}"
+        self.status = status
+
+
+class FakeProject:
+    namespace = "packit"
+    repo = "upsint"
+    service = None
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def get_pr(self, pr_id):
+        time.sleep(self.latency)
+        with self.lock:
+            self.requested.append(pr_id)
+        return FakePullRequest(pr_id)
+
+
+@pytest.fixture()
+def graphql(fake_api):
+    fake_api.routes[("POST", "/graphql")] = graphql_prs(pr_count=500)
+    return fake_api
+
+
+def get_queries(fake_api):
+    return [payload for method, _, payload in fake_api.requests if method == "POST"]
+
+
+def test_prs_are_resolved_in_batches(graphql):
+    api = GithubAPI(token="abc", api_url=graphql.url)
+    with GithubPullRequestResolver(FakeProject(), jobs=4, api=api) as resolver:
+        futures = [resolver.submit(pr_id) for pr_id in range(1, 501)]
+        resolver.flush()
+        prs = [f.result(timeout=10) for f in futures]
+
+    queries = get_queries(graphql)
+    assert len(queries) == 5
+    assert queries[0]["variables"] == {"owner": "packit", "name": "upsint"}
+    assert [pr.id for pr in prs] == list(range(1, 501))
+    assert prs[0].description == "description of #1"
+    assert prs[0].author == "packit"
+    assert prs[1].author == "ghost"
+    assert prs[2].merge_commit_sha == f"{3:040x}"
+
+
+def test_missing_pr(graphql):
+    api = GithubAPI(api_url=graphql.url)
+    with GithubPullRequestResolver(FakeProject(), api=api) as resolver:
+        existing, missing = resolver.submit(1), resolver.submit(1000)
+        assert resolver.submit(1) is existing
+        resolver.flush()
+        assert existing.result(timeout=10).title == "PR 1"
+        with pytest.raises(UpsintException):
+            missing.result(timeout=10)
+    assert len(get_queries(graphql)) == 1
+
+
+def test_missing_repository_fails_the_whole_batch(fake_api):
+    # what GitHub answers for a repository the token can't read
+    fake_api.routes[("POST", "/graphql")] = lambda *_: (
+        200,
+        {},
+        {
+            "data": {"repository": None},
+            "errors": [{"type": "NOT_FOUND", "path": ["repository"]}],
+        },
+    )
+    api = GithubAPI(api_url=fake_api.url)
+    with GithubPullRequestResolver(FakeProject(), api=api) as resolver:
+        futures = [resolver.submit(pr_id) for pr_id in (1, 2)]
+        resolver.flush()
+        for future in futures:
+            with pytest.raises(UpsintException, match="packit/upsint not found"):
+                future.result(timeout=10)
+
+
+def create_merges(directory, prs, first_id=1):
+    """
+    merges of pull requests first_id.. on top of the main branch,
+    a new repository with the initial commit tagged start is created for the first one
+    """
+    committer = "committer Packit <packit@example.com> 1600000000 +0000"
+    lines, parent = [], "refs/heads/main^0"
+    if first_id == 1:
+        lines += [
+            "commit refs/heads/main",
+            "mark :1",
+            committer,
+            "data 7",
+            "initial",
+            "",
+        ]
+        lines += ["reset refs/tags/start", "from :1", ""]
+        parent = ":1"
+        subprocess.check_call(["git", "init", "-q", "-b", "main", str(directory)])
+    for pr_id in range(first_id, first_id + prs):
+        branch = 2 * pr_id
+        message = f"Merge pull request #{pr_id} from packit/pr-{pr_id}\n\nPR {pr_id}"
+        lines += [f"commit refs/heads/pr-{pr_id}", f"mark :{branch}", committer]
+        lines += ["data 6", "change", f"from {parent}", ""]
+        lines += ["commit refs/heads/main", f"mark :{branch + 1}", committer]
+        lines += [
+            f"data {len(message)}",
+            message,
+            f"from {parent}",
+            f"merge :{branch}",
+            "",
+        ]
+        parent = f":{branch + 1}"
+    subprocess.run(
+        ["git", "fast-import", "--quiet"],
+        input="\n".join(lines).encode(),
+        cwd=directory,
+        check=True,
+    )
+
+
+def test_generate_changelog(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    initiate_git_repo(str(tmp_path))
+    project = FakeProject()
+    entries = list(generate_changelog(project, GIT_TAG))
+    assert project.requested == [760]
+    assert entries == [
+        "* More Specfile.add_patches() changes, by [@jpopelka]"
+        "(https://github.com/jpopelka), [#760](https://github.com/packit/upsint/pull/760)\n"
+        "  * description: 'description of #760'\n"
+        "  * commit: branch change #2\n"
+        "  * commit: branch change",
+        "* line 1",
+    ]
+
+
+def test_generate_changelog_concurrently(tmp_path, monkeypatch):
+    create_merges(tmp_path, 16)
+    monkeypatch.chdir(tmp_path)
+    project = FakeProject(latency=0.1)
+    start = time.monotonic()
+    entries = list(generate_changelog(project, "start", jobs=16))
+    elapsed = time.monotonic() - start
+    # serially, this would take 1.6 seconds
+    assert elapsed < 1.0
+    assert [e.splitlines()[1] for e in entries] == [
+        f"  * description: 'description of #{pr_id}'"
+        for pr_id in reversed(range(1, 17))
+    ]
+
+
+def test_generate_changelog_incrementally(tmp_path, monkeypatch):
+    create_merges(tmp_path, 3)
+    monkeypatch.chdir(tmp_path)
+    store = ChangelogStore(path=tmp_path / "changelog.sqlite")
+
+    project = FakeProject()
+    first_run = list(generate_changelog(project, "start", store=store))
+    assert sorted(project.requested) == [1, 2, 3]
+
+    create_merges(tmp_path, 1, first_id=4)
+    project, reserved = FakeProject(), []
+    second_run = list(
+        generate_changelog(project, "start", store=store, reserve=reserved.append)
+    )
+    assert project.requested == [4]
+    # only the new pull request is estimated to need a request
+    assert reserved == [1]
+    assert second_run[1:] == first_run
+    assert second_run == list(generate_changelog(FakeProject(), "start"))
+
+    # an older upper bound can't continue from the stored tip,
+    # but the entries themselves are reused
+    project = FakeProject()
+    assert list(generate_changelog(project, "start", "main~2", store=store)) == (
+        first_run[1:]
+    )
+    assert project.requested == []
+
+
+def test_stored_tip_merged_from_a_branch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    initiate_git_repo(str(tmp_path))
+    store = ChangelogStore(path=tmp_path / "changelog.sqlite")
+
+    # master merged the branch after the branch was processed
+    list(iter_changelog(FakeProject(), GIT_TAG, "branch", store=store))
+    entries = list(iter_changelog(FakeProject(), GIT_TAG, "master", store=store))
+
+    assert [(e.subject, e.commits) for e in entries] == [
+        ("More Specfile.add_patches() changes", ["branch change #2", "branch change"]),
+        ("line 1", []),
+    ]
+    assert entries == list(iter_changelog(FakeProject(), GIT_TAG, "master"))
+
+
+def test_changelog_of_many_merges(graphql, tmp_path, monkeypatch):
+    create_merges(tmp_path, 500)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(forge, "GITHUB_API_URL", graphql.url)
+    git_project = GithubProject(
+        repo="upsint", service=GithubService(token="abc"), namespace="packit"
+    )
+
+    entries = list(generate_changelog(git_project, "start", "main", jobs=4))
+
+    assert len(entries) == 500
+    assert entries[0].startswith("* PR 500")
+    assert "[#1](https://github.com/packit/upsint/pull/1)" in entries[-1]
+    # a GraphQL query for every hundred pull requests, no REST calls
+    assert len(graphql.requests) == 5
+
+
+def test_changelog_entries_as_data(graphql, tmp_path, monkeypatch):
+    create_merges(tmp_path, 2)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(forge, "GITHUB_API_URL", graphql.url)
+    git_project = GithubProject(
+        repo="upsint", service=GithubService(token="abc"), namespace="packit"
+    )
+    store = ChangelogStore(path=tmp_path / "changelog.sqlite")
+
+    for _ in range(2):
+        # the second run reads the entries from the store
+        latest, first = iter_changelog(git_project, "start", "main", store=store)
+        assert (latest.subject, latest.pr, latest.author) == ("PR 2", 2, "packit")
+        assert latest.description == "description of #2"
+        assert latest.commits == ["change"]
+        assert first.render(git_project).startswith("* PR 1, by [@packit]")
+    assert len(graphql.requests) == 1
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import subprocess
+import sys
+
+import pytest
+from click.testing import CliRunner
+
+from upsint.cli import upsint
+
+
+def test_startup_does_not_import_forge_libraries():
+    code = (
+        "import sys, upsint.cli; "
+        "print(' '.join(m for m in ('ogr', 'requests', 'tabulate', 'yaml') "
+        "if m in sys.modules))"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code], text=True)
+    assert output.strip() == ""
+
+
+def test_cache_stats(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    result = CliRunner().invoke(upsint, ["cache", "stats"])
+    assert result.exit_code == 0, result.output
+    assert f"Location: {tmp_path / 'upsint' / 'http.sqlite'}" in result.output
+
+
+def test_offline_needs_cache():
+    result = CliRunner().invoke(upsint, ["--offline", "--no-cache", "list-prs"])
+    assert result.exit_code == 2
+    assert "--offline needs the cache" in result.output
+
+
+def test_offline_age_is_reported_per_command(tmp_path, monkeypatch):
+    from upsint.core import App
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    app = App()
+    app.http_cache.offline_age = 7200
+    # e.g. the daemon running a command after one answered from stale data
+    result = CliRunner().invoke(upsint, ["cache", "stats"], obj=app)
+    assert result.exit_code == 0, result.output
+    assert "Offline" not in result.output
+
+
+def test_list_prs_from_file(tmp_path, monkeypatch):
+    import datetime
+    import json
+
+    from upsint import forge
+    from upsint.core import App
+
+    class PullRequest:
+        id, title, author, url = 1, "Fix", "packit", "https://pr/1"
+        created = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+    class Project:
+        full_repo_name = "packit/upsint"
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(forge, "iter_pr_list", lambda project: iter([PullRequest()]))
+    app = App()
+    monkeypatch.setattr(app, "get_git_project", lambda url: Project())
+    repos = tmp_path / "repos"
+    repos.write_text("# a single repository\nhttps://github.com/packit/upsint\n")
+
+    result = CliRunner().invoke(
+        upsint, ["list-prs", "--repos-file", str(repos), "--output", "jsonl"], obj=app
+    )
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output) == {
+        "repository": "packit/upsint",
+        "id": 1,
+        "title": "Fix",
+        "author": "packit",
+        "url": "https://pr/1",
+        "updated": "2020-01-01T00:00:00+00:00",
+    }
+
+
+@pytest.mark.parametrize("interval", ["-1", "0", "0.5"])
+def test_watch_interval_has_a_lower_bound(interval):
+    result = CliRunner().invoke(upsint, ["status", "--watch", "--interval", interval])
+    assert result.exit_code == 2
+    assert "--interval" in result.output
+
+
+def test_status_offline_after_prefetch(fake_api, tmp_path, monkeypatch):
+    from upsint.core import App
+    from upsint.transport import uninstall_transport
+    from tests.test_integration import initiate_git_repo
+
+    project = "/api/v4/projects/packit%2Fupsint"
+    merge_request = {
+        "iid": 7,
+        "title": "Feature",
+        "description": "Adds the feature.",
+        "author": {"username": "packit"},
+        "source_branch": "feature",
+        "state": "opened",
+        "sha": "b" * 40,
+    }
+    documents = {
+        "/api/v4/user": {"id": 1, "username": "packit"},
+        project: {
+            "id": 1,
+            "path_with_namespace": "packit/upsint",
+            "default_branch": "main",
+        },
+        f"{project}/issues_statistics": {"statistics": {"counts": {"opened": 0}}},
+        f"{project}/releases": [],
+        f"{project}/labels": [],
+        f"{project}/repository/tags": [],
+        f"{project}/merge_requests": [merge_request],
+        # python-gitlab gets the merge request via the id of the project
+        "/api/v4/projects/1/merge_requests/7": merge_request,
+        f"{project}/repository/commits/{'b' * 40}/statuses": [],
+    }
+    for path, document in documents.items():
+        fake_api.routes[("GET", path)] = lambda *_, document=document: (
+            200,
+            {},
+            document,
+        )
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.chdir(tmp_path)
+    initiate_git_repo(str(tmp_path))
+    subprocess.check_call(["git", "checkout", "-q", "-b", "feature"])
+
+    def create_app(**kwargs):
+        app = App(**kwargs)
+        app.conf._c = {
+            "authentication": {"gitlab": {"token": "abc", "instance_url": fake_api.url}}
+        }
+        monkeypatch.setattr(
+            app, "guess_remote_url", lambda: f"{fake_api.url}/packit/upsint"
+        )
+        return app
+
+    try:
+        result = CliRunner().invoke(upsint, ["prefetch"], obj=create_app())
+        assert result.exit_code == 0, result.output
+        sent = len(fake_api.requests)
+        result = CliRunner().invoke(
+            upsint, ["--offline", "status"], obj=create_app(offline=True)
+        )
+    finally:
+        uninstall_transport()
+    assert result.exit_code == 0, result.output
+    assert "#7 Feature, by @packit" in result.output
+    assert len(fake_api.requests) == sent
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+
+import pytest
+
+from upsint import conf
+from upsint.conf import Conf, merge_config
+
+
+@pytest.fixture()
+def config_files(tmp_path, monkeypatch):
+    user, packit = tmp_path / "upsint.yaml", tmp_path / "packit.yaml"
+    monkeypatch.setattr(conf, "CONFIG_FILE_CANDIDATES", (str(user), str(packit)))
+    return user, packit
+
+
+def test_merge_config():
+    base = {"authentication": {"github.com": {"token": "a"}}, "cache": {"ttl": 1}}
+    override = {"authentication": {"gitlab.com": {"token": "b"}}, "cache": None}
+    assert merge_config(base, override) == {
+        "authentication": {"github.com": {"token": "a"}, "gitlab.com": {"token": "b"}},
+        "cache": None,
+    }
+
+
+def test_config_files_are_merged(config_files, tmp_path):
+    user, packit = config_files
+    user.write_text("authentication:\n  github.com:\n    token: a\ncache:\n  ttl: 5\n")
+    packit.write_text("authentication:\n  github.com:\n    token: b\n")
+    c = Conf(cache_path=tmp_path / "config.json")
+    assert c.get_auth_configuration() == {"github.com": {"token": "b"}}
+    assert c.get_cache_configuration() == {"ttl": 5}
+
+
+def test_compiled_config_is_validated(config_files, tmp_path, monkeypatch):
+    user, _ = config_files
+    user.write_text("cache:\n  ttl: 5\n")
+    cache_path = tmp_path / "config.json"
+    assert Conf(cache_path=cache_path).get_cache_configuration() == {"ttl": 5}
+    assert os.stat(cache_path).st_mode & 0o777 == 0o600
+
+    loaded = []
+    load_config_file = conf.load_config_file
+    monkeypatch.setattr(
+        conf, "load_config_file", lambda p: loaded.append(p) or load_config_file(p)
+    )
+    assert Conf(cache_path=cache_path).get_cache_configuration() == {"ttl": 5}
+    assert loaded == []
+
+    user.write_text("cache:\n  ttl: 10\n")
+    assert Conf(cache_path=cache_path).get_cache_configuration() == {"ttl": 10}
+    assert loaded == [user]
+
+    user.unlink()
+    assert Conf(cache_path=cache_path).get_cache_configuration() == {}
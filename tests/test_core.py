@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import subprocess
+from pathlib import Path
+
+import pytest
+from ogr.abstract import PRStatus
+from ogr.services.github import GithubService
+from ogr.services.gitlab import GitlabService
+
+from upsint.cache import BranchPRIndex
+from upsint.core import App, get_config_hostname
+from upsint.exceptions import UpsintException
+from tests.test_changelog import FakeProject, FakePullRequest
+from tests.test_integration import cwd, initiate_git_repo
+
+AUTHENTICATION = {
+    "github.com": {"token": "a"},
+    "gitlab.com": {"token": "b"},
+    "gitlab.example.com": {
+        "token": "c",
+        "instance_url": "https://gitlab.example.com",
+    },
+    "pagure": {"token": "d", "instance_url": "https://pagure.io"},
+}
+
+
+def create_app():
+    app = App(use_cache=False)
+    app.conf._c = {"authentication": AUTHENTICATION}
+    return app
+
+
+def test_config_hostname():
+    assert [get_config_hostname(k, v) for k, v in AUTHENTICATION.items()] == [
+        "github.com",
+        "gitlab.com",
+        "gitlab.example.com",
+        "pagure.io",
+    ]
+    assert get_config_hostname("gitlab", {"token": "a"}) is None
+
+
+def test_only_the_used_service_is_created():
+    app = create_app()
+    project = app.get_git_project("https://gitlab.example.com/packit/upsint")
+    assert isinstance(project.service, GitlabService)
+    assert project.service.instance_url == "https://gitlab.example.com"
+    assert list(app._services) == ["gitlab.example.com"]
+
+    project = app.get_git_project("git@github.com:packit/upsint.git")
+    assert isinstance(project.service, GithubService)
+    assert app.get_git_project("https://github.com/packit/ogr").service is (
+        project.service
+    )
+    assert sorted(app._services) == ["github.com", "gitlab.example.com"]
+
+
+def test_unknown_hostname_falls_back_to_all_services():
+    app = create_app()
+    app.conf._c = {"authentication": {"gitlab": {"token": "a"}}}
+    project = app.get_git_project("https://gitlab.com/packit/upsint")
+    assert isinstance(project.service, GitlabService)
+
+
+def test_get_service_by_name():
+    app = create_app()
+    assert app.get_service("gitlab").instance_url == "https://gitlab.com"
+    assert app.get_service("gitlab.example.com").instance_url == (
+        "https://gitlab.example.com"
+    )
+    assert isinstance(app.get_service("github"), GithubService)
+    with pytest.raises(UpsintException):
+        app.get_service("bitbucket")
+
+
+def test_current_branch_pr_from_index(tmpdir):
+    with cwd(str(tmpdir)):
+        initiate_git_repo(str(tmpdir))
+        subprocess.check_call(["git", "checkout", "-q", "-b", "feature"])
+        app = App()
+        app.branch_pr_index = BranchPRIndex(path=Path(str(tmpdir)) / "index.json")
+        tip = subprocess.check_output(["git", "rev-parse", "HEAD"]).decode().strip()
+        app.branch_pr_index.set("/packit/upsint", "feature", tip, 12)
+
+        # FakeProject has no service: no other request can be made
+        project = FakeProject()
+        assert app.get_current_branch_pr(project).id == 12
+        assert project.requested == [12]
+
+
+def test_merged_pr_is_dropped_from_index(tmpdir, monkeypatch):
+    class User:
+        def get_username(self):
+            return "packit"
+
+    class Service:
+        user = User()
+
+    class MergedProject(FakeProject):
+        service = Service()
+
+        def get_pr(self, pr_id):
+            super().get_pr(pr_id)
+            return FakePullRequest(pr_id, status=PRStatus.merged)
+
+    searched = []
+    monkeypatch.setattr(
+        "upsint.forge.find_pr_by_branch",
+        lambda project, branch, username: searched.append((branch, username)),
+    )
+    with cwd(str(tmpdir)):
+        initiate_git_repo(str(tmpdir))
+        subprocess.check_call(["git", "checkout", "-q", "-b", "feature"])
+        app = App()
+        app.branch_pr_index = BranchPRIndex(path=Path(str(tmpdir)) / "index.json")
+        tip = subprocess.check_output(["git", "rev-parse", "HEAD"]).decode().strip()
+        app.branch_pr_index.set("/packit/upsint", "feature", tip, 12)
+
+        assert app.get_current_branch_pr(MergedProject()) is None
+        assert searched == [("feature", "packit")]
+        assert app.branch_pr_index.get("/packit/upsint", "feature", tip) is None
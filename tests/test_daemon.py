@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import io
+import json
+import socket
+import threading
+
+import pytest
+
+from upsint.daemon import Daemon, is_forwardable, run_in_daemon
+from upsint.exceptions import UpsintException
+from tests.test_integration import cwd, initiate_git_repo
+
+
+@pytest.fixture()
+def daemon(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    server = Daemon(socket_path=tmp_path / "upsint.sock")
+    thread = threading.Thread(target=server.serve, args=(server.bind(),))
+    thread.start()
+    yield server
+    server.stop()
+    thread.join(timeout=10)
+    assert not server.socket_path.exists()
+
+
+def run(daemon, args):
+    stdout, stderr = io.StringIO(), io.StringIO()
+    code = run_in_daemon(args, daemon.socket_path, stdout=stdout, stderr=stderr)
+    return code, stdout.getvalue(), stderr.getvalue()
+
+
+def test_is_forwardable():
+    assert is_forwardable(["list-branches", "--merged-with", "master"])
+    assert not is_forwardable(["status", "--watch"])
+    assert not is_forwardable(["--no-cache", "list-prs"])
+    assert not is_forwardable(["create-pr"])
+    assert not is_forwardable(["list-prs", "--repos-file", "-"])
+    assert not is_forwardable([])
+
+
+def test_command_runs_in_daemon(daemon, tmpdir):
+    with cwd(str(tmpdir)):
+        initiate_git_repo(str(tmpdir))
+        args = ["list-branches", "--merged-with", "master", "--output", "tsv"]
+        code, stdout, stderr = run(daemon, args)
+        assert (code, stderr) == (0, "")
+        assert sorted(line.split("\t")[0] for line in stdout.splitlines()) == [
+            "branch",
+            "master",
+        ]
+        app = daemon.app
+        assert run(daemon, args)[1] == stdout
+        # the App stays warm between the invocations
+        assert daemon.app is app
+
+
+def test_errors_are_forwarded(daemon, tmpdir):
+    with cwd(str(tmpdir)):
+        initiate_git_repo(str(tmpdir))
+        code, _, stderr = run(daemon, ["list-branches", "--limit", "0"])
+        assert code == 2
+        assert "Invalid value for '--limit'" in stderr
+
+
+def test_no_daemon(tmp_path):
+    assert run_in_daemon(["list-prs"], tmp_path / "missing.sock") is None
+
+
+def test_single_daemon(daemon):
+    with pytest.raises(UpsintException):
+        Daemon(socket_path=daemon.socket_path).bind()
+
+
+def test_daemon_refuses_other_commands(daemon, tmp_path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(str(daemon.socket_path))
+    with client, client.makefile("rwb") as connection:
+        request = {"args": ["remove-merged-branches"], "cwd": str(tmp_path)}
+        connection.write(json.dumps(request).encode() + b"\n")
+        connection.flush()
+        messages = [json.loads(line) for line in connection]
+    assert "read-only commands" in messages[0]["stderr"]
+    assert messages[-1] == {"exit": 2}
+    assert daemon.app is None
+
+
+@pytest.mark.parametrize("line", [b"garbage\n", b"[1]\n", b'{"args": \n'])
+def test_daemon_survives_malformed_requests(daemon, tmpdir, line):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(str(daemon.socket_path))
+    with client, client.makefile("rwb") as connection:
+        connection.write(line)
+        connection.flush()
+        messages = [json.loads(line) for line in connection]
+    assert "Malformed request" in messages[0]["stderr"]
+    assert messages[-1] == {"exit": 2}
+
+    with cwd(str(tmpdir)):
+        initiate_git_repo(str(tmpdir))
+        assert run(daemon, ["list-branches", "--merged-with", "master"])[0] == 0
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import threading
+from itertools import islice
+
+import github
+import pytest
+from ogr.abstract import CommitStatus
+from ogr.services.github import GithubProject, GithubService
+from ogr.services.gitlab import GitlabProject, GitlabService
+
+from upsint import forge
+from upsint.cache import HTTPCache, install_http_cache, uninstall_http_cache
+from upsint.forge import find_pr_by_branch, get_project_summary
+
+GITLAB_PROJECT = "/api/v4/projects/packit%2Fupsint"
+
+
+@pytest.fixture()
+def github_project(fake_api, monkeypatch):
+    monkeypatch.setattr(forge, "GITHUB_API_URL", fake_api.url)
+    service = GithubService(token="abc")
+    project = GithubProject(repo="upsint", service=service, namespace="packit")
+    # PyGithub doesn't know about GITHUB_API_URL
+    project._github_instance = github.Github(
+        auth=github.Auth.Token("abc"), base_url=fake_api.url
+    )
+    return project
+
+
+@pytest.fixture()
+def gitlab_project(fake_api):
+    fake_api.routes[("GET", "/api/v4/user")] = lambda *_: (
+        200,
+        {},
+        {"id": 1, "username": "packit"},
+    )
+    service = GitlabService(token="abc", instance_url=fake_api.url)
+    return GitlabProject(repo="upsint", service=service, namespace="packit")
+
+
+def test_github_project_summary(fake_api, github_project):
+    def graphql(query, payload, headers):
+        assert headers["Authorization"] == "bearer abc"
+        assert payload["variables"] == {"owner": "packit", "name": "upsint"}
+        repository = {
+            "issues": {"totalCount": 1234},
+            "pullRequests": {"totalCount": 56},
+            "latestRelease": {"name": None, "tagName": "0.1.0"},
+        }
+        return 200, {}, {"data": {"repository": repository}}
+
+    fake_api.routes[("POST", "/graphql")] = graphql
+    summary = get_project_summary(github_project)
+    assert (summary.open_issues, summary.open_prs) == (1234, 56)
+    assert summary.latest_release == "0.1.0"
+    assert len(fake_api.requests) == 1
+
+
+def test_gitlab_project_summary(fake_api, gitlab_project):
+    fake_api.routes[("GET", f"{GITLAB_PROJECT}/issues_statistics")] = lambda *_: (
+        200,
+        {},
+        {"statistics": {"counts": {"all": 30, "closed": 20, "opened": 10}}},
+    )
+    fake_api.routes[("GET", f"{GITLAB_PROJECT}/merge_requests")] = lambda query, *_: (
+        200,
+        {"X-Total": "42", "X-Per-Page": query["per_page"][0]},
+        [{"iid": 1}],
+    )
+    fake_api.routes[("GET", f"{GITLAB_PROJECT}/releases")] = lambda *_: (
+        200,
+        {},
+        [{"name": "upsint 1.0", "tag_name": "1.0"}],
+    )
+    summary = get_project_summary(gitlab_project)
+    assert (summary.open_issues, summary.open_prs) == (10, 42)
+    assert summary.latest_release == "upsint 1.0"
+    # the project itself is never fetched
+    assert {path for _, path, _ in fake_api.requests} == {
+        "/api/v4/user",
+        f"{GITLAB_PROJECT}/issues_statistics",
+        f"{GITLAB_PROJECT}/merge_requests",
+        f"{GITLAB_PROJECT}/releases",
+    }
+
+
+def test_find_gitlab_mr_by_branch(fake_api, gitlab_project):
+    def merge_requests(query, *_):
+        assert query["source_branch"] == ["feature"]
+        assert query["author_username"] == ["packit"]
+        return 200, {}, [{"iid": 7, "title": "Feature", "source_branch": "feature"}]
+
+    fake_api.routes[("GET", f"{GITLAB_PROJECT}/merge_requests")] = merge_requests
+    pr = find_pr_by_branch(gitlab_project, "feature", "packit")
+    assert (pr.id, pr.title) == (7, "Feature")
+    assert [path for _, path, _ in fake_api.requests][-1] == (
+        f"{GITLAB_PROJECT}/merge_requests"
+    )
+
+
+def test_find_github_pr_by_branch(fake_api, github_project):
+    def pulls(query, *_):
+        assert query["state"] == ["open"]
+        if query["head"] != ["packit:feature"]:
+            # the user's fork doesn't have the branch
+            return 200, {}, []
+        return (
+            200,
+            {},
+            [
+                {"number": 5, "title": "Theirs", "user": {"login": "someone"}},
+                {"number": 6, "title": "Mine", "user": {"login": "me"}},
+            ],
+        )
+
+    fake_api.routes[("GET", "/repos/packit/upsint/pulls")] = pulls
+    pr = find_pr_by_branch(github_project, "feature", "me")
+    assert (pr.id, pr.title) == (6, "Mine")
+    assert find_pr_by_branch(github_project, "feature", "nobody") is None
+
+
+def test_github_commit_checks(fake_api, github_project):
+    commit = "a" * 40
+    prefix = f"/repos/packit/upsint/commits/{commit}"
+    fake_api.routes[("GET", f"{prefix}/status")] = lambda *_: (
+        200,
+        {},
+        {
+            "state": "pending",
+            "statuses": [
+                {
+                    "context": "copr",
+                    "state": "pending",
+                    "description": "building",
+                    "target_url": "https://copr",
+                }
+            ],
+        },
+    )
+
+    def check_runs(query, *_):
+        assert query["filter"] == ["latest"]
+        runs = [
+            {
+                "name": "tests",
+                "status": "completed",
+                "conclusion": "failure",
+                "output": {"title": "2 failed"},
+                "html_url": "https://ci/1",
+            },
+            {
+                "name": "lint",
+                "status": "in_progress",
+                "conclusion": None,
+                "output": {"title": None},
+                "html_url": "https://ci/2",
+            },
+        ]
+        return 200, {}, {"total_count": 2, "check_runs": runs}
+
+    fake_api.routes[("GET", f"{prefix}/check-runs")] = check_runs
+    checks = forge.get_commit_checks(github_project, commit)
+    assert [(c.context, c.state, c.description) for c in checks] == [
+        ("copr", CommitStatus.pending, "building"),
+        ("tests", CommitStatus.failure, "2 failed"),
+        ("lint", CommitStatus.running, ""),
+    ]
+    assert len(fake_api.requests) == 2
+
+
+def test_gitlab_commit_checks(fake_api, gitlab_project):
+    commit = "b" * 40
+
+    def statuses(query, *_):
+        assert "all" not in query
+        status = {
+            "name": "build",
+            "status": "success",
+            "description": None,
+            "target_url": "https://ci/3",
+        }
+        return 200, {}, [status]
+
+    fake_api.routes[
+        ("GET", f"{GITLAB_PROJECT}/repository/commits/{commit}/statuses")
+    ] = statuses
+    checks = forge.get_commit_checks(gitlab_project, commit)
+    assert [(c.context, c.state, c.url) for c in checks] == [
+        ("build", CommitStatus.success, "https://ci/3")
+    ]
+
+
+def test_watch_commit_checks(fake_api, github_project, tmp_path):
+    commit = "c" * 40
+    prefix = f"/repos/packit/upsint/commits/{commit}"
+    states = iter(["pending", "pending", "pending", "success"])
+    fake_api.routes[("GET", f"{prefix}/check-runs")] = lambda *_: (
+        200,
+        {},
+        {"check_runs": []},
+    )
+
+    def combined_status(query, payload, headers):
+        state = next(states)
+        if headers.get("If-None-Match") == f'"{state}"':
+            return 304, {"ETag": f'"{state}"'}, None
+        statuses = [
+            {"context": "ci", "state": state, "description": "", "target_url": ""}
+        ]
+        return 200, {"ETag": f'"{state}"'}, {"statuses": statuses}
+
+    fake_api.routes[("GET", f"{prefix}/status")] = combined_status
+    cache = HTTPCache(path=tmp_path / "http.sqlite", ttl=0)
+    install_http_cache(cache)
+    delays = []
+    try:
+        polls = list(
+            forge.watch_commit_checks(
+                github_project, commit, interval=1, max_interval=3, sleep=delays.append
+            )
+        )
+    finally:
+        uninstall_http_cache()
+
+    assert [[c.state for c in changed] for changed in polls] == [
+        [CommitStatus.pending],
+        [CommitStatus.success],
+    ]
+    assert delays == [1, 2, 3]
+    assert cache.revalidated >= 2
+
+
+def test_watch_waits_for_checks_to_appear(fake_api, gitlab_project):
+    commit = "d" * 40
+    build = {
+        "name": "build",
+        "status": "success",
+        "description": None,
+        "target_url": None,
+    }
+    polls = iter([[], [], [build]])
+    fake_api.routes[
+        ("GET", f"{GITLAB_PROJECT}/repository/commits/{commit}/statuses")
+    ] = lambda *_: (200, {}, next(polls))
+    delays = []
+    changes = list(
+        forge.watch_commit_checks(
+            gitlab_project, commit, interval=1, max_interval=3, sleep=delays.append
+        )
+    )
+    assert [[c.context for c in changed] for changed in changes] == [[], ["build"]]
+    assert delays == [2, 3]
+
+
+def test_matching_projects_are_listed_page_by_page(fake_api, gitlab_project):
+    def projects(query, *_):
+        assert query["include_subgroups"][0].lower() == "true"
+        assert query["per_page"] == ["100"]
+        if query.get("page") == ["2"]:
+            return 200, {}, [{"path_with_namespace": "packit/sub/upstream"}]
+        next_page = f"{fake_api.url}/api/v4/groups/packit/projects?page=2&per_page=100"
+        return (
+            200,
+            {"Link": f'<{next_page}>; rel="next"'},
+            [
+                {"path_with_namespace": "packit/upsint"},
+                {"path_with_namespace": "packit/ogr"},
+            ],
+        )
+
+    fake_api.routes[("GET", "/api/v4/groups/packit/projects")] = projects
+    service = gitlab_project.service
+    matching = forge.iter_matching_projects(
+        service, ["packit/*up*", "packit/upsint", "other/project"]
+    )
+    first = next(matching)
+    assert (first.namespace, first.repo) == ("packit", "upsint")
+    # only the first page was needed so far
+    assert [path for _, path, _ in fake_api.requests].count(
+        "/api/v4/groups/packit/projects"
+    ) == 1
+    assert [f"{p.namespace}/{p.repo}" for p in matching] == [
+        "packit/sub/upstream",
+        "other/project",
+    ]
+
+
+def test_listing_stops_with_the_last_page_needed(fake_api, gitlab_project):
+    def tags(query, *_):
+        assert query["per_page"] == ["100"]
+        page = int(query.get("page", ["1"])[0])
+        next_page = f"{fake_api.url}{GITLAB_PROJECT}/repository/tags?page={page + 1}"
+        return (
+            200,
+            {"Link": f'<{next_page}>; rel="next"'},
+            [{"name": f"{page}.{i}", "commit": {"id": f"{i}"}} for i in range(100)],
+        )
+
+    fake_api.routes[("GET", f"{GITLAB_PROJECT}/repository/tags")] = tags
+    fake_api.routes[("GET", f"{GITLAB_PROJECT}/merge_requests")] = lambda q, *_: (
+        200,
+        {},
+        [{"iid": 3, "title": "Stream", "web_url": "https://mr/3"}],
+    )
+    first = list(islice(forge.iter_tags(gitlab_project), 150))
+    assert (first[0].name, first[-1].name) == ("1.0", "2.49")
+    assert [path for _, path, _ in fake_api.requests].count(
+        f"{GITLAB_PROJECT}/repository/tags"
+    ) == 2
+    (pr,) = forge.iter_pr_list(gitlab_project)
+    assert (pr.id, pr.title, pr.url) == (3, "Stream", "https://mr/3")
+    # no request for the project itself
+    assert GITLAB_PROJECT not in [path for _, path, _ in fake_api.requests]
+
+
+def test_pr_lists_are_fetched_at_once_and_merged(fake_api, gitlab_project):
+    # both listings have to be in flight at the same time to get through
+    barrier = threading.Barrier(2, timeout=5)
+
+    def merge_requests(repo, updated):
+        def handler(query, *_):
+            assert query["per_page"] == ["100"]
+            barrier.wait()
+            return (
+                200,
+                {},
+                [
+                    {"iid": i, "title": f"{repo} {i}", "updated_at": u}
+                    for i, u in enumerate(updated, start=1)
+                ],
+            )
+
+        return handler
+
+    for repo, updated in (
+        ("upsint", ["2020-01-03T10:00:00.000Z", "2020-01-01T10:00:00.000Z"]),
+        ("ogr", ["2020-01-02T10:00:00.000Z"]),
+    ):
+        fake_api.routes[("GET", f"/api/v4/projects/packit%2F{repo}/merge_requests")] = (
+            merge_requests(repo, updated)
+        )
+    fake_api.routes[("GET", "/api/v4/projects/packit%2Fgone/merge_requests")] = (
+        lambda *_: (404, {}, {"message": "404 Project Not Found"})
+    )
+    projects = [
+        GitlabProject(repo=repo, service=gitlab_project.service, namespace="packit")
+        for repo in ("upsint", "ogr", "gone")
+    ]
+
+    pr_lists = list(forge.iter_pr_lists(projects, jobs=3))
+    errors = {p.git_project.repo: p.error for p in pr_lists if p.error}
+    assert list(errors) == ["gone"]
+    assert [pr.title for _, pr in forge.merge_pr_lists(pr_lists)] == [
+        "upsint 1",
+        "ogr 1",
+        "upsint 2",
+    ]
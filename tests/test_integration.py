@@ -12,16 +12,27 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import datetime
+import io
 import os
 import subprocess
 from contextlib import contextmanager
 from pathlib import Path
 from typing import Union
 
+import pytest
+
+from upsint.core import App
+from upsint.exceptions import UpsintException
 from upsint.utils import (
     get_commits_in_range,
     get_commits_in_a_merge,
     get_commit_metadata,
+    get_merge_history,
+    iter_commits,
+    iter_local_branches,
+    list_local_branches,
+    parse_commit_log,
 )
 
 GIT_TAG = "0.1.0"
@@ -128,3 +139,129 @@ def test_get_commit_metadata(tmpdir):
             metadata.message
             == "Merge pull request #760 from jpopelka/specfile-add_patches"
         )
+
+
+def test_get_commit_metadata_parents(tmpdir):
+    with cwd(str(tmpdir)):
+        initiate_git_repo(str(tmpdir))
+        merge = get_commit_metadata("HEAD")
+        assert merge.is_merge
+        assert merge.parents == (
+            subprocess.check_output(["git", "show", "--quiet", "--format=%P", "HEAD"])
+            .decode()
+            .split()
+        )
+        assert not get_commit_metadata("HEAD^").is_merge
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64 * 1024])
+def test_parse_commit_log(chunk_size):
+    log = (
+        b"aaa\0ppp\0subject one\0body\nwith\n\nparagraphs\n\0"
+        b"bbb\0p1 p2\0subject two\0\0"
+        b"ccc\0\0root \xc5\xbe\0\0"
+    )
+    commits = list(parse_commit_log(io.BytesIO(log), chunk_size=chunk_size))
+    assert [c.hash for c in commits] == ["aaa", "bbb", "ccc"]
+    assert commits[0].body == "body\nwith\n\nparagraphs"
+    assert commits[1].parents == ["p1", "p2"]
+    assert commits[1].is_merge
+    assert commits[1].body == ""
+    assert commits[2].parents == []
+    assert commits[2].message == "root \u017e"
+
+
+def test_parse_commit_log_truncated():
+    with pytest.raises(UpsintException):
+        list(parse_commit_log(io.BytesIO(b"aaa\0ppp\0subject")))
+
+
+def test_iter_commits_matches_git(tmpdir):
+    with cwd(str(tmpdir)):
+        initiate_git_repo(str(tmpdir))
+        hashes = (
+            subprocess.check_output(["git", "log", "--pretty=format:%H"])
+            .decode()
+            .split()
+        )
+        assert [c.hash for c in iter_commits("HEAD")] == hashes
+
+
+def test_get_merge_history(tmpdir):
+    with cwd(str(tmpdir)):
+        initiate_git_repo(str(tmpdir))
+        history = get_merge_history(GIT_TAG)
+        assert len(history) == 2
+        (merge, merged), (line_1, nothing) = history
+        assert merge.message.startswith("Merge pull request #760")
+        assert [c.message for c in merged] == ["branch change #2", "branch change"]
+        assert [c.hash for c in merged] == get_commits_in_a_merge("HEAD")
+        assert line_1.message == "line 1"
+        assert nothing == []
+        assert get_merge_history("HEAD") == []
+
+
+def test_list_local_branches(tmpdir):
+    with cwd(str(tmpdir)):
+        initiate_git_repo(str(tmpdir))
+        subprocess.check_call(["git", "checkout", "-q", "-b", "unmerged"])
+        subprocess.check_call(
+            ["git", "commit", "-q", "--allow-empty", "-m", "not merged yet"]
+        )
+        subprocess.check_call(["git", "checkout", "-q", "master"])
+        branches = {b.name: b for b in list_local_branches("master")}
+        assert set(branches) == {"master", "branch", "unmerged"}
+        assert branches["master"].merged == "merged"
+        assert branches["branch"].merged == "merged"
+        assert branches["unmerged"].merged == ""
+        assert branches["unmerged"].remote_tracking == ""
+        assert branches["unmerged"].date.tzinfo is not None
+
+        with pytest.raises(subprocess.CalledProcessError):
+            list_local_branches("does-not-exist")
+
+
+def test_remove_branches(tmpdir):
+    with cwd(str(tmpdir)):
+        initiate_git_repo(str(tmpdir))
+        for name in ("one", "two", "moved"):
+            subprocess.check_call(["git", "branch", name, "master"])
+        subprocess.check_call(["git", "config", "branch.one.remote", "origin"])
+        expected = {
+            b.name: b.sha for b in list_local_branches("master") if b.name != "branch"
+        }
+        # "moved" is updated after we decided to remove it
+        subprocess.check_call(["git", "branch", "-f", "moved", "master^"])
+
+        failures = App().remove_branches(
+            ["one", "two", "moved", "master", "missing"], expected_commits=expected
+        )
+
+        assert set(failures) == {"moved", "master", "missing"}
+        assert "checked out" in failures["master"]
+        remaining = {b.name for b in list_local_branches("master")}
+        assert remaining == {"master", "branch", "moved"}
+        assert (
+            subprocess.call(["git", "config", "--get-regexp", r"^branch\.one\."]) == 1
+        )
+
+
+def test_iter_local_branches_most_recent_first(tmpdir):
+    with cwd(str(tmpdir)):
+        initiate_git_repo(str(tmpdir))
+        for idx, name in enumerate(("old", "new", "middle")):
+            date = f"2020-01-0{[1, 3, 2][idx]}T10:00:00+02:00"
+            subprocess.check_call(
+                ["git", "commit", "-q", "--allow-empty", "-m", name],
+                env={**os.environ, "GIT_AUTHOR_DATE": date},
+            )
+            subprocess.check_call(["git", "branch", name])
+            subprocess.check_call(["git", "reset", "-q", "--hard", "HEAD^"])
+
+        names = [b.name for b in iter_local_branches("master")]
+        assert names[-3:] == ["new", "middle", "old"]
+        assert [b.name for b in iter_local_branches("master", limit=2)] == names[:2]
+        old = list(iter_local_branches("master"))[-1]
+        assert old.date == datetime.datetime(
+            2020, 1, 1, 8, tzinfo=datetime.timezone.utc
+        )
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import threading
+
+import pytest
+from ogr.services.github import GithubProject, GithubService
+from ogr.services.gitlab import GitlabProject, GitlabService
+
+from upsint.labels import (
+    CREATE,
+    DELETE,
+    UPDATE,
+    Checkpoint,
+    LabelSyncer,
+    ProjectLabel,
+    plan_label_sync,
+)
+
+
+class FakeLabel:
+    def __init__(self, name, color="ff0000", description=None):
+        self.name, self.color, self.description = name, color, description
+
+
+SOURCE = [FakeLabel("bug"), FakeLabel("feature"), FakeLabel("Docs", "00ff00", "docs")]
+
+
+@pytest.fixture()
+def gitlab_service(fake_api):
+    fake_api.routes[("GET", "/api/v4/user")] = lambda *_: (200, {}, {"id": 1})
+    return GitlabService(token="abc", instance_url=fake_api.url)
+
+
+def test_plan_label_sync():
+    project = GithubProject(repo="upsint", namespace="packit", service=GithubService())
+    existing = [
+        ProjectLabel("bug", "FF0000"),
+        ProjectLabel("docs", "00ff00", "docs"),
+        ProjectLabel("wontfix", "ffffff"),
+    ]
+    plan = plan_label_sync(SOURCE, project, existing, prune=True)
+    assert [(op.action, op.name, op.new_name, op.color) for op in plan] == [
+        (CREATE, "feature", None, "ff0000"),
+        (UPDATE, "docs", "Docs", "00ff00"),
+        (DELETE, "wontfix", None, None),
+    ]
+    assert plan_label_sync(SOURCE[:1], project, existing) == []
+
+
+def test_labels_are_synced_to_many_destinations(fake_api, gitlab_service):
+    changes, in_flight, lock = [], [0], threading.Lock()
+
+    def add_routes(name, labels):
+        path = f"/api/v4/projects/packit%2F{name}/labels"
+        fake_api.routes[("GET", path)] = lambda *_: (200, {}, labels)
+
+        def change(method, label=None):
+            def handler(query, payload, headers):
+                with lock:
+                    in_flight[0] += 1
+                    assert in_flight[0] <= 2
+                changes.append((name, method, label or payload["name"], payload))
+                with lock:
+                    in_flight[0] -= 1
+                return 200, {}, dict(payload or {}, name=label or payload["name"])
+
+            return handler
+
+        fake_api.routes[("POST", path)] = change("create")
+        fake_api.routes[("PUT", path)] = change("update")
+        for label in labels:
+            fake_api.routes[("DELETE", f"{path}/{label['name']}")] = change(
+                "delete", label["name"]
+            )
+
+    add_routes(
+        "a",
+        [
+            {"name": "bug", "color": "#00FF00", "description": None},
+            {"name": "wontfix", "color": "#ffffff", "description": ""},
+        ],
+    )
+    add_routes("b", [])
+    add_routes(
+        "synced",
+        [
+            {"name": "bug", "color": "#FF0000", "description": ""},
+            {"name": "feature", "color": "#ff0000", "description": None},
+            {"name": "Docs", "color": "#00ff00", "description": "docs"},
+        ],
+    )
+    projects = [
+        GitlabProject(repo=repo, service=gitlab_service, namespace="packit")
+        for repo in ("a", "b", "synced", "missing")
+    ]
+    with LabelSyncer(jobs=4, host_jobs=2, prune=True) as syncer:
+        results = {r.destination: r for r in syncer.sync_many(SOURCE, projects)}
+
+    assert results["packit/a"].done == {CREATE: 2, UPDATE: 1, DELETE: 1}
+    assert results["packit/b"].done == {CREATE: 3}
+    assert results["packit/synced"].operations == []
+    assert results["packit/missing"].error
+    assert sorted((name, method, label) for name, method, label, _ in changes) == [
+        ("a", "create", "Docs"),
+        ("a", "create", "feature"),
+        ("a", "delete", "wontfix"),
+        ("a", "update", "bug"),
+        ("b", "create", "Docs"),
+        ("b", "create", "bug"),
+        ("b", "create", "feature"),
+    ]
+    # the destination in sync cost a single request
+    assert [
+        method for method, path, _ in fake_api.requests if "packit%2Fsynced" in path
+    ] == ["GET"]
+
+
+def test_dry_run_changes_nothing(fake_api, gitlab_service):
+    path = "/api/v4/projects/packit%2Fa/labels"
+    fake_api.routes[("GET", path)] = lambda *_: (200, {}, [])
+    project = GitlabProject(repo="a", service=gitlab_service, namespace="packit")
+    with LabelSyncer(dry_run=True) as syncer:
+        (result,) = syncer.sync_many(SOURCE, [project])
+    assert [op.action for op in result.operations] == [CREATE] * 3
+    assert result.done == {}
+    assert {method for method, _, _ in fake_api.requests} == {"GET"}
+
+
+def test_group_labels_are_kept(fake_api, gitlab_service):
+    path = "/api/v4/projects/packit%2Fa/labels"
+    # group labels are listed with the project labels, is_project_label tells them apart
+    labels = [
+        {"name": name, "color": color, "description": "", "is_project_label": own}
+        for name, color, own in (
+            ("bug", "#000000", False),
+            ("wontfix", "#ffffff", False),
+            ("feature", "#ff0000", True),
+        )
+    ]
+    fake_api.routes[("GET", path)] = lambda *_: (200, {}, labels)
+    fake_api.routes[("POST", path)] = lambda _, payload, __: (200, {}, payload)
+    project = GitlabProject(repo="a", service=gitlab_service, namespace="packit")
+    with LabelSyncer(prune=True) as syncer:
+        (result,) = syncer.sync_many(SOURCE, [project])
+    assert result.error is None
+    assert [(op.action, op.name) for op in result.operations] == [(CREATE, "Docs")]
+    assert [method for method, _, _ in fake_api.requests if method != "GET"] == ["POST"]
+
+
+def test_checkpoint(tmp_path):
+    checkpoint = Checkpoint(tmp_path / "labels.checkpoint")
+    checkpoint.add("packit/upsint")
+    checkpoint.add("packit/ogr")
+    resumed = Checkpoint(tmp_path / "labels.checkpoint")
+    assert "packit/ogr" in resumed
+    assert "packit/packit" not in resumed
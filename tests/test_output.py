@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import io
+import json
+from enum import Enum
+
+import pytest
+
+from upsint.output import get_writer, write_rows
+
+FIELDS = ("name", "state", "count")
+ROWS = [("1.0", None, 3), ("tab\there", "x,y", 0)]
+
+
+class State(Enum):
+    open = "open"
+
+
+def write(output, rows=ROWS, **kwargs):
+    stream = io.StringIO()
+    with get_writer(output, FIELDS, stream, **kwargs) as writer:
+        for row in rows:
+            writer.write(row)
+    return stream.getvalue()
+
+
+def test_json():
+    assert json.loads(write("json")) == [
+        {"name": "1.0", "state": None, "count": 3},
+        {"name": "tab\there", "state": "x,y", "count": 0},
+    ]
+    assert json.loads(write("json", rows=[])) == []
+
+
+def test_jsonl():
+    lines = write("jsonl", rows=[("1.0", State.open, 3), ("2.0", ["a", 1], 0)])
+    assert [json.loads(line) for line in lines.splitlines()] == [
+        {"name": "1.0", "state": "open", "count": 3},
+        {"name": "2.0", "state": ["a", 1], "count": 0},
+    ]
+    assert write("tsv", rows=[("2.0", ["a", "b"], 0)]) == "2.0\ta; b\t0\n"
+
+
+def test_csv():
+    assert write("csv") == 'name,state,count\r\n1.0,,3\r\ntab\there,"x,y",0\r\n'
+
+
+def test_tsv():
+    assert write("tsv") == "1.0\t\t3\ntab here\tx,y\t0\n"
+
+
+def test_rows_are_flushed_as_they_come():
+    flushed = []
+
+    class Stream(io.StringIO):
+        def flush(self):
+            flushed.append(self.getvalue().count("\n"))
+
+    writer = get_writer("jsonl", FIELDS, Stream(), flush_every=2)
+    for row in ROWS * 2:
+        writer.write(row)
+    assert flushed == [2, 4]
+
+
+def test_failed_listing_is_not_closed():
+    stream = io.StringIO()
+    with pytest.raises(RuntimeError):
+        with get_writer("json", FIELDS, stream) as writer:
+            writer.write(ROWS[0])
+            raise RuntimeError()
+    assert not stream.getvalue().rstrip().endswith("]")
+
+
+def test_empty_table(capsys):
+    write_rows(iter([]), FIELDS, "table", empty="No tags.")
+    assert capsys.readouterr().out == "No tags.\n"
+    write_rows(iter([("1.0", None, 3)]), FIELDS, "tsv")
+    assert capsys.readouterr().out == "1.0\t\t3\n"
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import pytest
+import requests
+
+from upsint.exceptions import RateLimitExceeded
+from upsint.ratelimit import RateLimiter
+from upsint.transport import Transport, install_transport, uninstall_transport
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 3))
+        self.now += seconds
+
+
+@pytest.fixture()
+def clock():
+    return FakeClock()
+
+
+def create_limiter(clock, **kwargs):
+    return RateLimiter(sleep=clock.sleep, clock=clock, **kwargs)
+
+
+def get_request(url="https://api.github.com/repos/packit/upsint"):
+    return requests.Request("GET", url, headers={"Authorization": "bearer a"}).prepare()
+
+
+def get_response(status=200, **headers):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update({k.replace("_", "-"): str(v) for k, v in headers.items()})
+    return response
+
+
+def test_secondary_limit_is_retried(fake_api, clock):
+    replies = iter([(429, {"Retry-After": "2"}), (200, {})])
+    fake_api.routes[("GET", "/user")] = lambda *_: next(replies) + ({},)
+    transport = Transport(rate_limiter=create_limiter(clock))
+    install_transport(transport)
+    try:
+        assert requests.get(f"{fake_api.url}/user").status_code == 200
+    finally:
+        uninstall_transport()
+    assert clock.sleeps == [2]
+    assert len(fake_api.requests) == 2
+
+
+def test_wait_for_reset(clock):
+    limiter = create_limiter(clock)
+    limiter.after_send(
+        get_request(),
+        get_response(
+            X_RateLimit_Limit=5000, X_RateLimit_Remaining=0, X_RateLimit_Reset=1030
+        ),
+    )
+    limiter.before_send(get_request())
+    assert clock.sleeps == [30]
+    # other resources and credentials have their own budget
+    limiter.before_send(get_request("https://api.github.com/graphql"))
+    assert clock.sleeps == [30]
+
+
+def test_long_wait_fails(clock):
+    limiter = create_limiter(clock, max_wait=60)
+    limiter.after_send(
+        get_request(),
+        get_response(
+            403, RateLimit_Limit=600, RateLimit_Remaining=0, RateLimit_Reset=2000
+        ),
+    )
+    with pytest.raises(RateLimitExceeded):
+        limiter.before_send(get_request())
+
+
+def test_requests_are_paced_when_budget_runs_low(clock):
+    limiter = create_limiter(clock)
+    limiter.after_send(
+        get_request(),
+        get_response(
+            X_RateLimit_Limit=100, X_RateLimit_Remaining=5, X_RateLimit_Reset=1050
+        ),
+    )
+    for _ in range(3):
+        limiter.before_send(get_request())
+    assert clock.sleeps == [10, 12.5]
+
+
+def test_max_requests(clock):
+    limiter = create_limiter(clock, max_requests=2)
+    with pytest.raises(RateLimitExceeded):
+        limiter.reserve(3)
+    limiter.reserve(2)
+    limiter.before_send(get_request())
+    limiter.before_send(get_request())
+    with pytest.raises(RateLimitExceeded):
+        limiter.before_send(get_request())
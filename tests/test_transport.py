@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import pytest
+import requests
+
+from upsint.cache import HTTPCache
+from upsint.transport import Transport, install_transport, uninstall_transport
+
+
+@pytest.fixture()
+def transport():
+    transport = Transport(pool_sizes={"127.0.0.1": 3}, read_timeout=5)
+    install_transport(transport)
+    yield transport
+    uninstall_transport()
+    transport.close()
+
+
+def test_sessions_share_connections(fake_api, transport):
+    headers = []
+    fake_api.routes[("GET", "/user")] = lambda query, payload, h: (
+        headers.append(h["Accept-Encoding"]) or (200, {}, {"login": "packit"})
+    )
+    timings = []
+    transport.add_hook(lambda request, response, elapsed: timings.append(elapsed))
+
+    for _ in range(2):
+        with requests.Session() as session:
+            session.headers["Accept-Encoding"] = None
+            assert session.get(f"{fake_api.url}/user").json() == {"login": "packit"}
+
+    assert len(timings) == transport.requests_sent == 2
+    assert headers == ["gzip, deflate"] * 2
+    (key,) = transport.poolmanager.pools.keys()
+    pool = transport.poolmanager.pools[key]
+    assert pool.num_connections == 1
+    assert pool.pool.maxsize == 3
+
+
+def test_cached_responses_are_not_sent(fake_api, transport, tmp_path):
+    transport.cache = HTTPCache(path=tmp_path / "http.sqlite")
+    fake_api.routes[("GET", "/labels")] = lambda *_: (200, {}, ["bug"])
+    assert requests.get(f"{fake_api.url}/labels").json() == ["bug"]
+    assert requests.get(f"{fake_api.url}/labels").json() == ["bug"]
+    assert transport.requests_sent == 1
+    assert len(fake_api.requests) == 1
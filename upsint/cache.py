@@ -0,0 +1,406 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Persistent cache of forge API responses.
+
+ogr and the libraries under it (PyGithub, python-gitlab) talk to the forges
+using requests, so the cache sits at the HTTP level: GET responses are stored
+in an SQLite database keyed by the URL (service + project + object)
+and the credentials used. Fresh entries are served without touching the network,
+stale ones are revalidated with If-None-Match/If-Modified-Since.
+GitHub GraphQL queries are read-only too, so they are stored keyed by the query.
+
+Offline, or when the forge can't be reached, whatever is in the cache is served
+regardless of its age; the age of the oldest response served is kept,
+so that the user can be told how old the data is.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Optional
+
+from upsint.constant import CACHE_DIR, CACHE_MAX_SIZE, CACHE_TTL
+from upsint.exceptions import OfflineError
+
+if TYPE_CHECKING:
+    # requests is imported only once there's something to send
+    import requests
+    from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+"""
+
+
+def get_cache_dir() -> Path:
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    if xdg_cache_home:
+        return Path(xdg_cache_home).joinpath("upsint")
+    return Path(CACHE_DIR).expanduser()
+
+
+@dataclass
+class CachedResponse:
+    key: str
+    url: str
+    headers: Dict[str, str]
+    body: bytes
+    stored_at: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.stored_at
+
+    def to_response(self, request: "requests.PreparedRequest") -> "requests.Response":
+        import requests
+        from requests.structures import CaseInsensitiveDict
+        from requests.utils import get_encoding_from_headers
+
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = CaseInsensitiveDict(self.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = self.url
+        response.request = request
+        response._content = self.body
+        return response
+
+
+class HTTPCache:
+    """
+    SQLite-backed cache of GET (and GraphQL) responses with TTL, LRU size eviction
+    and conditional revalidation.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        ttl: float = CACHE_TTL,
+        max_size: int = CACHE_MAX_SIZE,
+        offline: bool = False,
+    ):
+        """
+        :param offline: never send requests, serve cached responses of any age
+        """
+        self.path = path or get_cache_dir().joinpath("http.sqlite")
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.offline = offline
+        # seconds, the oldest response served offline or in place of a failed request
+        self.offline_age: Optional[float] = None
+        self._lock = threading.RLock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            # the connection is shared by the worker threads, guarded by the lock
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    @staticmethod
+    def is_cacheable(request: "requests.PreparedRequest") -> bool:
+        if request.method == "GET":
+            return True
+        if request.method != "POST" or not request.path_url.endswith("/graphql"):
+            return False
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        return b"mutation" not in body
+
+    @staticmethod
+    def get_key(request: "requests.PreparedRequest") -> str:
+        # responses differ per user, but we don't want to store tokens
+        credentials = "\n".join(
+            request.headers.get(h, "")
+            for h in ("Authorization", "Private-Token", "Accept")
+        )
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        digest = hashlib.sha256(credentials.encode() + b"\0" + body).hexdigest()[:16]
+        return f"{request.method} {request.url} {digest}"
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self.db.execute(
+                "SELECT url, headers, body, stored_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            self.db.commit()
+        url, headers, body, stored_at = row
+        return CachedResponse(
+            key=key,
+            url=url,
+            headers=json.loads(headers),
+            body=body,
+            stored_at=stored_at,
+        )
+
+    def store(self, key: str, response: "requests.Response"):
+        now = time.time()
+        body = response.content
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    response.url,
+                    json.dumps(dict(response.headers)),
+                    body,
+                    len(body),
+                    now,
+                    now,
+                ),
+            )
+            self.evict()
+            self.db.commit()
+
+    def refresh(self, key: str):
+        """ mark an entry as fresh after the server confirmed it did not change """
+        with self._lock:
+            self.db.execute(
+                "UPDATE responses SET stored_at = ? WHERE key = ?", (time.time(), key)
+            )
+            self.db.commit()
+
+    def evict(self):
+        """ drop least recently used entries until the cache fits max_size """
+        with self._lock:
+            (size,) = self.db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            if size <= self.max_size:
+                return
+            rows = self.db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at"
+            ).fetchall()
+            evicted = []
+            for key, entry_size in rows:
+                if size <= self.max_size:
+                    break
+                evicted.append((key,))
+                size -= entry_size
+            logger.debug("evicting %d entries from the HTTP cache", len(evicted))
+            self.db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def clear(self):
+        with self._lock:
+            self.db.execute("DELETE FROM responses")
+            self.db.commit()
+            self.db.execute("VACUUM")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, size = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "entries": entries,
+            "size": size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+        }
+
+    def _serve_offline(self, cached: CachedResponse, request):
+        with self._lock:
+            self.hits += 1
+            self.offline_age = max(self.offline_age or 0.0, cached.age)
+        self._log("served offline", request.url)
+        return cached.to_response(request)
+
+    def _log(self, event: str, url: str):
+        logger.debug(
+            "HTTP cache %s (hits=%d, revalidated=%d, misses=%d): %s",
+            event,
+            self.hits,
+            self.revalidated,
+            self.misses,
+            url,
+        )
+
+    def send(
+        self,
+        send,
+        adapter: "HTTPAdapter",
+        request: "requests.PreparedRequest",
+        **kwargs,
+    ):
+        """
+        Serve the request from the cache, revalidate it or send it and store the response.
+        A cached response of any age is served if the request can't be sent.
+
+        :param send: the original HTTPAdapter.send
+        :raises OfflineError: offline and the response is not cached
+        """
+        if (
+            not self.is_cacheable(request)
+            or kwargs.get("stream")
+            or "If-None-Match" in request.headers
+            or "If-Modified-Since" in request.headers
+        ):
+            if self.offline:
+                raise OfflineError(
+                    f"Can't send {request.method} {request.url} while offline."
+                )
+            return send(adapter, request, **kwargs)
+
+        key = self.get_key(request)
+        cached = self.get(key)
+        if self.offline:
+            if cached is None:
+                raise OfflineError(
+                    f"{request.url} is not in the cache, "
+                    f"run `upsint prefetch` for the project while online."
+                )
+            return self._serve_offline(cached, request)
+        if cached and cached.age < self.ttl:
+            self.hits += 1
+            self._log("hit", request.url)
+            return cached.to_response(request)
+
+        if cached:
+            etag = cached.headers.get("ETag")
+            last_modified = cached.headers.get("Last-Modified")
+            if etag:
+                request.headers["If-None-Match"] = etag
+            if last_modified:
+                request.headers["If-Modified-Since"] = last_modified
+
+        import requests
+
+        try:
+            response = send(adapter, request, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as ex:
+            if cached is None:
+                raise
+            logger.warning(
+                f"Can't reach {request.url}, using the cached response: {ex}"
+            )
+            return self._serve_offline(cached, request)
+        if cached and response.status_code == 304:
+            response.close()
+            self.revalidated += 1
+            self.refresh(key)
+            self._log("revalidated", request.url)
+            return cached.to_response(request)
+
+        self.misses += 1
+        self._log("miss", request.url)
+        if response.status_code == 200:
+            self.store(key, response)
+        return response
+
+
+def install_http_cache(cache: HTTPCache):
+    """
+    Route all requests made through requests' HTTPAdapter (and its subclasses)
+    via the cache. Any session created by ogr, PyGithub or python-gitlab is covered.
+    The cache is added to the installed transport or a default one is installed.
+    """
+    from upsint.transport import Transport, get_installed_transport, install_transport
+
+    transport = get_installed_transport() or Transport()
+    transport.cache = cache
+    install_transport(transport)
+
+
+def uninstall_http_cache():
+    """ stop routing the requests via the cache and the transport """
+    from upsint.transport import uninstall_transport
+
+    uninstall_transport()
+
+
+class BranchPRIndex:
+    """
+    Which pull request was opened from a local branch.
+
+    An entry is valid only as long as the branch points to the same commit
+    it pointed to when the pull request was found.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or get_cache_dir().joinpath("branch-prs.json")
+
+    def _load(self) -> Dict[str, Dict[str, Dict]]:
+        try:
+            return json.loads(self.path.read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, project: str, branch: str, tip: str) -> Optional[int]:
+        entry = self._load().get(project, {}).get(branch)
+        if entry and entry["tip"] == tip:
+            logger.debug("branch %s is PR #%s (index)", branch, entry["pr"])
+            return entry["pr"]
+        return None
+
+    def set(self, project: str, branch: str, tip: str, pr_id: int):
+        index = self._load()
+        index.setdefault(project, {})[branch] = {"tip": tip, "pr": pr_id}
+        self._save(index)
+
+    def delete(self, project: str, branch: str):
+        index = self._load()
+        if index.get(project, {}).pop(branch, None) is not None:
+            self._save(index)
+
+    def _save(self, index: Dict[str, Dict[str, Dict]]):
+        self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(index))
+        tmp.replace(self.path)
+
+    def clear(self):
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,476 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import logging
+import re
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from ogr.abstract import GitProject, PullRequest
+from ogr.services.github import GithubProject
+
+from upsint.cache import get_cache_dir
+from upsint.constant import DEFAULT_JOBS
+from upsint.exceptions import UpsintException
+from upsint.forge import GithubAPI, get_project_key
+from upsint.utils import CommitMetadata, get_merge_history, is_ancestor, rev_parse
+
+logger = logging.getLogger(__name__)
+
+MERGE_PR_RE = re.compile(r"Merge pull request #(\d+) from (\w+)/\w+")
+# GitHub limits the number of nodes a single GraphQL query can return
+GRAPHQL_BATCH_SIZE = 100
+
+
+CHANGELOG_SCHEMA = """
+DROP TABLE IF EXISTS entries;
+CREATE TABLE IF NOT EXISTS changes (
+    project TEXT NOT NULL,
+    sha TEXT NOT NULL,
+    change TEXT NOT NULL,
+    PRIMARY KEY (project, sha)
+);
+CREATE TABLE IF NOT EXISTS ranges (
+    project TEXT NOT NULL,
+    lower_bound TEXT NOT NULL,
+    tip TEXT NOT NULL,
+    shas TEXT NOT NULL,
+    PRIMARY KEY (project, lower_bound)
+);
+"""
+
+
+class ChangelogStore:
+    """
+    Changelog entries keyed by commit hash, stored as JSON.
+
+    Merged commits are immutable, so once an entry is resolved, it never changes.
+    For every lower bound, we also remember the newest processed commit (tip)
+    and the list of first-parent commits up to it, so the next run only walks
+    the commits on top of the tip.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or get_cache_dir().joinpath("changelog.sqlite")
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._db.executescript(CHANGELOG_SCHEMA)
+        return self._db
+
+    def get_entries(
+        self, project: str, shas: Iterable[str]
+    ) -> Dict[str, "ChangelogEntry"]:
+        shas = list(shas)
+        entries: Dict[str, ChangelogEntry] = {}
+        with self._lock:
+            # stay below the limit of SQL variables
+            for start in range(0, len(shas), 500):
+                end = start + 500
+                chunk = shas[start:end]
+                entries.update(
+                    (sha, ChangelogEntry(**json.loads(change)))
+                    for sha, change in self.db.execute(
+                        "SELECT sha, change FROM changes WHERE project = ? "
+                        f"AND sha IN ({', '.join('?' * len(chunk))})",
+                        (project, *chunk),
+                    ).fetchall()
+                )
+        return entries
+
+    def set_entries(self, project: str, entries: Dict[str, "ChangelogEntry"]):
+        with self._lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO changes VALUES (?, ?, ?)",
+                (
+                    (project, sha, json.dumps(asdict(entry)))
+                    for sha, entry in entries.items()
+                ),
+            )
+            self.db.commit()
+
+    def get_range(
+        self, project: str, lower_bound: str
+    ) -> Optional[Tuple[str, List[str]]]:
+        """
+        :param lower_bound: hash of the lower bound commit
+        :return: (tip, first-parent commits from tip down to lower_bound) or None
+        """
+        with self._lock:
+            row = self.db.execute(
+                "SELECT tip, shas FROM ranges WHERE project = ? AND lower_bound = ?",
+                (project, lower_bound),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def set_range(self, project: str, lower_bound: str, tip: str, shas: List[str]):
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO ranges VALUES (?, ?, ?, ?)",
+                (project, lower_bound, tip, json.dumps(shas)),
+            )
+            self.db.commit()
+
+    def clear(self):
+        with self._lock:
+            self.db.execute("DELETE FROM changes")
+            self.db.execute("DELETE FROM ranges")
+            self.db.commit()
+
+
+class PullRequestResolver:
+    """
+    Fetch pull requests in a bounded pool of threads so the requests
+    don't wait for each other.
+    """
+
+    def __init__(self, git_project: GitProject, jobs: int = DEFAULT_JOBS):
+        self.git_project = git_project
+        self.executor = ThreadPoolExecutor(
+            max_workers=jobs, thread_name_prefix="upsint-pr"
+        )
+
+    def submit(self, pr_id: int) -> "Future[ResolvedPullRequest]":
+        logger.debug("resolving PR #%s", pr_id)
+        return self.executor.submit(self._get_pr, pr_id)
+
+    def _get_pr(self, pr_id: int) -> "ResolvedPullRequest":
+        return self.git_project.get_pr(pr_id)
+
+    def flush(self):
+        """ make sure all the submitted pull requests are being fetched """
+
+    def estimate_requests(self, count: int) -> int:
+        """ how many API requests fetching this many pull requests takes """
+        return count
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+@dataclass
+class PullRequestInfo:
+    """ the subset of a pull request a changelog needs """
+
+    id: int
+    title: str
+    description: str
+    author: str
+    merge_commit_sha: Optional[str]
+
+
+# what the resolvers return, both have all render_entry needs
+ResolvedPullRequest = Union[PullRequest, PullRequestInfo]
+
+
+class GithubPullRequestResolver(PullRequestResolver):
+    """
+    Fetch pull requests from GitHub in batches, using a single GraphQL query
+    for up to GRAPHQL_BATCH_SIZE of them.
+    """
+
+    query_template = (
+        "query($owner: String!, $name: String!) {{ "
+        "repository(owner: $owner, name: $name) {{ {fields} }} }}"
+    )
+    pr_template = (
+        "pr{id}: pullRequest(number: {id}) "
+        "{{ number title body author {{ login }} mergeCommit {{ oid }} }}"
+    )
+
+    def __init__(
+        self,
+        git_project: GithubProject,
+        jobs: int = DEFAULT_JOBS,
+        api: Optional[GithubAPI] = None,
+        batch_size: int = GRAPHQL_BATCH_SIZE,
+    ):
+        super().__init__(git_project, jobs=jobs)
+        self.api = api or GithubAPI.from_project(git_project)
+        self.batch_size = batch_size
+        self.pending: Dict[int, "Future[ResolvedPullRequest]"] = {}
+        self.futures: Dict[int, "Future[ResolvedPullRequest]"] = {}
+
+    def submit(self, pr_id: int) -> "Future[ResolvedPullRequest]":
+        if pr_id in self.futures:
+            return self.futures[pr_id]
+        future: "Future[ResolvedPullRequest]" = Future()
+        self.futures[pr_id] = self.pending[pr_id] = future
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        return future
+
+    def estimate_requests(self, count: int) -> int:
+        return -(-count // self.batch_size)
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        logger.debug("resolving %d PRs in a single query", len(batch))
+        self.executor.submit(self._fetch_batch, batch)
+
+    def _fetch_batch(self, batch: Dict[int, "Future[ResolvedPullRequest]"]):
+        try:
+            self._resolve_batch(batch)
+        except Exception as ex:
+            # nobody would ever wake up the callers waiting for the rest
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(ex)
+
+    def _resolve_batch(self, batch: Dict[int, "Future[ResolvedPullRequest]"]):
+        query = self.query_template.format(
+            fields=" ".join(self.pr_template.format(id=pr_id) for pr_id in batch)
+        )
+        result = self.api.graphql(
+            query,
+            {"owner": self.git_project.namespace, "name": self.git_project.repo},
+        )
+        repository = result["data"]["repository"]
+        if repository is None:
+            # the repository doesn't exist or the token can't read it
+            raise UpsintException(
+                f"Repository {self.git_project.namespace}/{self.git_project.repo} "
+                f"not found: {result.get('errors')}"
+            )
+        for pr_id, future in batch.items():
+            raw = repository.get(f"pr{pr_id}")
+            if raw is None:
+                future.set_exception(
+                    UpsintException(f"PR #{pr_id} not found: {result.get('errors')}")
+                )
+                continue
+            future.set_result(
+                PullRequestInfo(
+                    id=raw["number"],
+                    title=raw["title"],
+                    description=raw["body"],
+                    # author is null for deleted accounts
+                    author=(raw["author"] or {}).get("login", "ghost"),
+                    merge_commit_sha=(raw["mergeCommit"] or {}).get("oid"),
+                )
+            )
+
+
+def get_pr_resolver(git_project: GitProject, jobs: int = DEFAULT_JOBS):
+    """ pick the most efficient way to fetch pull requests of the project """
+    if isinstance(git_project, GithubProject):
+        return GithubPullRequestResolver(git_project, jobs=jobs)
+    return PullRequestResolver(git_project, jobs=jobs)
+
+
+@dataclass
+class ChangelogEntry:
+    """ what a first-parent commit changed """
+
+    commit: str
+    # title of the pull request or the commit message
+    subject: str
+    pr: Optional[int] = None
+    author: Optional[str] = None
+    description: Optional[str] = None
+    # messages of the commits the pull request brought in
+    commits: List[str] = field(default_factory=list)
+
+    def render(self, git_project: GitProject) -> str:
+        """ markdown """
+        if self.pr is None:
+            return f"* {self.subject}"
+        lines = [
+            f"* {self.subject}, by [@{self.author}](https://github.com/{self.author}), "
+            f"[#{self.pr}](https://github.com/{git_project.namespace}"
+            f"/{git_project.repo}/pull/{self.pr})",
+            f"  * description: {self.description!r}",
+        ]
+        lines += [f"  * commit: {message}" for message in self.commits]
+        return "\n".join(lines)
+
+
+def get_entry(
+    commit: CommitMetadata,
+    merged_commits: List[CommitMetadata],
+    pr: Optional[ResolvedPullRequest] = None,
+) -> ChangelogEntry:
+    """
+    :param commit: the first-parent commit
+    :param merged_commits: commits brought in by the commit
+    :param pr: the pull request, if the commit is a merge of one
+    """
+    match = MERGE_PR_RE.match(commit.message)
+    if not match or pr is None:
+        return ChangelogEntry(commit.hash, commit.message)
+    pr_id, author = match.groups()
+    return ChangelogEntry(
+        commit.hash,
+        commit.body,
+        pr=int(pr_id),
+        author=author,
+        description=pr.description,
+        commits=[m.message for m in merged_commits],
+    )
+
+
+def render_entry(
+    git_project: GitProject,
+    commit: CommitMetadata,
+    merged_commits: List[CommitMetadata],
+    pr: Optional[ResolvedPullRequest] = None,
+) -> str:
+    """
+    render a changelog entry for a single first-parent commit
+
+    :param commit: the first-parent commit
+    :param merged_commits: commits brought in by the commit
+    :param pr: the pull request, if the commit is a merge of one
+    :return: markdown
+    """
+    return get_entry(commit, merged_commits, pr).render(git_project)
+
+
+def _resolve_history(
+    git_project: GitProject,
+    history: List[Tuple[CommitMetadata, List[CommitMetadata]]],
+    jobs: int,
+    known: Dict[str, ChangelogEntry],
+    reserve: Optional[Callable[[int], None]] = None,
+) -> Iterator[ChangelogEntry]:
+    """ resolve the entries which are not `known` yet, yield all in the history order """
+    with get_pr_resolver(git_project, jobs=jobs) as resolver:
+        pr_ids = {}
+        for commit, _ in history:
+            match = None if commit.hash in known else MERGE_PR_RE.match(commit.message)
+            if match:
+                pr_ids[commit.hash] = int(match.group(1))
+        if reserve:
+            reserve(resolver.estimate_requests(len(set(pr_ids.values()))))
+
+        pending = []
+        for commit, merged_commits in history:
+            pr_id = pr_ids.get(commit.hash)
+            future = resolver.submit(pr_id) if pr_id is not None else None
+            pending.append((commit, merged_commits, future))
+        resolver.flush()
+
+        for commit, merged_commits, future in pending:
+            if commit.hash in known:
+                yield known[commit.hash]
+                continue
+            pr = future.result() if future else None
+            yield get_entry(commit, merged_commits, pr=pr)
+
+
+def generate_changelog(
+    git_project: GitProject,
+    lower_bound: str,
+    upper_bound: str = "HEAD",
+    jobs: int = DEFAULT_JOBS,
+    store: Optional[ChangelogStore] = None,
+    reserve: Optional[Callable[[int], None]] = None,
+) -> Iterator[str]:
+    """
+    Produce changelog entries for a range of commits, newest first.
+
+    Pull requests are fetched concurrently as soon as the merge commits are found,
+    the entries are still yielded in the history order.
+
+    :param git_project: project where the pull requests live
+    :param lower_bound: commits starting here
+    :param upper_bound: and ending here
+    :param jobs: how many pull requests can be fetched at the same time
+    :param store: when set, reuse entries resolved previously
+                  and process only commits on top of the last processed one
+    :param reserve: called with the number of API requests needed
+                    before any of them is sent
+    :return: generator of rendered entries
+    """
+    for entry in iter_changelog(
+        git_project, lower_bound, upper_bound, jobs=jobs, store=store, reserve=reserve
+    ):
+        yield entry.render(git_project)
+
+
+def iter_changelog(
+    git_project: GitProject,
+    lower_bound: str,
+    upper_bound: str = "HEAD",
+    jobs: int = DEFAULT_JOBS,
+    store: Optional[ChangelogStore] = None,
+    reserve: Optional[Callable[[int], None]] = None,
+) -> Iterator[ChangelogEntry]:
+    """
+    like generate_changelog, but yield the entries as data
+    """
+    if store is None:
+        history = get_merge_history(lower_bound=lower_bound, upper_bound=upper_bound)
+        yield from _resolve_history(
+            git_project, history, jobs, known={}, reserve=reserve
+        )
+        return
+
+    project = get_project_key(git_project)
+    lower_sha, upper_sha = rev_parse(lower_bound), rev_parse(upper_bound)
+    cached_range = store.get_range(project, lower_sha)
+    walk_from = lower_sha
+    cached_shas: List[str] = []
+    cached_entries: Dict[str, ChangelogEntry] = {}
+    if cached_range and is_ancestor(cached_range[0], upper_sha):
+        cached_entries = store.get_entries(project, cached_range[1])
+        # the entries could have been removed from the store meanwhile
+        if len(cached_entries) == len(cached_range[1]):
+            walk_from, cached_shas = cached_range
+            logger.debug(
+                "reusing %d changelog entries up to %s", len(cached_shas), walk_from
+            )
+
+    history = get_merge_history(lower_bound=walk_from, upper_bound=upper_sha)
+    if cached_shas and history and history[-1][0].parents[:1] != [walk_from]:
+        # the tip was merged in from another branch: the cached entries
+        # are not the older part of the first-parent history of upper_sha
+        logger.debug("%s is not a first parent of %s", walk_from, upper_sha)
+        cached_shas, cached_entries = [], {}
+        history = get_merge_history(lower_bound=lower_sha, upper_bound=upper_sha)
+    new_shas = [commit.hash for commit, _ in history]
+    known = store.get_entries(project, new_shas)
+    new_entries: Dict[str, ChangelogEntry] = {}
+    for entry in _resolve_history(
+        git_project, history, jobs, known=known, reserve=reserve
+    ):
+        new_entries[entry.commit] = entry
+        yield entry
+    store.set_entries(project, new_entries)
+
+    for sha in cached_shas:
+        yield cached_entries[sha]
+    store.set_range(project, lower_sha, upper_sha, new_shas + cached_shas)
@@ -15,16 +15,26 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import functools
 import logging
-import re
+import signal
 import subprocess
 import sys
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING
 
 import click
-from ogr.abstract import CommitStatus
-from tabulate import tabulate
 
-from upsint.core import App
+from upsint.constant import (
+    DEFAULT_JOBS,
+    LABEL_HOST_JOBS,
+    OUTPUT_FORMATS,
+    PR_LIST_JOBS,
+    WATCH_INTERVAL,
+    WATCH_MAX_INTERVAL,
+)
+from upsint.exceptions import UpsintException
 from upsint.utils import (
     git_push,
     prompt_for_pr_content,
@@ -33,28 +43,104 @@ from upsint.utils import (
     set_origin_remote,
     clone_repo_and_cd_inside,
     set_upstream_remote,
-    get_commits_in_range,
-    get_commit_metadata,
-    get_commits_in_a_merge,
     assemble_pr_template,
 )
 
+if TYPE_CHECKING:
+    from ogr.abstract import GitProject, PullRequest
+
+    from upsint.core import App
+    from upsint.forge import CheckStatus
+
+# ogr, tabulate and the rest of the heavy modules are imported in the commands
+# which need them, so that local commands and --help start fast
+
 logger = logging.getLogger("upsint")
 
 
+def get_app(ctx: click.Context) -> "App":
+    """ App shared by the whole invocation, created on the first use """
+    root = ctx.find_root()
+    if root.obj is None:
+        from upsint.core import App
+
+        root.obj = App(
+            use_cache=not root.params.get("no_cache"),
+            max_requests=root.params.get("max_requests"),
+            offline=bool(root.params.get("offline")),
+        )
+    return root.obj
+
+
+def format_age(seconds: float) -> str:
+    for unit, size in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        if seconds >= size:
+            count = int(seconds // size)
+            return f"{count} {unit}{'s' if count > 1 else ''}"
+    return "less than a minute"
+
+
+def pass_app(f):
+    """ like click.pass_obj, but the App is created only if the command runs """
+
+    @click.pass_context
+    def new_func(ctx, *args, **kwargs):
+        app = get_app(ctx)
+        # the daemon keeps the App between the commands
+        app.reset_offline_age()
+        try:
+            return ctx.invoke(f, app, *args, **kwargs)
+        except UpsintException as ex:
+            raise click.ClickException(str(ex))
+        finally:
+            if app.offline_age is not None:
+                click.echo(
+                    f"Offline: data from the local cache, "
+                    f"up to {format_age(app.offline_age)} old.",
+                    err=True,
+                )
+
+    return functools.update_wrapper(new_func, f)
+
+
 @click.group()
-def upsint():
-    pass
+@click.option("--debug", "-d", is_flag=True, help="Show debug logs.")
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Don't use the local cache of responses from git forges.",
+)
+@click.option(
+    "--max-requests",
+    type=click.IntRange(min=0),
+    default=None,
+    help="Send at most this many requests to the forges. Commands which can "
+    "estimate their cost refuse to start if they'd need more.",
+)
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Don't contact the forges, answer from the local cache however old it is. "
+    "Without this, the cache is used as well when a forge can't be reached.",
+)
+@click.pass_context
+def upsint(ctx, debug, no_cache, max_requests, offline):
+    if offline and no_cache:
+        raise click.UsageError("--offline needs the cache, drop --no-cache.")
+    if debug:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(name)s %(levelname)s %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
 
 
 @click.command(name="fork")
 @click.argument("repo", type=click.STRING)
-def fork(repo):
+@pass_app
+def fork(app, repo):
     """
     Fork selected repository
     """
-    app = App()
-
     target_repo_org, target_repo_name = repo.split("/", 1)
     # let's default to github if there is only 1 slash in repo
 
@@ -84,15 +170,14 @@ def fork(repo):
 @click.command(name="create-pr")
 @click.argument("target_remote", type=click.STRING, required=False, default="upstream")
 @click.argument("target_branch", type=click.STRING, required=False, default=None)
-def create_pr(target_remote, target_branch):
+@pass_app
+def create_pr(app, target_remote, target_branch):
     """
     Create a pull or a merge request against upstream remote.
 
     The default projects's branch is used implicitly
     (which everyone can configure in their project settings).
     """
-    app = App()
-
     url = app.guess_remote_url()
     git_project = app.get_git_project(url)
 
@@ -129,29 +214,119 @@ def create_pr(target_remote, target_branch):
     print(pr.url)
 
 
+def limit_option(f):
+    return click.option(
+        "--limit",
+        type=click.IntRange(min=1),
+        default=None,
+        help="Show only this many, the rest is not fetched at all.",
+    )(f)
+
+
+PR_FIELDS = ("id", "title", "author", "url")
+PROJECT_PR_FIELDS = ("repository", "id", "title", "author", "url", "updated")
+BRANCH_FIELDS = ("name", "remote_tracking", "date", "tracking_status", "merged")
+LABEL_FIELDS = ("name", "color", "description")
+TAG_FIELDS = ("name", "commit")
+CHANGE_FIELDS = ("commit", "subject", "pr", "author", "description", "commits")
+CHECK_FIELDS = ("pr", "context", "state", "description", "url")
+SUMMARY_FIELDS = ("open_issues", "open_prs", "latest_release")
+
+
+def output_option(default: str = "table"):
+    return click.option(
+        "--output",
+        type=click.Choice([default, *OUTPUT_FORMATS]),
+        default=default,
+        show_default=True,
+        help="Machine-readable formats are printed row by row as they are fetched, "
+        "a table only once all is.",
+    )
+
+
 @click.command(
     name="list-prs",
-    help="List open pull requests in current git repository or the one you selected. "
-    "This is how you can select a repository for Github: <owner>/<project>.",
+    help="List open pull requests in current git repository or the ones you selected. "
+    "This is how you can select a repository for Github: <owner>/<project>. "
+    "Pull requests of several repositories, or of those in --repos-file, "
+    "are listed at once and merged into one list with the repository "
+    "and update time, recently updated first.",
 )
-@click.argument("repo", type=click.STRING, required=False)
-def list_prs(repo):
+@click.argument("repo", type=click.STRING, nargs=-1)
+@click.option(
+    "--repos-file",
+    type=click.File("r"),
+    default=None,
+    help="Also list the repositories in this file, one per line ('-' for stdin).",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=PR_LIST_JOBS,
+    show_default=True,
+    help="How many repositories to list concurrently.",
+)
+@limit_option
+@output_option()
+@pass_app
+def list_prs(app, repo, repos_file, jobs, limit, output):
     """
-    List pull requests of a selected repository, default to repo in $PWD
+    List pull requests of the selected repositories, default to repo in $PWD
     """
-    app = App()
-    url = repo or app.guess_remote_url()
-    git_project = app.get_git_project(url)
-    prs = git_project.get_pr_list()
-    if not prs:
-        print("No open pull requests.")
+    from upsint.forge import iter_pr_list, iter_pr_lists, merge_pr_lists
+    from upsint.output import write_rows
+
+    repos = list(repo)
+    if repos_file is not None:
+        lines = (line.split("#", 1)[0].strip() for line in repos_file)
+        repos += [line for line in lines if line]
+    # the same columns for a file of any length
+    if repos_file is not None or len(repos) > 1:
+        git_projects = [app.get_git_project(url) for url in dict.fromkeys(repos)]
+        pr_lists = list(iter_pr_lists(git_projects, limit=limit, jobs=jobs))
+        for pr_list in pr_lists:
+            if pr_list.error:
+                click.echo(
+                    f"Can't list pull requests of {pr_list.git_project.full_repo_name}: "
+                    f"{pr_list.error}",
+                    err=True,
+                )
+        prs = islice(merge_pr_lists(pr_lists), limit)
+        write_rows(
+            (get_project_pr_row(git_project, pr, output) for git_project, pr in prs),
+            PROJECT_PR_FIELDS,
+            output,
+            empty="No open pull requests.",
+        )
+        if any(pr_list.error for pr_list in pr_lists):
+            sys.exit(1)
         return
-    print(
-        tabulate(
-            [("#%s" % pr.id, pr.title, "@%s" % pr.author, pr.url) for pr in prs],
-            tablefmt="fancy_grid",
+
+    url = repos[0] if repos else app.guess_remote_url()
+    git_project = app.get_git_project(url)
+    prs = islice(iter_pr_list(git_project), limit)
+    if output == "table":
+        rows = (("#%s" % pr.id, pr.title, "@%s" % pr.author, pr.url) for pr in prs)
+    else:
+        rows = ((pr.id, pr.title, pr.author, pr.url) for pr in prs)
+    write_rows(rows, PR_FIELDS, output, empty="No open pull requests.")
+
+
+def get_project_pr_row(git_project: "GitProject", pr: "PullRequest", output: str):
+    from upsint.forge import get_pr_updated
+
+    updated = get_pr_updated(pr)
+    if output == "table":
+        return (
+            git_project.full_repo_name,
+            "#%s" % pr.id,
+            pr.title,
+            "@%s" % pr.author,
+            pr.url,
+            updated.strftime("%Y-%m-%d %H:%M"),
         )
-    )
+    return (git_project.full_repo_name, pr.id, pr.title, pr.author, pr.url, updated)
 
 
 @click.command(
@@ -172,17 +347,22 @@ def list_prs(repo):
     default="upstream",
     help="List branches of this project specified as git-remote name",
 )
-def list_branches(merged_with, remote):
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Show only this many most recently updated branches.",
+)
+@output_option()
+@pass_app
+def list_branches(a, merged_with, remote, limit, output):
     """
     List git branches in current git repository
     """
-    a = App()
-    print(
-        tabulate(
-            a.list_branches(merged_with=merged_with, remote=remote),
-            tablefmt="fancy_grid",
-        )
-    )
+    from upsint.output import write_rows
+
+    branches = a.list_branches(merged_with=merged_with, remote=remote, limit=limit)
+    write_rows((b.as_row() for b in branches), BRANCH_FIELDS, output)
 
 
 @click.command(
@@ -191,29 +371,31 @@ def list_branches(merged_with, remote):
     "This is how you can select a repository for Github: <owner>/<project>.",
 )
 @click.argument("repo", type=click.STRING, required=False)
-def list_labels(repo):
+@limit_option
+@output_option()
+@pass_app
+def list_labels(app, repo, limit, output):
     """
     List the labels for the selected repository, default to repo in $PWD
     """
-    app = App()
+    from upsint.labels import iter_labels
+    from upsint.output import write_rows
+
     url = repo or app.guess_remote_url()
     git_project = app.get_git_project(url)
     try:
-        repo_labels = git_project.get_labels()
-    except AttributeError:
-        click.echo(
-            f"We don't support repository-wide labels for type {git_project.__class__.__name__}.",
-            err=True,
-        )
+        repo_labels = iter_labels(git_project)
+    except UpsintException as ex:
+        click.echo(str(ex), err=True)
         sys.exit(2)
-    if not repo_labels:
-        print("No labels.")
-        return
-    print(
-        tabulate(
-            [(label.name, label.color, label.description) for label in repo_labels],
-            tablefmt="fancy_grid",
-        )
+    write_rows(
+        (
+            (label.name, label.color, label.description)
+            for label in islice(repo_labels, limit)
+        ),
+        LABEL_FIELDS,
+        output,
+        empty="No labels.",
     )
 
 
@@ -223,29 +405,30 @@ def list_labels(repo):
     "This is how you can select a repository for Github: <owner>/<project>.",
 )
 @click.argument("repo", type=click.STRING, required=False)
-def list_tags(repo):
+@limit_option
+@output_option()
+@pass_app
+def list_tags(app, repo, limit, output):
     """
     List the tags for the selected repository, default to repo in $PWD
     """
-    app = App()
+    from upsint.forge import iter_tags
+    from upsint.output import write_rows
+
     url = repo or app.guess_remote_url()
     git_project = app.get_git_project(url)
-    repo_tags = git_project.get_tags()
-    if not repo_tags:
-        print("No tags.")
-        return
-    print(
-        tabulate(
-            [(tag.name, tag.commit_sha) for tag in repo_tags], tablefmt="fancy_grid"
-        )
-    )
+    tags = islice(iter_tags(git_project), limit)
+    rows = ((tag.name, tag.commit_sha) for tag in tags)
+    write_rows(rows, TAG_FIELDS, output, empty="No tags.")
 
 
 @click.command(
     name="update-labels",
     help="Update labels of other project. "
     "Multiple destinations can be set by joining them with semicolon. "
-    "This is how you can select a repository for Github: <owner>/<project>.",
+    "This is how you can select a repository for Github: <owner>/<project>. "
+    "The project can be a pattern, e.g. packit/* or packit/upsint-*, to update "
+    "all matching projects of a GitHub organization or a GitLab group.",
 )
 @click.option("--source-repo", "-r", type=click.STRING)
 @click.option(
@@ -261,58 +444,177 @@ def list_tags(repo):
     default="github",
     help="Name of the git service for destination (e.g. github/gitlab).",
 )
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+    show_default=True,
+    help="How many destinations to update concurrently.",
+)
+@click.option(
+    "--host-jobs",
+    type=click.IntRange(min=1),
+    default=LABEL_HOST_JOBS,
+    show_default=True,
+    help="How many requests to send to a single forge concurrently.",
+)
+@click.option(
+    "--prune",
+    is_flag=True,
+    help="Delete labels which the source project doesn't have.",
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Only print what would be created, updated and deleted.",
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Record finished destinations in this file and skip those already there, "
+    "so that an interrupted run can be resumed.",
+)
 @click.argument("destination", type=click.STRING, nargs=-1)
-def update_labels(source_repo, service, source_service, destination):
+@pass_app
+def update_labels(
+    app,
+    source_repo,
+    service,
+    source_service,
+    jobs,
+    host_jobs,
+    prune,
+    dry_run,
+    checkpoint,
+    destination,
+):
     """
     Update labels for the selected repository, default to repo in $PWD
     """
-    app = App()
-    url = app.guess_remote_url()
-    git_project = app.get_git_project(url)
-    try:
-        repo_labels = git_project.get_labels()
-    except AttributeError:
-        click.echo(
-            f"Project {git_project.__class__.__name__} does not support repository-wide labels.",
-            err=True,
-        )
-        sys.exit(2)
+    from tabulate import tabulate
+
+    from upsint.forge import iter_matching_projects
+    from upsint.labels import (
+        CREATE,
+        DELETE,
+        UPDATE,
+        Checkpoint,
+        LabelSyncer,
+        get_project_name,
+        list_labels,
+    )
+
+    if source_repo:
+        namespace, repo = source_repo.rsplit("/", 1)
+        source = app.get_service(source_service)
+        git_project = source.get_project(namespace=namespace, repo=repo)
+    else:
+        git_project = app.get_git_project(app.guess_remote_url())
+    if app.use_cache:
+        # the labels are compared with the current state, not a minute old one
+        app.http_cache.ttl = 0
+    repo_labels = list_labels(git_project)
     if not repo_labels:
         print("No labels.")
         return
+    if not destination:
+        return
+
+    destination_service = app.get_service(service)
+    # patterns are listed page by page while the first projects are being updated
+    projects = iter_matching_projects(destination_service, destination)
+    finished = Checkpoint(Path(checkpoint)) if checkpoint else None
+    if finished is not None:
+        projects = (p for p in projects if get_project_name(p) not in finished)
+    total = None
+    if not any(char in "".join(destination) for char in "*?["):
+        projects = list(projects)
+        total = len(projects)
+        if not dry_run and projects:
+            # listing and changing every label at worst
+            app.reserve_requests(total * (1 + len(repo_labels)), projects[0])
+
+    results = []
+    with LabelSyncer(
+        jobs=jobs, host_jobs=host_jobs, prune=prune, dry_run=dry_run
+    ) as syncer:
+        for result in syncer.sync_many(repo_labels, projects):
+            results.append(result)
+            if finished is not None and not dry_run and not result.error:
+                finished.add(result.destination)
+            counter = f"{len(results)}/{total}" if total else str(len(results))
+            progress = f"[{counter}] {result.destination}:"
+            if result.error:
+                click.echo(f"{progress} failed: {result.error}", err=True)
+            elif not result.operations:
+                click.echo(f"{progress} in sync", err=True)
+            elif dry_run:
+                click.echo(progress, err=True)
+                for operation in result.operations:
+                    click.echo(f"  {operation}", err=True)
+            else:
+                done = ", ".join(
+                    f"{count} {action}d" for action, count in result.done.items()
+                )
+                click.echo(f"{progress} {done}", err=True)
 
-    for repo_for_copy in destination:
-        other_serv = app.get_service(service, repo=repo_for_copy)
-        changes = other_serv.update_labels(labels=repo_labels)
+    def count(result, action):
+        if dry_run:
+            return sum(op.action == action for op in result.operations)
+        return result.done.get(action, 0)
 
-        click.echo(
-            "{changes} labels of {labels_count} copied to {repo_name}".format(
-                changes=changes, labels_count=len(repo_labels), repo_name=repo_for_copy
-            )
+    print(
+        tabulate(
+            [
+                (
+                    r.destination,
+                    count(r, CREATE),
+                    count(r, UPDATE),
+                    count(r, DELETE),
+                    r.unchanged,
+                    r.error
+                    or (
+                        "in sync"
+                        if not r.operations
+                        else "planned" if dry_run else "ok"
+                    ),
+                )
+                for r in sorted(results, key=lambda r: r.destination)
+            ],
+            headers=(
+                "destination",
+                "create",
+                "update",
+                "delete",
+                "unchanged",
+                "status",
+            ),
+            tablefmt="fancy_grid",
         )
+    )
+    if any(result.error for result in results):
+        sys.exit(1)
 
 
 @click.command(name="remove-merged-branches")
 @click.argument("merged_with_branch", type=click.STRING, default="master")
-def remove_merged_branches(merged_with_branch):
+@pass_app
+def remove_merged_branches(a, merged_with_branch):
     """
     Remove branches which are already merged (in master by default)
 
     Argument MERGED_WITH_BRANCH defaults to master and checks whether
     a branch was merged with this one
     """
-    a = App()
-    to_remove = []
-    for branch_dict in a.list_branches(merged_with_branch):
-        branch_name = branch_dict["name"]
-        if (
-            branch_name == merged_with_branch
-            or branch_name == branch_dict["remote_tracking"]
-        ):
+    to_remove = {}
+    for branch in a.list_branches(remote="upstream", merged_with=merged_with_branch):
+        if branch.name == merged_with_branch or branch.name == branch.remote_tracking:
             # don't remove self or a local copy of remote branch
             continue
-        if branch_dict["merged"] == "merged":
-            to_remove.append(branch_name)
+        if branch.merged == "merged":
+            to_remove[branch.name] = branch.sha
     if not to_remove:
         print("Nothing to remove.")
         return
@@ -322,8 +624,12 @@ def remove_merged_branches(merged_with_branch):
     inp = input("Y/N? ")
     if inp in ("y", "Y", "yolo"):
         print("Removing...")
-        for b in to_remove:
-            a.remove_branch(b)
+        failures = a.remove_branches(to_remove, expected_commits=to_remove)
+        for b, reason in failures.items():
+            click.echo(f"Failed to remove {b}: {reason}", err=True)
+        print(f"Removed {len(to_remove) - len(failures)} of {len(to_remove)} branches.")
+        if failures:
+            sys.exit(1)
     else:
         print("Doing nothing, stay safe my friend.")
 
@@ -352,41 +658,73 @@ def checkout_pr(remote, pr):
 
 
 @click.command(name="get-changes")
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+    show_default=True,
+    help="How many pull requests to fetch concurrently.",
+)
+@output_option(default="text")
 @click.argument("lower-bound", type=click.STRING)
 @click.argument("upper-bound", type=click.STRING, default="HEAD")
-def get_changes(lower_bound, upper_bound):
+@pass_app
+def get_changes(app, jobs, output, lower_bound, upper_bound):
     """
     Get changelog-like changes in a commit range
     """
-    app = App()
+    from upsint.changelog import ChangelogStore, iter_changelog
+
     url = app.guess_remote_url()
     git_project = app.get_git_project(url)
-    commits = get_commits_in_range(lower_bound=lower_bound, upper_bound=upper_bound)
-    reg = re.compile(r"Merge pull request #(\d+) from (\w+)/\w+")
-
-    for com in commits:
-        # we could get all the commit messages in a single git call,
-        # but parsing that would be pretty hard and prone to errors
-        commit_metadata = get_commit_metadata(com)
-        match = reg.match(commit_metadata.message)
-        if match:
-            pr_id = match.group(1)
-            author = match.group(2)
-
-            pr = git_project.get_pr(int(pr_id))
-
-            print(
-                f"* {commit_metadata.body}, by [@{author}](https://github.com/{author}), "
-                f"[#{pr_id}](https://github.com/{git_project.namespace}"
-                f"/{git_project.repo}/pull/{pr_id})"
-            )
-            print(f"  * description: {pr.description!r}")
-            for m_commit in get_commits_in_a_merge(com):
-                m = get_commit_metadata(m_commit)
-                print(f"  * commit: {m.message}")
 
-        else:
-            print(f"* {commit_metadata.message}")
+    store = ChangelogStore() if app.use_cache else None
+
+    changes = iter_changelog(
+        git_project,
+        lower_bound=lower_bound,
+        upper_bound=upper_bound,
+        jobs=jobs,
+        store=store,
+        reserve=lambda count: app.reserve_requests(count, git_project),
+    )
+    if output == "text":
+        for change in changes:
+            print(change.render(git_project))
+        return
+
+    from upsint.output import write_rows
+
+    rows = (
+        (c.commit, c.subject, c.pr, c.author, c.description, c.commits) for c in changes
+    )
+    # entries come as the pull requests are fetched, pass each on right away
+    write_rows(rows, CHANGE_FIELDS, output, flush_every=1)
+
+
+def echo_check(check: "CheckStatus"):
+    from ogr.abstract import CommitStatus
+
+    if check.state in (CommitStatus.pending, CommitStatus.running):
+        color, symbol = "yellow", "🚀"
+    elif check.state in (CommitStatus.failure, CommitStatus.error):
+        color, symbol = "red", "🞭"
+    elif check.state == CommitStatus.success:
+        color, symbol = "green", "✓"
+    elif check.state == CommitStatus.canceled:
+        color, symbol = "orange", "🗑"
+    else:
+        logger.warning(
+            f"I don't know this type of commit status: "
+            f"{check.state.value}, {check.description}"
+        )
+        return
+    click.echo(
+        click.style(
+            f"{symbol} {check.context} - {check.description} {check.url}", fg=color
+        )
+    )
 
 
 @click.command(name="status")
@@ -396,16 +734,68 @@ def get_changes(lower_bound, upper_bound):
     default=False,
     help="If on a PR branch, show all the comments",
 )
-def status(with_pr_comments):
+@click.option(
+    "--watch",
+    "-w",
+    is_flag=True,
+    help="If on a PR branch, keep polling the CI checks until all of them finish "
+    "and print those which changed.",
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=1),
+    default=WATCH_INTERVAL,
+    show_default=True,
+    help="Seconds between polls in the watch mode, doubled while nothing changes.",
+)
+@output_option(default="text")
+@pass_app
+def status(app, with_pr_comments, watch, interval, output):
     """
     Get information about project. If not on master,
     figure out if the branch is associated with a PR and get status of that PR.
+
+    Machine-readable output lists the CI checks of the PR (without the comments),
+    or the summary of the project.
     """
-    app = App()
+    from upsint.forge import (
+        get_commit_checks,
+        get_project_summary,
+        watch_commit_checks,
+    )
+
     url = app.guess_remote_url()
     git_project = app.get_git_project(url)
 
     pr = app.get_current_branch_pr(git_project)
+    if pr and watch and app.use_cache:
+        # revalidate every poll: unchanged responses are just 304s
+        app.http_cache.ttl = 0
+    if output != "text":
+        from upsint.output import write_rows
+
+        if not pr:
+            summary = get_project_summary(git_project)
+            row = (summary.open_issues, summary.open_prs, summary.latest_release)
+            write_rows([row], SUMMARY_FIELDS, output)
+            return
+        if watch:
+            checks = (
+                check
+                for changed in watch_commit_checks(
+                    git_project,
+                    pr.head_commit,
+                    interval=interval,
+                    max_interval=max(interval, WATCH_MAX_INTERVAL),
+                )
+                for check in changed
+            )
+        else:
+            checks = get_commit_checks(git_project, pr.head_commit)
+        rows = ((pr.id, c.context, c.state, c.description, c.url) for c in checks)
+        write_rows(rows, CHECK_FIELDS, output, flush_every=1)
+        return
+
     if pr:
         click.echo(f"#{pr.id} ", nl=False)
         click.echo(click.style(pr.title, fg="white"), nl=False)
@@ -415,32 +805,18 @@ def status(with_pr_comments):
             click.echo(click.style(f"{pr.description[:255]}...", fg="yellow"))
         else:
             click.echo(click.style(pr.description, fg="yellow"))
-        top_commit = pr.get_all_commits()[-1]
-
-        commit_statuses = git_project.get_commit_statuses(top_commit)
-        # github returns all statuses, not just the latest:
-        # so let's just display the latest ones
-        processed = set()
-        for cs in commit_statuses:
-            if cs.context in processed:
-                continue
-            if cs.state in (CommitStatus.pending, CommitStatus.running):
-                color, symbol = "yellow", "🚀"
-            elif cs.state in (CommitStatus.failure, CommitStatus.error):
-                color, symbol = "red", "🞭"
-            elif cs.state == CommitStatus.success:
-                color, symbol = "green", "✓"
-            elif cs.state == CommitStatus.canceled:
-                color, symbol = "orange", "🗑"
-            else:
-                logger.warning(
-                    f"I don't know this type of commit status: {cs.state.value}, {cs.comment}"
-                )
-                continue
-            processed.add(cs.context)
-            click.echo(
-                click.style(f"{symbol} {cs.context} - {cs.comment} {cs.url}", fg=color)
-            )
+        if watch:
+            for changed in watch_commit_checks(
+                git_project,
+                pr.head_commit,
+                interval=interval,
+                max_interval=max(interval, WATCH_MAX_INTERVAL),
+            ):
+                for check in changed:
+                    echo_check(check)
+        else:
+            for check in get_commit_checks(git_project, pr.head_commit):
+                echo_check(check)
         if with_pr_comments:
             pr_comments = pr.get_comments()
             if pr_comments:
@@ -452,16 +828,100 @@ def status(with_pr_comments):
                     click.echo(click.style(comment.body))
                     click.echo(click.style(40 * "-"))
     else:
-        open_issues = git_project.get_issue_list()
-        click.echo(f"Open issues: {len(open_issues)}")
-        open_prs = git_project.get_pr_list()
-        click.echo(f"Open PRs: {len(open_prs)}")
-        latest_release = git_project.get_latest_release()
-        if latest_release:
-            click.echo(f"Latest release: {latest_release.title}")
+        summary = get_project_summary(git_project)
+        click.echo(f"Open issues: {summary.open_issues}")
+        click.echo(f"Open PRs: {summary.open_prs}")
+        if summary.latest_release:
+            click.echo(f"Latest release: {summary.latest_release}")
         # TODO: printing latest commit would be nice
 
 
+@click.command(name="prefetch")
+@click.argument("repo", type=click.STRING, required=False)
+@click.option(
+    "--changes-since",
+    "lower_bound",
+    type=click.STRING,
+    default=None,
+    help="Also fetch the pull requests merged since this git ref, for get-changes.",
+)
+@pass_app
+def prefetch(app, repo, lower_bound):
+    """
+    Fetch everything the read-only commands show for the project into the local
+    cache, so that they can answer with --offline or when the forge is unreachable.
+
+    Defaults to the repo in $PWD, then the pull request of the current branch
+    and its CI checks are fetched as well.
+    """
+    from upsint.forge import get_commit_checks
+
+    if app.offline:
+        raise click.UsageError("Can't prefetch while --offline.")
+    if not app.use_cache:
+        raise click.UsageError("There's no cache to prefetch into with --no-cache.")
+    # revalidate everything, unchanged responses are just 304s
+    app.http_cache.ttl = 0
+    url = repo or app.guess_remote_url()
+    git_project = app.get_git_project(url)
+    counts = app.prefetch(git_project)
+    if not repo:
+        pr = app.get_current_branch_pr(git_project)
+        if pr:
+            # the next status finds the PR in the branch index and gets it by its id
+            pr = git_project.get_pr(pr.id)
+            checks = get_commit_checks(git_project, pr.head_commit)
+            counts[f"checks of #{pr.id}"] = len(checks)
+    if lower_bound:
+        from upsint.changelog import ChangelogStore, generate_changelog
+
+        counts["changelog entries"] = sum(
+            1
+            for _ in generate_changelog(
+                git_project,
+                lower_bound=lower_bound,
+                store=ChangelogStore(),
+                reserve=lambda count: app.reserve_requests(count, git_project),
+            )
+        )
+    summary = ", ".join(f"{count} {what}" for what, count in counts.items())
+    click.echo(f"Cached {summary} of {git_project.namespace}/{git_project.repo}.")
+
+
+@click.group(name="cache")
+def cache():
+    """
+    Manage the local cache of responses from git forges
+    """
+
+
+@cache.command(name="stats")
+@pass_app
+def cache_stats(app):
+    """
+    Show size of the cache and how it performed in this process
+    """
+    from tabulate import tabulate
+
+    stats = app.http_cache.stats()
+    click.echo(f"Location: {app.http_cache.path}")
+    print(tabulate(stats.items(), tablefmt="fancy_grid"))
+
+
+@cache.command(name="clear")
+@pass_app
+def cache_clear(app):
+    """
+    Remove all cached responses and changelog entries
+    """
+    from upsint.changelog import ChangelogStore
+
+    app.http_cache.clear()
+    app.branch_pr_index.clear()
+    ChangelogStore().clear()
+    click.echo("Cache cleared.")
+
+
 upsint.add_command(fork)
 upsint.add_command(create_pr)
 upsint.add_command(list_prs)
@@ -473,7 +933,52 @@ upsint.add_command(remove_merged_branches)
 upsint.add_command(checkout_pr)
 upsint.add_command(get_changes)
 upsint.add_command(status)
+upsint.add_command(prefetch)
+
+
+@click.command(name="daemon")
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Listen on this unix socket, $XDG_RUNTIME_DIR/upsint.sock by default.",
+)
+def daemon(socket_path):
+    """
+    Keep config, forge connections and caches warm for other upsint invocations.
+
+    While the daemon is running, read-only commands (list-*, get-changes, status)
+    are run by it; the rest run as usual.
+    """
+    from upsint.daemon import Daemon
+
+    server = Daemon(Path(socket_path) if socket_path else None)
+    try:
+        listener = server.bind()
+    except UpsintException as ex:
+        raise click.ClickException(str(ex))
+    signal.signal(signal.SIGTERM, lambda *_: server.stop())
+    click.echo(f"Listening on {server.socket_path}")
+    try:
+        server.serve(listener)
+    except KeyboardInterrupt:
+        pass
+
+
+upsint.add_command(cache)
+upsint.add_command(daemon)
+
+
+def main():
+    """ run the command in the upsint daemon if it's running, in this process otherwise """
+    from upsint.daemon import run_in_daemon
+
+    code = run_in_daemon(sys.argv[1:])
+    if code is None:
+        upsint()
+    sys.exit(code)
 
 
 if __name__ == "__main__":
-    upsint()
+    main()
@@ -15,16 +15,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import json
 import logging
+import os
 from pathlib import Path
+from typing import Any, Dict, List, Optional
 
-import yaml
-
+from upsint.cache import get_cache_dir
 from upsint.exceptions import UpsintException
 
-
 logger = logging.getLogger(__name__)
 
+# all the files which exist are merged in this order, later files win
 CONFIG_FILE_CANDIDATES = (
     "~/.upsint.yaml",
     "~/.upsint.yml",
@@ -33,20 +35,102 @@ CONFIG_FILE_CANDIDATES = (
 )
 
 
+def merge_config(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    """ merge nested dictionaries recursively, other values of `override` win """
+    result = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = merge_config(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def get_file_signatures(paths: List[Path]) -> List[Optional[List[int]]]:
+    """ mtime and size of the files, so it's possible to tell if any changed """
+    signatures: List[Optional[List[int]]] = []
+    for path in paths:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            signatures.append(None)
+            continue
+        signatures.append([stat.st_mtime_ns, stat.st_size])
+    return signatures
+
+
+def load_config_file(path: Path) -> Dict[str, Any]:
+    content = path.read_text()
+    if path.suffix == ".json":
+        return json.loads(content) or {}
+    # parsing YAML is slow and needed only when a config file changes
+    import yaml
+
+    return yaml.safe_load(content) or {}
+
+
 class Conf:
-    def __init__(self):
+    """
+    Configuration merged from all the config files.
+
+    The merged configuration is stored as JSON in the cache directory together
+    with the mtimes and sizes of the config files; it's used for as long
+    as none of the files is changed, created or removed.
+    """
+
+    def __init__(self, cache_path: Optional[Path] = None):
         self._c = None
+        self.cache_path = cache_path or get_cache_dir().joinpath("config.json")
+        self.paths = [Path(c).expanduser() for c in CONFIG_FILE_CANDIDATES]
+
+    def _load_cached(self, signatures) -> Optional[Dict[str, Any]]:
+        try:
+            cached = json.loads(self.cache_path.read_text())
+        except (OSError, ValueError):
+            return None
+        if cached.get("sources") != [str(p) for p in self.paths]:
+            return None
+        if cached.get("signatures") != signatures:
+            return None
+        return cached.get("config")
+
+    def _store_cached(self, signatures, config: Dict[str, Any]):
+        document = json.dumps(
+            {
+                "sources": [str(p) for p in self.paths],
+                "signatures": signatures,
+                "config": config,
+            }
+        )
+        tmp_path = self.cache_path.with_suffix(".tmp")
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # the config contains tokens, keep it private as the config files
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(document)
+            tmp_path.replace(self.cache_path)
+        except OSError as ex:
+            logger.debug(f"can't store the compiled config: {ex}")
+
+    def load(self) -> Dict[str, Any]:
+        signatures = get_file_signatures(self.paths)
+        config = self._load_cached(signatures)
+        if config is not None:
+            return config
+        config = {}
+        for path, signature in zip(self.paths, signatures):
+            if signature is None:
+                logger.debug(f"file {path} does not exist")
+                continue
+            config = merge_config(config, load_config_file(path))
+        self._store_cached(signatures, config)
+        return config
 
     @property
     def c(self):
         if self._c is None:
-            for c in CONFIG_FILE_CANDIDATES:
-                try:
-                    content = Path(c).expanduser().read_text()
-                except FileNotFoundError:
-                    logger.debug(f"file {c} does not exist")
-                    continue
-                self._c = yaml.safe_load(content)
+            self._c = self.load()
         return self._c
 
     def get_auth_configuration(self):
@@ -54,3 +138,9 @@ class Conf:
         if not auth_conf:
             raise UpsintException("No authentication defined in the config file.")
         return auth_conf
+
+    def get_cache_configuration(self):
+        return self.c.get("cache") or {}
+
+    def get_transport_configuration(self):
+        return self.c.get("transport") or {}
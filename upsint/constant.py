@@ -16,3 +16,37 @@
 #
 
 CLONE_TIMEOUT = 60
+
+# how many pull requests `get-changes` fetches concurrently
+DEFAULT_JOBS = 8
+# requests `update-labels` sends to a single forge host concurrently
+LABEL_HOST_JOBS = 4
+# repositories `list-prs` lists concurrently, each needs its own connection
+PR_LIST_JOBS = 16
+
+# the most items both GitHub and GitLab serve in a page
+MAX_PER_PAGE = 100
+
+# machine-readable formats of --output, written row by row
+OUTPUT_FORMATS = ("json", "jsonl", "csv", "tsv")
+
+CACHE_DIR = "~/.cache/upsint"
+# seconds a cached forge response is served without revalidation
+CACHE_TTL = 60
+CACHE_MAX_SIZE = 100 * 1024 * 1024
+
+# seconds between polls of `status --watch`, doubled while nothing changes
+WATCH_INTERVAL = 10
+WATCH_MAX_INTERVAL = 120
+
+# connections kept open to a single forge host, and how many hosts
+HTTP_POOL_MAXSIZE = 16
+HTTP_POOL_NUM = 10
+# seconds, used unless a client library sets its own timeout
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 60
+
+# seconds upsint waits for a rate limit to reset before giving up
+RATE_LIMIT_MAX_WAIT = 15 * 60
+# spread the requests once less than this fraction of the rate limit remains
+RATE_LIMIT_PACE_BELOW = 0.1
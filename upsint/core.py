@@ -14,33 +14,192 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+import logging
 import re
-from typing import Optional, Iterable
-
-from ogr import get_instances_from_dict, get_project
-from ogr.abstract import GitProject, GitService, PullRequest
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Iterable, Iterator
+from urllib.parse import urlparse
 
+from upsint.cache import BranchPRIndex, HTTPCache
 from upsint.conf import Conf
+from upsint.exceptions import UpsintException
 from upsint.utils import (
     get_current_branch_name,
     get_remote_url,
-    list_local_branches,
+    Branch,
+    iter_local_branches,
     git_branch_d,
+    git_delete_branches,
+    rev_parse,
 )
 
+if TYPE_CHECKING:
+    # ogr and the forge libraries take a while to import,
+    # commands working with the local repository only don't need them
+    from ogr.abstract import GitProject, GitService, PullRequest
+
+    from upsint.transport import Transport
+
+logger = logging.getLogger(__name__)
+
+
+def log_request(request, response, elapsed: float):
+    logger.debug(
+        f"{request.method} {request.url} {response.status_code} {elapsed:.3f}s"
+    )
+
+
+TRANSPORT_OPTIONS = (
+    "pool_maxsize",
+    "pool_sizes",
+    "num_pools",
+    "connect_timeout",
+    "read_timeout",
+    "keep_alive",
+)
+
+
+def get_config_hostname(key: str, value: Dict) -> Optional[str]:
+    """
+    hostname of the forge configured as `key: value` in the authentication config,
+    the key is a hostname, URL or just a type of the forge, e.g. "pagure"
+    """
+    url = value.get("instance_url") or key
+    if "://" not in url:
+        url = f"https://{url}"
+    hostname = urlparse(url).hostname
+    return hostname if hostname and "." in hostname else None
+
 
 class App:
-    def __init__(self):
+    def __init__(
+        self,
+        use_cache: bool = True,
+        max_requests: Optional[int] = None,
+        offline: bool = False,
+    ):
+        """
+        :param use_cache: use the local cache of forge responses
+        :param max_requests: refuse to send more requests to the forges
+        :param offline: answer from the local cache only, however old the data are
+        """
         self.conf = Conf()
-        self._git_services: Optional[Iterable[GitService]] = None
+        self.use_cache = use_cache
+        self.max_requests = max_requests
+        self.offline = offline
+        self._service_configs: Optional[Dict[Optional[str], Dict[str, Dict]]] = None
+        self._services: Dict[Optional[str], List["GitService"]] = {}
+        self._services_lock = threading.Lock()
+        self._http_cache: Optional[HTTPCache] = None
+        self._transport: Optional["Transport"] = None
+        self.branch_pr_index = BranchPRIndex()
+
+    @property
+    def http_cache(self) -> HTTPCache:
+        if self._http_cache is None:
+            cache_conf = self.conf.get_cache_configuration()
+            self._http_cache = HTTPCache(
+                offline=self.offline,
+                **{k: v for k, v in cache_conf.items() if k in ("ttl", "max_size")},
+            )
+        return self._http_cache
 
     @property
-    def git_services(self):
-        if self._git_services is None:
-            self._git_services = get_instances_from_dict(
-                self.conf.get_auth_configuration()
+    def transport(self) -> "Transport":
+        """ HTTP transport shared by all the forge services """
+        if self._transport is None:
+            from upsint.ratelimit import RateLimiter
+            from upsint.transport import Transport
+
+            transport_conf = self.conf.get_transport_configuration()
+            self._transport = Transport(
+                cache=self.http_cache if self.use_cache else None,
+                rate_limiter=RateLimiter(max_requests=self.max_requests),
+                **{k: v for k, v in transport_conf.items() if k in TRANSPORT_OPTIONS},
             )
-        return self._git_services
+            self._transport.add_hook(log_request)
+        return self._transport
+
+    @property
+    def offline_age(self) -> Optional[float]:
+        """ seconds, age of the oldest response served without asking the forge """
+        return self._http_cache.offline_age if self._http_cache else None
+
+    def reset_offline_age(self):
+        """ forget the stale responses served to a previous command of the daemon """
+        if self._http_cache:
+            self._http_cache.offline_age = None
+
+    def reserve_requests(self, count: int, git_project: "GitProject"):
+        """
+        Make sure a command can send about `count` requests to the project's forge
+        before it sends any.
+
+        :raises RateLimitExceeded: if it would exceed --max-requests
+        """
+        from upsint.forge import get_api_hostname
+
+        self.transport.rate_limiter.reserve(count, get_api_hostname(git_project))
+
+    @property
+    def service_configs(self) -> Dict[Optional[str], Dict[str, Dict]]:
+        """
+        authentication config split by the hostname of the forge:
+        {hostname: {key: service config}}, hostname is None if unknown
+        """
+        if self._service_configs is None:
+            self._service_configs = {}
+            for key, value in self.conf.get_auth_configuration().items():
+                hostname = get_config_hostname(key, value)
+                self._service_configs.setdefault(hostname, {})[key] = value
+        return self._service_configs
+
+    def get_services(self, hostname: Optional[str]) -> List["GitService"]:
+        """
+        services configured for the hostname, they are created on the first use
+
+        :param hostname: None for services whose hostname is not known
+        """
+        with self._services_lock:
+            if hostname not in self._services:
+                from ogr import get_instances_from_dict
+
+                configs = self.service_configs.get(hostname)
+                from upsint.transport import install_transport
+
+                if configs:
+                    install_transport(self.transport)
+                # ogr modifies the configs
+                self._services[hostname] = list(
+                    get_instances_from_dict(
+                        {key: dict(value) for key, value in (configs or {}).items()}
+                    )
+                )
+            return self._services[hostname]
+
+    def get_service(self, name: str) -> "GitService":
+        """
+        configured service selected by its hostname, key in the config
+        or type of the forge, e.g. "github"
+
+        :raises UpsintException: no such service is configured
+        """
+        for hostname, configs in self.service_configs.items():
+            names = {hostname, hostname.split(".")[0]} if hostname else set()
+            for key, config in configs.items():
+                names |= {key, config.get("type")}
+            services = self.get_services(hostname) if name in names else []
+            if services:
+                return services[0]
+        raise UpsintException(f"No {name} service is configured.")
+
+    @property
+    def git_services(self) -> List["GitService"]:
+        """ all the configured services """
+        services = []
+        for hostname in self.service_configs:
+            services += self.get_services(hostname)
+        return services
 
     def guess_remote_url(self, remote=None):
         if remote is None:
@@ -51,23 +210,24 @@ class App:
     def get_current_branch(self):
         return get_current_branch_name()
 
-    def list_branches(self, remote: str, merged_with: Optional[str] = None):
+    def list_branches(
+        self,
+        remote: str,
+        merged_with: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[Branch]:
         """
-        provide a list of branches with additional metadata
+        provide branches with additional metadata, most recent first
 
         :param merged_with: was a branch merged into this one?
-        :return dict {
-            "name": "master",
-            "remote_tracking": "origin",  # can be None
-        }
+        :param limit: provide only this many most recent branches
+        :return: generator of Branch records
         """
         if not merged_with:
             url = self.guess_remote_url(remote=remote)
             git_project = self.get_git_project(url)
             merged_with = git_project.default_branch
-        return sorted(
-            list_local_branches(merged_with), key=lambda x: x["date"], reverse=True
-        )
+        return iter_local_branches(merged_with, limit=limit)
 
     def remove_branch(self, branch_name: str):
         """
@@ -77,15 +237,56 @@ class App:
         """
         git_branch_d(branch_name)
 
-    def get_git_project(self, url: str) -> GitProject:
+    def remove_branches(
+        self, names: Iterable[str], expected_commits: Optional[Dict[str, str]] = None
+    ) -> Dict[str, str]:
+        """
+        remove selected local branches at once
+
+        :param names: branches to remove
+        :param expected_commits: {branch: commit} - skip a branch if it doesn't point
+                                 to this commit anymore; current state is used when unset
+        :return: {branch: reason} for branches which were not removed
+        """
+        names = set(names)
+        if expected_commits is None:
+            expected_commits = {
+                b.name: b.sha
+                for b in iter_local_branches(merged_with="HEAD")
+                if b.name in names
+            }
+        failures = {
+            name: "no such branch" for name in names if name not in expected_commits
+        }
+        failures.update(
+            git_delete_branches(
+                {name: expected_commits[name] for name in names if name not in failures}
+            )
+        )
+        return failures
+
+    def get_git_project(self, url: str) -> "GitProject":
+        from ogr import get_project
+        from ogr.parsing import parse_git_repo
+
         if not url:
             url = self.guess_remote_url()
-        return get_project(url, custom_instances=self.git_services)
+        repo_url = parse_git_repo(url)
+        hostname = repo_url.hostname if repo_url else None
+        services = self.get_services(hostname)
+        if not any(service.hostname == hostname for service in services):
+            # the key in the config doesn't have to be the hostname of the forge
+            services = self.git_services
+        return get_project(url, custom_instances=services)
 
-    def get_current_branch_pr(self, git_project: GitProject) -> PullRequest:
+    def get_current_branch_pr(self, git_project: "GitProject") -> "PullRequest":
         """
         If the current branch is assoctiated with a PR, get it, otherwise return None
         """
+        from ogr.abstract import PRStatus
+
+        from upsint.forge import find_pr_by_branch, get_project_key
+
         current_branch = self.get_current_branch()
 
         pr_re = re.compile(r"^pr/(\d+)$")
@@ -95,10 +296,43 @@ class App:
             pr = git_project.get_pr(pr_id)
             return pr
 
-        # FIXME: could this logic be in ogr? input: branch + repo, output: pr
-        for pr in git_project.get_pr_list():
-            if (
-                pr.source_branch == current_branch
-                and pr.author == git_project.service.user.get_username()
-            ):
-                return pr
+        project_key = get_project_key(git_project)
+        tip = rev_parse(current_branch)
+        if self.use_cache:
+            pr_id = self.branch_pr_index.get(project_key, current_branch, tip)
+            if pr_id is not None:
+                pr = git_project.get_pr(pr_id)
+                if pr.status == PRStatus.open:
+                    return pr
+                # merged or closed, the branch usually stays where it was
+                self.branch_pr_index.delete(project_key, current_branch)
+
+        username = git_project.service.user.get_username()
+        pr = find_pr_by_branch(git_project, current_branch, username)
+        if pr and self.use_cache:
+            self.branch_pr_index.set(project_key, current_branch, tip, pr.id)
+        return pr
+
+    def prefetch(self, git_project: "GitProject") -> Dict[str, int]:
+        """
+        Warm the cache with the data the read-only commands show for the project,
+        each read as a whole list rather than object by object.
+        The same calls as in the commands are made, so that the responses match.
+
+        :return: {what: how many objects} fetched
+        """
+        from upsint.forge import get_project_summary, iter_pr_list, iter_tags
+        from upsint.labels import iter_labels
+
+        counts = {}
+        git_project.service.user.get_username()
+        # list-branches compares the branches with the default one
+        git_project.default_branch
+        get_project_summary(git_project)
+        counts["pull requests"] = sum(1 for _ in iter_pr_list(git_project))
+        try:
+            counts["labels"] = sum(1 for _ in iter_labels(git_project))
+        except UpsintException:
+            logger.debug(f"{git_project.__class__.__name__} doesn't support labels")
+        counts["tags"] = sum(1 for _ in iter_tags(git_project))
+        return counts
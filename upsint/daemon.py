@@ -0,0 +1,264 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Optional resident process which keeps the App (config, forge services,
+HTTP connections and caches) warm between invocations of the CLI.
+
+The client sends the command line and the working directory over a unix socket
+as a JSON line, the daemon runs the command and streams the output back as
+JSON lines {"stdout": text}, {"stderr": text} and finally {"exit": code}.
+Requests are served one at a time: commands depend on the working directory,
+which is shared by the whole process.
+
+Only the read-only commands which don't need a terminal are forwarded;
+everything else, or every command when the daemon isn't running, is run
+in the calling process.
+"""
+
+import io
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+from pathlib import Path
+from typing import IO, List, Optional, cast
+
+from upsint.exceptions import UpsintException
+
+logger = logging.getLogger(__name__)
+
+DAEMON_COMMANDS = (
+    "list-prs",
+    "list-branches",
+    "list-labels",
+    "list-tags",
+    "get-changes",
+    "status",
+)
+# commands which would block the daemon for a long time
+BLOCKING_OPTIONS = ("--watch", "-w")
+
+
+def get_socket_path() -> Path:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir).joinpath("upsint.sock")
+    from upsint.cache import get_cache_dir
+
+    return get_cache_dir().joinpath("upsint.sock")
+
+
+def is_forwardable(args: List[str]) -> bool:
+    """ can the daemon run this command line? global options are not supported """
+    if not args or args[0] not in DAEMON_COMMANDS:
+        return False
+    # "-" reads stdin, which isn't passed to the daemon
+    return not any(arg in BLOCKING_OPTIONS or arg in ("--help", "-") for arg in args)
+
+
+def run_in_daemon(
+    args: List[str],
+    socket_path: Optional[Path] = None,
+    stdout: Optional[IO[str]] = None,
+    stderr: Optional[IO[str]] = None,
+) -> Optional[int]:
+    """
+    Run the command in the daemon and print its output.
+
+    :return: exit code of the command or None if it has to run in this process
+    """
+    if not is_forwardable(args):
+        return None
+    stdout, stderr = stdout or sys.stdout, stderr or sys.stderr
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(socket_path or get_socket_path()))
+    except OSError:
+        client.close()
+        return None
+
+    with client, client.makefile("rwb") as connection:
+        request = {"args": args, "cwd": os.getcwd(), "color": stdout.isatty()}
+        connection.write(json.dumps(request).encode() + b"\n")
+        connection.flush()
+        for line in connection:
+            message = json.loads(line)
+            if "exit" in message:
+                return message["exit"]
+            stream = stdout if "stdout" in message else stderr
+            stream.write(message.get("stdout", message.get("stderr")))
+            stream.flush()
+    stderr.write("The upsint daemon exited before the command finished.\n")
+    return 1
+
+
+class _SocketStream(io.TextIOBase):
+    """ text stream sending everything written to it to the client """
+
+    def __init__(self, connection, name: str):
+        self.connection = connection
+        self.name = name
+
+    def writable(self):
+        return True
+
+    def write(self, text: str) -> int:
+        if text:
+            message = json.dumps({self.name: text}).encode() + b"\n"
+            self.connection.write(message)
+            self.connection.flush()
+        return len(text)
+
+
+class Daemon:
+    def __init__(self, socket_path: Optional[Path] = None):
+        self.socket_path = socket_path or get_socket_path()
+        self.app = None
+        self.config_signatures = None
+        self.stopped = threading.Event()
+        self._server: Optional[socket.socket] = None
+
+    def get_app(self):
+        """ the warm App, recreated when the config files change """
+        from upsint.conf import get_file_signatures
+        from upsint.core import App
+
+        signatures = (
+            get_file_signatures(self.app.conf.paths) if self.app is not None else None
+        )
+        if self.app is None or signatures != self.config_signatures:
+            self.app = App()
+            self.config_signatures = get_file_signatures(self.app.conf.paths)
+        return self.app
+
+    def run_command(self, request: dict, connection) -> int:
+        import click
+
+        from upsint.cli import upsint
+
+        stdout = _SocketStream(connection, "stdout")
+        stderr = _SocketStream(connection, "stderr")
+        original_cwd, original_streams = os.getcwd(), (sys.stdout, sys.stderr)
+        sys.stdout, sys.stderr = stdout, stderr
+        try:
+            os.chdir(request["cwd"])
+            result = upsint.main(
+                args=request["args"],
+                prog_name="upsint",
+                obj=self.get_app(),
+                color=request.get("color"),
+                standalone_mode=False,
+            )
+            # click returns the code of ctx.exit() when not in the standalone mode
+            return result if isinstance(result, int) else 0
+        except SystemExit as ex:
+            return ex.code if isinstance(ex.code, int) else int(bool(ex.code))
+        except click.ClickException as ex:
+            ex.show(file=cast(IO[str], stderr))
+            return ex.exit_code
+        except click.Abort:
+            stderr.write("Aborted!\n")
+            return 1
+        except Exception as ex:
+            logger.exception("command failed")
+            stderr.write(f"{ex.__class__.__name__}: {ex}\n")
+            return 1
+        finally:
+            sys.stdout, sys.stderr = original_streams
+            os.chdir(original_cwd)
+
+    def handle(self, client: socket.socket):
+        with client, client.makefile("rwb") as connection:
+            line = connection.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line)
+            except ValueError:
+                request = None
+            if not isinstance(request, dict):
+                # e.g. a client of another upsint version, keep serving the rest
+                logger.warning(f"malformed request: {line!r}")
+                _SocketStream(connection, "stderr").write(
+                    "Malformed request to the upsint daemon.\n"
+                )
+                code = 2
+            elif is_forwardable(request.get("args")):
+                logger.debug(f"running {request['args']} in {request['cwd']}")
+                code = self.run_command(request, connection)
+            else:
+                # e.g. a command asking on stdin would block the daemon
+                logger.warning(f"refusing to run {request.get('args')}")
+                _SocketStream(connection, "stderr").write(
+                    "The upsint daemon runs only read-only commands "
+                    f"({', '.join(DAEMON_COMMANDS)}).\n"
+                )
+                code = 2
+            connection.write(json.dumps({"exit": code}).encode() + b"\n")
+            connection.flush()
+
+    def bind(self) -> socket.socket:
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.socket_path.exists():
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(str(self.socket_path))
+            except OSError:
+                # left behind by a daemon which didn't exit cleanly
+                self.socket_path.unlink()
+            else:
+                raise UpsintException(
+                    f"upsint daemon is already running: {self.socket_path}"
+                )
+            finally:
+                probe.close()
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        # the daemon acts with the user's tokens, nobody else may connect
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(str(self.socket_path))
+        finally:
+            os.umask(old_umask)
+        server.listen()
+        return server
+
+    def serve(self, server: Optional[socket.socket] = None):
+        server = self._server = server or self.bind()
+        try:
+            while True:
+                try:
+                    client, _ = server.accept()
+                except OSError:
+                    if self.stopped.is_set():
+                        return
+                    raise
+                try:
+                    self.handle(client)
+                except (BrokenPipeError, ConnectionResetError):
+                    logger.debug("the client disconnected")
+        finally:
+            server.close()
+            self.socket_path.unlink(missing_ok=True)
+
+    def stop(self):
+        """ stop serving once the current command finishes """
+        self.stopped.set()
+        if self._server is not None:
+            # wakes up the accept() call
+            self._server.shutdown(socket.SHUT_RDWR)
@@ -18,3 +18,11 @@
 
 class UpsintException(Exception):
     pass
+
+
+class RateLimitExceeded(UpsintException):
+    """ the forge's rate limit or --max-requests doesn't allow more requests """
+
+
+class OfflineError(UpsintException):
+    """ a response is needed which is not in the local cache while offline """
@@ -0,0 +1,637 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Direct access to forge APIs for the cases where going through ogr
+would cost too many requests.
+"""
+
+import datetime
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from github import UnknownObjectException
+from github.PaginatedList import PaginatedList
+from github.PullRequest import PullRequest as GithubRawPullRequest
+from github.Repository import Repository
+from github.Tag import Tag
+from gitlab.exceptions import GitlabListError
+from ogr.abstract import CommitStatus, GitProject, GitService, GitTag, PullRequest
+from ogr.services.github import GithubProject, GithubPullRequest, GithubService
+from ogr.services.gitlab import GitlabProject, GitlabPullRequest, GitlabService
+
+from upsint.constant import (
+    MAX_PER_PAGE,
+    PR_LIST_JOBS,
+    WATCH_INTERVAL,
+    WATCH_MAX_INTERVAL,
+)
+from upsint.exceptions import UpsintException
+
+logger = logging.getLogger(__name__)
+
+GITHUB_API_URL = "https://api.github.com"
+
+
+class GithubAPI:
+    """
+    Minimal client of GitHub REST and GraphQL APIs
+    """
+
+    def __init__(self, token: Optional[str] = None, api_url: Optional[str] = None):
+        self.api_url = (api_url or GITHUB_API_URL).rstrip("/")
+        self.session = requests.Session()
+        self.session.headers["Accept"] = "application/vnd.github+json"
+        if token:
+            self.session.headers["Authorization"] = f"bearer {token}"
+
+    @classmethod
+    def from_project(cls, git_project: GithubProject) -> "GithubAPI":
+        token = git_project.service.authentication.get_token(
+            git_project.namespace, git_project.repo
+        )
+        return cls(token=token)
+
+    def get(
+        self, path: str, params: Optional[Dict[str, Any]] = None
+    ) -> requests.Response:
+        response = self.session.get(f"{self.api_url}{path}", params=params)
+        if not response.ok:
+            raise UpsintException(
+                f"GitHub API request {path} failed: {response.status_code} {response.text}"
+            )
+        return response
+
+    def graphql(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict:
+        """
+        run a GraphQL query
+
+        :return: the response with "data" and, optionally, "errors" reported
+                 per field (the rest of the data is still valid then)
+        """
+        response = self.session.post(
+            f"{self.api_url}/graphql",
+            json={"query": query, "variables": variables or {}},
+        )
+        if not response.ok:
+            raise UpsintException(
+                f"GitHub GraphQL query failed: {response.status_code} {response.text}"
+            )
+        result = response.json()
+        if not result.get("data"):
+            raise UpsintException(
+                f"GitHub GraphQL query failed: {result.get('errors')}"
+            )
+        return result
+
+
+def get_project_key(git_project: GitProject) -> str:
+    """ identify the project across forges, e.g. for local caches """
+    instance_url = getattr(git_project.service, "instance_url", "")
+    return f"{instance_url}/{git_project.namespace}/{git_project.repo}"
+
+
+def get_api_hostname(git_project: GitProject) -> str:
+    """ host the API requests for the project are sent to """
+    if is_github(git_project) and git_project.service.hostname == "github.com":
+        return urlsplit(GITHUB_API_URL).hostname
+    return git_project.service.hostname
+
+
+def is_github(git_project: GitProject) -> bool:
+    return isinstance(git_project, GithubProject)
+
+
+def is_gitlab(git_project: GitProject) -> bool:
+    return isinstance(git_project, GitlabProject)
+
+
+def get_lazy_gitlab_project(git_project: GitlabProject):
+    """ python-gitlab project object which doesn't fetch anything by itself """
+    return git_project.service.gitlab_instance.projects.get(
+        f"{git_project.namespace}/{git_project.repo}", lazy=True
+    )
+
+
+def get_lazy_github_repo(git_project: GithubProject):
+    """ PyGithub repository object which doesn't fetch anything by itself """
+    return git_project.github_instance.get_repo(
+        f"{git_project.namespace}/{git_project.repo}", lazy=True
+    )
+
+
+def iter_github_list(
+    git_project: GithubProject,
+    content_class,
+    path: str,
+    params: Optional[Dict[str, Any]] = None,
+) -> PaginatedList:
+    """ PyGithub list of the repository's objects, fetched page by page as it's read """
+    repo = get_lazy_github_repo(git_project)
+    return PaginatedList(
+        content_class,
+        git_project.github_instance.requester,
+        f"{repo.url}{path}",
+        dict(params or {}, per_page=MAX_PER_PAGE),
+    )
+
+
+def iter_pr_list(git_project: GitProject) -> Iterator[PullRequest]:
+    """ open pull requests, recently updated first, read page by page """
+    if isinstance(git_project, GithubProject):
+        prs = iter_github_list(
+            git_project,
+            GithubRawPullRequest,
+            "/pulls",
+            {"state": "open", "sort": "updated", "direction": "desc"},
+        )
+        return (GithubPullRequest(pr, git_project) for pr in prs)
+    if isinstance(git_project, GitlabProject):
+        mrs = get_lazy_gitlab_project(git_project).mergerequests.list(
+            state="opened",
+            order_by="updated_at",
+            sort="desc",
+            iterator=True,
+            per_page=MAX_PER_PAGE,
+        )
+        return (GitlabPullRequest(mr, git_project) for mr in mrs)
+    return iter(git_project.get_pr_list())
+
+
+def get_pr_updated(pr: PullRequest) -> datetime.datetime:
+    """ when the pull request was last updated (created, if the forge doesn't tell) """
+    updated = getattr(getattr(pr, "_raw_pr", None), "updated_at", None) or pr.created
+    if isinstance(updated, str):
+        # python-gitlab keeps the timestamps as they come from the API
+        updated = datetime.datetime.fromisoformat(updated.replace("Z", "+00:00"))
+    if updated.tzinfo is None:
+        updated = updated.replace(tzinfo=datetime.timezone.utc)
+    return updated
+
+
+@dataclass
+class ProjectPullRequests:
+    git_project: GitProject
+    prs: List[PullRequest]
+    error: Optional[str] = None
+
+
+def _list_prs_safely(
+    git_project: GitProject, limit: Optional[int]
+) -> ProjectPullRequests:
+    try:
+        return ProjectPullRequests(
+            git_project, list(islice(iter_pr_list(git_project), limit))
+        )
+    except Exception as ex:
+        # one broken repository doesn't stop the others
+        logger.debug(f"listing pull requests of {git_project.full_repo_name} failed")
+        return ProjectPullRequests(git_project, [], error=str(ex))
+
+
+def iter_pr_lists(
+    git_projects: Iterable[GitProject],
+    limit: Optional[int] = None,
+    jobs: int = PR_LIST_JOBS,
+) -> Iterator[ProjectPullRequests]:
+    """
+    List open pull requests of many projects at once, so that it takes about
+    as long as the slowest of them.
+
+    :param limit: read only this many most recently updated pull requests per project
+    :return: generator of the lists in the order the projects finish
+    """
+    with ThreadPoolExecutor(
+        max_workers=jobs, thread_name_prefix="upsint-prs"
+    ) as executor:
+        futures = [
+            executor.submit(_list_prs_safely, git_project, limit)
+            for git_project in git_projects
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def merge_pr_lists(
+    pr_lists: Iterable[ProjectPullRequests],
+) -> List[Tuple[GitProject, PullRequest]]:
+    """ pull requests of all the projects, recently updated first """
+    prs = [(pr_list.git_project, pr) for pr_list in pr_lists for pr in pr_list.prs]
+    return sorted(prs, key=lambda item: get_pr_updated(item[1]), reverse=True)
+
+
+def iter_tags(git_project: GitProject) -> Iterator[GitTag]:
+    """ tags of the project, read page by page """
+    if isinstance(git_project, GithubProject):
+        tags = iter_github_list(git_project, Tag, "/tags")
+        return (GitTag(tag.name, tag.commit.sha) for tag in tags)
+    if isinstance(git_project, GitlabProject):
+        tags = get_lazy_gitlab_project(git_project).tags.list(
+            iterator=True, per_page=MAX_PER_PAGE
+        )
+        return (GitTag(tag.name, tag.commit["id"]) for tag in tags)
+    return iter(git_project.get_tags())
+
+
+def _iter_github_namespace(
+    service: GithubService, namespace: str
+) -> Iterator[GithubProject]:
+    requester = service.github.requester
+    # organizations and users have separate listings, there's no telling up front
+    for owner in ("orgs", "users"):
+        repos = PaginatedList(
+            Repository,
+            requester,
+            f"{requester.base_url}/{owner}/{namespace}/repos",
+            {"per_page": MAX_PER_PAGE},
+        )
+        try:
+            for repo in repos:
+                if not repo.archived:
+                    yield GithubProject(
+                        repo=repo.name,
+                        namespace=namespace,
+                        service=service,
+                        github_repo=repo,
+                    )
+            return
+        except UnknownObjectException:
+            if owner == "users":
+                raise UpsintException(f"No GitHub organization or user {namespace}.")
+
+
+def _iter_gitlab_namespace(
+    service: GitlabService, namespace: str
+) -> Iterator[GitlabProject]:
+    group = service.gitlab_instance.groups.get(namespace, lazy=True)
+    try:
+        # the first page is requested right away, the others as they are read
+        projects = group.projects.list(
+            iterator=True,
+            per_page=MAX_PER_PAGE,
+            include_subgroups=True,
+            archived=False,
+        )
+        for project in projects:
+            project_namespace, repo = project.path_with_namespace.rsplit("/", 1)
+            yield GitlabProject(repo=repo, namespace=project_namespace, service=service)
+    except GitlabListError as ex:
+        if ex.response_code != 404:
+            raise
+        raise UpsintException(f"No GitLab group {namespace}.")
+
+
+def iter_namespace_projects(
+    service: GitService, namespace: str
+) -> Iterator[GitProject]:
+    """
+    Projects of a GitHub organization or user, or of a GitLab group and its subgroups,
+    archived ones are skipped. They are yielded page by page as the listing is read.
+    """
+    if isinstance(service, GithubService):
+        return _iter_github_namespace(service, namespace)
+    if isinstance(service, GitlabService):
+        return _iter_gitlab_namespace(service, namespace)
+    raise UpsintException(
+        f"Listing projects of a namespace is not supported for {service.__class__.__name__}."
+    )
+
+
+def iter_matching_projects(
+    service: GitService, patterns: Iterable[str]
+) -> Iterator[GitProject]:
+    """
+    Projects given as namespace/repo, where the repo may be a glob pattern,
+    e.g. packit/* or packit/upsint-*; every project is yielded once.
+    """
+    seen = set()
+    for pattern in patterns:
+        namespace, repo = pattern.rsplit("/", 1)
+        if not any(char in pattern for char in "*?["):
+            projects: Iterable[GitProject] = [
+                service.get_project(namespace=namespace, repo=repo)
+            ]
+        elif any(char in namespace for char in "*?["):
+            raise UpsintException(
+                f"{pattern}: only the repository part can be a pattern."
+            )
+        else:
+            projects = iter_namespace_projects(service, namespace)
+        for git_project in projects:
+            name = f"{git_project.namespace}/{git_project.repo}"
+            if name not in seen and fnmatchcase(name, pattern):
+                seen.add(name)
+                yield git_project
+
+
+def find_pr_by_branch(
+    git_project: GitProject, branch: str, username: str
+) -> Optional[PullRequest]:
+    """
+    Find an open pull request of the user from the selected branch.
+
+    GitHub and GitLab filter the pull requests on the server,
+    other forges need to list all of them.
+    """
+    if isinstance(git_project, GithubProject):
+        repo = get_lazy_github_repo(git_project)
+        # the branch is either in the user's fork or in the project itself
+        for owner in dict.fromkeys((username, git_project.namespace)):
+            for raw_pr in repo.get_pulls(state="open", head=f"{owner}:{branch}"):
+                if raw_pr.user.login == username:
+                    return GithubPullRequest(raw_pr, git_project)
+        return None
+    if isinstance(git_project, GitlabProject):
+        mrs = get_lazy_gitlab_project(git_project).mergerequests.list(
+            state="opened",
+            source_branch=branch,
+            author_username=username,
+            get_all=False,
+        )
+        return GitlabPullRequest(mrs[0], git_project) if mrs else None
+
+    for pr in git_project.get_pr_list():
+        if pr.source_branch == branch and pr.author == username:
+            return pr
+    return None
+
+
+@dataclass
+class ProjectSummary:
+    open_issues: int
+    open_prs: int
+    latest_release: Optional[str]
+
+
+GITHUB_SUMMARY_QUERY = """
+query($owner: String!, $name: String!) {
+  repository(owner: $owner, name: $name) {
+    issues(states: OPEN) { totalCount }
+    pullRequests(states: OPEN) { totalCount }
+    latestRelease { name tagName }
+  }
+}
+"""
+
+
+def _get_github_summary(git_project: GithubProject) -> ProjectSummary:
+    result = GithubAPI.from_project(git_project).graphql(
+        GITHUB_SUMMARY_QUERY,
+        {"owner": git_project.namespace, "name": git_project.repo},
+    )
+    repository = result["data"]["repository"]
+    release = repository["latestRelease"]
+    return ProjectSummary(
+        open_issues=repository["issues"]["totalCount"],
+        open_prs=repository["pullRequests"]["totalCount"],
+        latest_release=(release["name"] or release["tagName"]) if release else None,
+    )
+
+
+def _get_gitlab_summary(git_project: GitlabProject) -> ProjectSummary:
+    project = get_lazy_gitlab_project(git_project)
+
+    def count_issues():
+        return project.issues_statistics.get().statistics["counts"]["opened"]
+
+    def count_mrs():
+        # only the first page is downloaded, the count is in the headers
+        return project.mergerequests.list(
+            state="opened", per_page=1, iterator=True
+        ).total
+
+    def latest_release():
+        releases = project.releases.list(per_page=1, get_all=False)
+        return releases[0].name if releases else None
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        issues, mrs, release = (
+            executor.submit(count_issues),
+            executor.submit(count_mrs),
+            executor.submit(latest_release),
+        )
+        return ProjectSummary(
+            open_issues=issues.result(),
+            open_prs=mrs.result(),
+            latest_release=release.result(),
+        )
+
+
+def _get_generic_summary(git_project: GitProject) -> ProjectSummary:
+    def latest_release():
+        release = git_project.get_latest_release()
+        return release.title if release else None
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        issues, prs, release = (
+            executor.submit(git_project.get_issue_list),
+            executor.submit(git_project.get_pr_list),
+            executor.submit(latest_release),
+        )
+        return ProjectSummary(
+            open_issues=len(list(issues.result())),
+            open_prs=len(list(prs.result())),
+            latest_release=release.result(),
+        )
+
+
+def get_project_summary(git_project: GitProject) -> ProjectSummary:
+    """
+    Count open issues and pull requests and find the latest release
+    without downloading the issues and pull requests themselves.
+
+    GitHub answers all of it in a single GraphQL query, GitLab with three
+    small requests sent at once. Other forges need to list everything.
+    """
+    if isinstance(git_project, GithubProject):
+        return _get_github_summary(git_project)
+    if isinstance(git_project, GitlabProject):
+        return _get_gitlab_summary(git_project)
+    return _get_generic_summary(git_project)
+
+
+@dataclass
+class CheckStatus:
+    """ the latest state of a single CI check of a commit """
+
+    context: str
+    state: CommitStatus
+    description: str
+    url: str
+
+
+# check runs which are not completed yet are reported by their status,
+# the completed ones by their conclusion
+GITHUB_CHECK_RUN_STATES = {
+    "queued": CommitStatus.pending,
+    "waiting": CommitStatus.pending,
+    "requested": CommitStatus.pending,
+    "pending": CommitStatus.pending,
+    "in_progress": CommitStatus.running,
+    "success": CommitStatus.success,
+    "neutral": CommitStatus.success,
+    "skipped": CommitStatus.success,
+    "failure": CommitStatus.failure,
+    "action_required": CommitStatus.failure,
+    "timed_out": CommitStatus.error,
+    "startup_failure": CommitStatus.error,
+    "stale": CommitStatus.warning,
+    "cancelled": CommitStatus.canceled,
+}
+
+GITLAB_STATUS_STATES = {
+    "created": CommitStatus.pending,
+    "pending": CommitStatus.pending,
+    "manual": CommitStatus.pending,
+    "running": CommitStatus.running,
+    "success": CommitStatus.success,
+    "skipped": CommitStatus.success,
+    "failed": CommitStatus.failure,
+    "canceled": CommitStatus.canceled,
+}
+
+
+def _get_github_checks(
+    git_project: GithubProject, commit: str, api: Optional[GithubAPI] = None
+) -> List[CheckStatus]:
+    api = api or GithubAPI.from_project(git_project)
+    repo_path = f"/repos/{git_project.namespace}/{git_project.repo}/commits/{commit}"
+    # the combined status contains only the latest status of every context
+    combined = api.get(f"{repo_path}/status", params={"per_page": 100}).json()
+    checks = [
+        CheckStatus(
+            context=status["context"],
+            state=CommitStatus[status["state"]],
+            description=status["description"] or "",
+            url=status["target_url"] or "",
+        )
+        for status in combined["statuses"]
+    ]
+    check_runs = api.get(
+        f"{repo_path}/check-runs", params={"filter": "latest", "per_page": 100}
+    ).json()
+    for run in check_runs["check_runs"]:
+        state = run["conclusion"] if run["status"] == "completed" else run["status"]
+        checks.append(
+            CheckStatus(
+                context=run["name"],
+                state=GITHUB_CHECK_RUN_STATES.get(state, CommitStatus.warning),
+                description=(run.get("output") or {}).get("title") or "",
+                url=run["html_url"] or "",
+            )
+        )
+    return checks
+
+
+def _get_gitlab_checks(git_project: GitlabProject, commit: str) -> List[CheckStatus]:
+    # unless asked for all of them, GitLab returns only the latest status per name
+    statuses = (
+        get_lazy_gitlab_project(git_project)
+        .commits.get(commit, lazy=True)
+        .statuses.list(per_page=100, get_all=True)
+    )
+    return [
+        CheckStatus(
+            context=status.name,
+            state=GITLAB_STATUS_STATES.get(status.status, CommitStatus.warning),
+            description=status.description or "",
+            url=status.target_url or "",
+        )
+        for status in statuses
+    ]
+
+
+def _get_generic_checks(git_project: GitProject, commit: str) -> List[CheckStatus]:
+    checks: Dict[str, CheckStatus] = {}
+    # the whole history is returned, newest first
+    for status in git_project.get_commit_statuses(commit):
+        if status.context not in checks:
+            checks[status.context] = CheckStatus(
+                context=status.context,
+                state=status.state,
+                description=status.comment or "",
+                url=status.url or "",
+            )
+    return list(checks.values())
+
+
+def get_commit_checks(
+    git_project: GitProject, commit: str, api: Optional[GithubAPI] = None
+) -> List[CheckStatus]:
+    """
+    Get the latest state of every CI check of the commit.
+
+    GitHub needs two requests, one for the combined commit status
+    and one for the check runs, GitLab returns just the latest statuses.
+    Other forges return the whole history which is deduplicated here.
+
+    :param api: GitHub API client to reuse, a new one is created if not set
+    """
+    if isinstance(git_project, GithubProject):
+        return _get_github_checks(git_project, commit, api)
+    if isinstance(git_project, GitlabProject):
+        return _get_gitlab_checks(git_project, commit)
+    return _get_generic_checks(git_project, commit)
+
+
+PENDING_STATES = (CommitStatus.pending, CommitStatus.running)
+
+
+def watch_commit_checks(
+    git_project: GitProject,
+    commit: str,
+    interval: float = WATCH_INTERVAL,
+    max_interval: float = WATCH_MAX_INTERVAL,
+    sleep: Callable[[float], None] = time.sleep,
+) -> Iterator[List[CheckStatus]]:
+    """
+    Poll the CI checks of the commit until there are some and none of them
+    is pending or running. Right after a push, CI may not have registered
+    any checks yet, the polling goes on then.
+
+    The first poll yields all the checks, the following ones only the checks
+    which changed since the previous poll. While nothing changes, the interval
+    is doubled up to `max_interval`; every change resets it.
+    Responses are revalidated by the HTTP cache, so an unchanged poll
+    costs only "304 Not Modified" replies.
+    """
+    api = (
+        GithubAPI.from_project(git_project)
+        if isinstance(git_project, GithubProject)
+        else None
+    )
+    known: Dict[str, CheckStatus] = {}
+    delay = interval
+    first = True
+    while True:
+        checks = get_commit_checks(git_project, commit, api=api)
+        changed = [check for check in checks if known.get(check.context) != check]
+        known.update((check.context, check) for check in checks)
+        if changed or first:
+            yield changed
+        first = False
+        if known and all(check.state not in PENDING_STATES for check in known.values()):
+            return
+        delay = interval if changed else min(delay * 2, max_interval)
+        logger.debug(f"next poll of the commit checks in {delay} seconds")
+        sleep(delay)
@@ -0,0 +1,353 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Copying labels from one project to many.
+
+The labels of a destination are listed at once and compared with the source:
+the plan creates the missing labels, updates those whose color or description
+differ and, when asked to, deletes the labels the source doesn't have.
+A destination which is in sync costs just the list request.
+
+The destinations are processed concurrently and the operations of a destination
+are sent concurrently too. Requests to a single forge host are bounded,
+so that a large fan-out doesn't run into the secondary rate limits.
+"""
+
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, cast
+
+from github.Label import Label as GithubLabel
+from ogr.abstract import GitProject
+from ogr.services.github import GithubProject
+from ogr.services.gitlab import GitlabProject
+
+from upsint.constant import DEFAULT_JOBS, LABEL_HOST_JOBS, MAX_PER_PAGE
+from upsint.exceptions import UpsintException
+from upsint.forge import (
+    get_api_hostname,
+    iter_github_list,
+    get_lazy_github_repo,
+    get_lazy_gitlab_project,
+)
+
+logger = logging.getLogger(__name__)
+
+CREATE = "create"
+UPDATE = "update"
+DELETE = "delete"
+
+
+@dataclass
+class ProjectLabel:
+    """ label as listed by the forge """
+
+    name: str
+    color: str
+    description: str = ""
+    # the object of the forge library, to update or delete the label with
+    handle: Any = field(default=None, repr=False, compare=False)
+    # a label of a parent group, the project can't change it
+    inherited: bool = field(default=False, compare=False)
+
+
+@dataclass
+class LabelOperation:
+    action: str
+    name: str
+    color: Optional[str] = None
+    description: Optional[str] = None
+    # the source spells the name differently, e.g. "Bug" vs. "bug"
+    new_name: Optional[str] = None
+    label: Optional[ProjectLabel] = field(default=None, repr=False)
+
+    def __str__(self):
+        if self.action == DELETE:
+            return f"{self.action} {self.name}"
+        name = f"{self.name} -> {self.new_name}" if self.new_name else self.name
+        return f"{self.action} {name} ({self.color}, {self.description!r})"
+
+
+@dataclass
+class LabelSyncResult:
+    destination: str
+    operations: List[LabelOperation] = field(default_factory=list)
+    unchanged: int = 0
+    done: Dict[str, int] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+def get_project_name(git_project: GitProject) -> str:
+    return f"{git_project.namespace}/{git_project.repo}"
+
+
+class Checkpoint:
+    """
+    Destinations which are done, one per line in a file,
+    so that an interrupted run can skip them when it's started again.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        try:
+            self.done = set(path.read_text().splitlines())
+        except FileNotFoundError:
+            self.done = set()
+
+    def __contains__(self, destination: str) -> bool:
+        return destination in self.done
+
+    def add(self, destination: str):
+        # appended right away, a crash loses at most this destination
+        with self.path.open("a") as checkpoint:
+            checkpoint.write(f"{destination}\n")
+        self.done.add(destination)
+
+
+def iter_labels(git_project: GitProject) -> Iterator[ProjectLabel]:
+    """ labels of the project, read page by page """
+    if isinstance(git_project, GithubProject):
+        labels = iter_github_list(git_project, GithubLabel, "/labels")
+    elif isinstance(git_project, GitlabProject):
+        labels = get_lazy_gitlab_project(git_project).labels.list(
+            iterator=True, per_page=MAX_PER_PAGE
+        )
+    else:
+        raise UpsintException(
+            f"{git_project.__class__.__name__} does not support repository-wide labels."
+        )
+    return (
+        ProjectLabel(
+            label.name,
+            label.color,
+            label.description or "",
+            label,
+            # GitLab lists the labels of the ancestor groups as well
+            inherited=not getattr(label, "is_project_label", True),
+        )
+        for label in labels
+    )
+
+
+def list_labels(git_project: GitProject) -> List[ProjectLabel]:
+    """ all the labels of the project, read in as few pages as possible """
+    return list(iter_labels(git_project))
+
+
+def normalize_label_color(git_project: GitProject, color: str) -> str:
+    """ GitHub takes the colors without "#", GitLab with it """
+    color = color.lstrip("#")
+    return f"#{color}" if isinstance(git_project, GitlabProject) else color
+
+
+def plan_label_sync(
+    labels: Sequence[ProjectLabel],
+    git_project: GitProject,
+    existing: Sequence[ProjectLabel],
+    prune: bool = False,
+) -> List[LabelOperation]:
+    """
+    Operations which make the labels of the project match `labels`.
+
+    Names are compared case-insensitively, as the forges do, colors after
+    normalizing them to the form the project's forge uses.
+    Inherited labels are neither updated nor deleted, only missing labels are created.
+
+    :param existing: labels the project has now
+    :param prune: delete the labels which are not in `labels`
+    """
+    current = {label.name.lower(): label for label in existing}
+    operations, wanted = [], set()
+    for label in labels:
+        key = label.name.lower()
+        if key in wanted:
+            continue
+        wanted.add(key)
+        color = normalize_label_color(git_project, label.color)
+        description = label.description or ""
+        present = current.get(key)
+        if present is None:
+            operations.append(LabelOperation(CREATE, label.name, color, description))
+        elif present.inherited:
+            logger.debug(f"{present.name} is inherited from a group, keeping it")
+        elif (present.name, present.color.lower(), present.description) != (
+            label.name,
+            color.lower(),
+            description,
+        ):
+            operations.append(
+                LabelOperation(
+                    UPDATE,
+                    present.name,
+                    color,
+                    description,
+                    new_name=label.name if label.name != present.name else None,
+                    label=present,
+                )
+            )
+    if prune:
+        operations += [
+            LabelOperation(DELETE, present.name, label=present)
+            for key, present in current.items()
+            if key not in wanted and not present.inherited
+        ]
+    return operations
+
+
+def apply_label_operation(git_project: GitProject, operation: LabelOperation):
+    name = operation.new_name or operation.name
+    if isinstance(git_project, GithubProject):
+        if operation.action == CREATE:
+            get_lazy_github_repo(git_project).create_label(
+                name=name, color=operation.color, description=operation.description
+            )
+        elif operation.action == UPDATE:
+            operation.label.handle.edit(
+                name=name, color=operation.color, description=operation.description
+            )
+        else:
+            operation.label.handle.delete()
+        return
+
+    # the labels of other forges can't be listed, there's nothing to apply
+    manager = get_lazy_gitlab_project(cast(GitlabProject, git_project)).labels
+    if operation.action == CREATE:
+        manager.create(
+            {
+                "name": name,
+                "color": operation.color,
+                "description": operation.description,
+            }
+        )
+    elif operation.action == UPDATE:
+        changes = {"color": operation.color, "description": operation.description}
+        if operation.new_name:
+            changes["new_name"] = operation.new_name
+        manager.update(operation.name, changes)
+    else:
+        manager.delete(operation.name)
+
+
+class LabelSyncer:
+    """
+    Plan and apply the label changes of many projects at once.
+    """
+
+    def __init__(
+        self,
+        jobs: int = DEFAULT_JOBS,
+        host_jobs: int = LABEL_HOST_JOBS,
+        prune: bool = False,
+        dry_run: bool = False,
+    ):
+        """
+        :param jobs: how many destinations to update concurrently
+        :param host_jobs: how many requests to send to a single host concurrently
+        :param prune: delete labels the source doesn't have
+        :param dry_run: only plan the operations
+        """
+        self.jobs = jobs
+        self.host_jobs = host_jobs
+        self.prune = prune
+        self.dry_run = dry_run
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        # operations get their own workers, the destination workers wait for them
+        self._operations = ThreadPoolExecutor(
+            max_workers=jobs, thread_name_prefix="upsint-label"
+        )
+
+    def _host_slot(self, git_project: GitProject) -> threading.BoundedSemaphore:
+        host = get_api_hostname(git_project)
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.host_jobs)
+            return self._host_slots[host]
+
+    def _apply(self, git_project: GitProject, operation: LabelOperation):
+        with self._host_slot(git_project):
+            apply_label_operation(git_project, operation)
+
+    def sync(
+        self, labels: Sequence[ProjectLabel], git_project: GitProject
+    ) -> LabelSyncResult:
+        """ plan the label changes of the project and apply them unless in a dry run """
+        result = LabelSyncResult(get_project_name(git_project))
+        with self._host_slot(git_project):
+            existing = list_labels(git_project)
+        result.operations = plan_label_sync(
+            labels, git_project, existing, prune=self.prune
+        )
+        result.unchanged = len(existing) - sum(
+            operation.action != CREATE for operation in result.operations
+        )
+        if self.dry_run:
+            return result
+        futures = [
+            self._operations.submit(self._apply, git_project, operation)
+            for operation in result.operations
+        ]
+        for operation, future in zip(result.operations, futures):
+            try:
+                future.result()
+            except Exception as ex:
+                logger.debug(f"{operation} in {result.destination} failed")
+                result.error = result.error or f"{operation.name}: {ex}"
+            else:
+                result.done[operation.action] = result.done.get(operation.action, 0) + 1
+        return result
+
+    def _sync_safely(self, labels, git_project) -> LabelSyncResult:
+        try:
+            return self.sync(labels, git_project)
+        except Exception as ex:
+            # one broken destination doesn't stop the others
+            logger.debug(f"updating labels of {get_project_name(git_project)} failed")
+            return LabelSyncResult(get_project_name(git_project), error=str(ex))
+
+    def sync_many(
+        self, labels: Sequence[ProjectLabel], destinations: Iterable[GitProject]
+    ) -> Iterator[LabelSyncResult]:
+        """
+        Update all the destinations. They are read from the iterable as the workers
+        free up, so it can be a listing which is still being fetched.
+
+        :return: generator of results in the order the destinations finish
+        """
+        with ThreadPoolExecutor(
+            max_workers=self.jobs, thread_name_prefix="upsint-destination"
+        ) as executor:
+            pending = set()
+            for destination in destinations:
+                pending.add(executor.submit(self._sync_safely, labels, destination))
+                if len(pending) >= 2 * self.jobs:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from (future.result() for future in done)
+            for future in as_completed(pending):
+                yield future.result()
+
+    def close(self):
+        self._operations.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
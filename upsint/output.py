@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Writers of the rows listing commands print.
+
+A table needs all the rows to size its columns. The machine-readable formats
+are written row by row and flushed regularly, so that a consumer can process
+the first rows while the rest is still being fetched.
+"""
+
+import csv
+import datetime
+import enum
+import json
+import sys
+from typing import Any, Iterable, List, Optional, Sequence, TextIO
+
+from upsint.constant import MAX_PER_PAGE
+
+
+def to_text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return "; ".join(map(to_text, value))
+    if isinstance(value, enum.Enum):
+        return str(value.value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def to_json(value: Any) -> Any:
+    """ the value as a JSON type """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    return to_text(value)
+
+
+class Writer:
+    """
+    Write rows of values of `fields` to the stream.
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[str],
+        stream: Optional[TextIO] = None,
+        flush_every: int = MAX_PER_PAGE,
+    ):
+        """
+        :param flush_every: flush the stream after this many rows,
+                            by default after every page fetched from a forge
+        """
+        self.fields = fields
+        self.stream = stream or sys.stdout
+        self.flush_every = flush_every
+        self.count = 0
+
+    def write(self, row: Sequence[Any]):
+        self._write(row)
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.stream.flush()
+
+    def _write(self, row: Sequence[Any]):
+        raise NotImplementedError()
+
+    def close(self):
+        self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        else:
+            # a failed listing doesn't end up looking complete
+            self.stream.flush()
+
+
+class TableWriter(Writer):
+    """ the rows are printed once all are known """
+
+    def __init__(self, fields, stream=None, flush_every=MAX_PER_PAGE, empty: str = ""):
+        """
+        :param empty: message printed instead of an empty table
+        """
+        super().__init__(fields, stream, flush_every)
+        self.empty = empty
+        self.rows: List[Sequence[Any]] = []
+
+    def _write(self, row):
+        self.rows.append(row)
+
+    def close(self):
+        from tabulate import tabulate
+
+        if self.rows:
+            self.stream.write(tabulate(self.rows, tablefmt="fancy_grid") + "\n")
+        elif self.empty:
+            self.stream.write(self.empty + "\n")
+        super().close()
+
+
+class JsonWriter(Writer):
+    """ a JSON array of objects, still written an object at a time """
+
+    def _write(self, row):
+        self.stream.write("[\n" if self.count == 0 else ",\n")
+        self.stream.write(json.dumps(dict(zip(self.fields, map(to_json, row)))))
+
+    def close(self):
+        self.stream.write("[]\n" if self.count == 0 else "\n]\n")
+        super().close()
+
+
+class JsonLinesWriter(Writer):
+    """ a JSON object per line """
+
+    def _write(self, row):
+        line = json.dumps(dict(zip(self.fields, map(to_json, row))))
+        self.stream.write(line + "\n")
+
+
+class CsvWriter(Writer):
+    """ CSV with a header """
+
+    def __init__(self, fields, stream=None, flush_every=MAX_PER_PAGE):
+        super().__init__(fields, stream, flush_every)
+        self.writer = csv.writer(self.stream)
+        self.writer.writerow(fields)
+
+    def _write(self, row):
+        self.writer.writerow([to_text(value) for value in row])
+
+
+class TsvWriter(Writer):
+    """ tab-separated values without a header, tabs and newlines become spaces """
+
+    table = str.maketrans("\t\r\n", "   ")
+
+    def _write(self, row):
+        line = "\t".join(to_text(value).translate(self.table) for value in row)
+        self.stream.write(line + "\n")
+
+
+WRITERS = {
+    "json": JsonWriter,
+    "jsonl": JsonLinesWriter,
+    "csv": CsvWriter,
+    "tsv": TsvWriter,
+}
+
+
+def get_writer(
+    output: str,
+    fields: Sequence[str],
+    stream: Optional[TextIO] = None,
+    flush_every: int = MAX_PER_PAGE,
+    empty: str = "",
+) -> Writer:
+    """
+    :param output: "table" or one of OUTPUT_FORMATS
+    :param empty: message printed instead of an empty table
+    """
+    if output == "table":
+        return TableWriter(fields, stream, flush_every, empty=empty)
+    return WRITERS[output](fields, stream, flush_every)
+
+
+def write_rows(
+    rows: Iterable[Sequence[Any]],
+    fields: Sequence[str],
+    output: str,
+    empty: str = "",
+    flush_every: int = MAX_PER_PAGE,
+):
+    """ write all the rows to stdout as they come """
+    with get_writer(output, fields, flush_every=flush_every, empty=empty) as writer:
+        for row in rows:
+            writer.write(row)
@@ -0,0 +1,222 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Scheduling of requests within the rate limits of the forges.
+
+GitHub reports the budget in X-RateLimit-{Limit,Remaining,Reset} headers,
+GitLab in RateLimit-{Limit,Remaining,Reset}. The budget is tracked per host,
+credentials and (on GitHub) resource. Once it runs low, requests are spread
+evenly until the reset; when it's exhausted, or a secondary limit answers
+with Retry-After, requests wait and are retried, unless the wait is too long.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from upsint.constant import RATE_LIMIT_MAX_WAIT, RATE_LIMIT_PACE_BELOW
+from upsint.exceptions import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+# how many times a request rejected by a rate limit is sent again
+MAX_RETRIES = 3
+
+
+@dataclass
+class Budget:
+    limit: Optional[int] = None
+    remaining: Optional[int] = None
+    reset: Optional[float] = None
+    # no requests until then, set by Retry-After
+    blocked_until: float = 0.0
+    # the earliest time the next request may be sent when pacing
+    next_slot: float = 0.0
+
+
+def get_budget_key(request) -> Tuple[str, str, str]:
+    url = urlsplit(request.url)
+    path = url.path.rstrip("/")
+    if path.endswith("/graphql"):
+        resource = "graphql"
+    elif "/search/" in path:
+        resource = "search"
+    else:
+        resource = "core"
+    credentials = hashlib.sha256(
+        "\0".join(
+            request.headers.get(header, "")
+            for header in ("Authorization", "Private-Token")
+        ).encode()
+    ).hexdigest()
+    return url.hostname or "", credentials, resource
+
+
+def _get_header(headers, *names) -> Optional[str]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        max_requests: Optional[int] = None,
+        max_wait: float = RATE_LIMIT_MAX_WAIT,
+        pace_below: float = RATE_LIMIT_PACE_BELOW,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        :param max_requests: refuse to send more requests than this in total
+        :param max_wait: wait at most this many seconds for a rate limit to reset,
+                         fail instead
+        :param pace_below: spread the requests once the remaining part
+                           of the budget drops below this fraction
+        """
+        self.max_requests = max_requests
+        self.max_wait = max_wait
+        self.pace_below = pace_below
+        self.sleep = sleep
+        self.clock = clock
+        self.requests_sent = 0
+        self.budgets: Dict[Tuple[str, str, str], Budget] = {}
+        self._lock = threading.Lock()
+
+    def get_remaining(self, host: str) -> Optional[int]:
+        """ the lowest known remaining budget for the host """
+        with self._lock:
+            remaining = [
+                budget.remaining
+                for (budget_host, _, _), budget in self.budgets.items()
+                if budget_host == host and budget.remaining is not None
+            ]
+        return min(remaining) if remaining else None
+
+    def reserve(self, requests: int, host: Optional[str] = None):
+        """
+        Check up front that a command needing about this many requests can finish.
+
+        :raises RateLimitExceeded: when the requests exceed --max-requests
+        """
+        if self.max_requests is not None:
+            allowed = self.max_requests - self.requests_sent
+            if requests > allowed:
+                raise RateLimitExceeded(
+                    f"This needs about {requests} requests, "
+                    f"only {allowed} are allowed by --max-requests."
+                )
+        remaining = self.get_remaining(host) if host else None
+        if remaining is not None and requests > remaining:
+            logger.warning(
+                f"About {requests} requests are needed but only {remaining} remain "
+                f"in the rate limit of {host}, upsint will wait for the reset."
+            )
+
+    def _wait(self, seconds: float, reason: str):
+        if seconds > self.max_wait:
+            raise RateLimitExceeded(
+                f"{reason}: it would take {seconds:.0f} seconds to continue "
+                f"(at most {self.max_wait:.0f} are allowed)."
+            )
+        log = logger.warning if seconds >= 5 else logger.debug
+        log(f"{reason}, waiting {seconds:.1f} seconds")
+        self.sleep(seconds)
+
+    def before_send(self, request):
+        """ wait until the request can be sent """
+        key = get_budget_key(request)
+        with self._lock:
+            if (
+                self.max_requests is not None
+                and self.requests_sent >= self.max_requests
+            ):
+                raise RateLimitExceeded(
+                    f"Reached the limit of {self.max_requests} requests (--max-requests)."
+                )
+            self.requests_sent += 1
+            budget = self.budgets.setdefault(key, Budget())
+            now = self.clock()
+            delay, reason = 0.0, ""
+            if budget.blocked_until > now:
+                delay, reason = budget.blocked_until - now, "Secondary rate limit hit"
+            elif budget.remaining is not None and budget.reset is not None:
+                until_reset = max(budget.reset - now, 0.0)
+                if budget.remaining <= 0 and until_reset > 0:
+                    delay, reason = until_reset, f"Rate limit of {key[0]} exhausted"
+                elif budget.limit and budget.remaining < budget.limit * self.pace_below:
+                    # spread the rest of the budget until the reset
+                    slot = max(now, budget.next_slot)
+                    budget.next_slot = slot + until_reset / max(budget.remaining, 1)
+                    delay, reason = slot - now, f"Rate limit of {key[0]} running low"
+                if budget.remaining is not None:
+                    budget.remaining -= 1
+        if delay > 0:
+            self._wait(delay, reason)
+
+    def after_send(self, request, response) -> Optional[float]:
+        """
+        Update the budget from the response.
+
+        :return: seconds to wait before retrying the request if it was rejected
+                 by a rate limit, None otherwise
+        """
+        key = get_budget_key(request)
+        headers = response.headers
+        remaining = _get_header(headers, "X-RateLimit-Remaining", "RateLimit-Remaining")
+        limit = _get_header(headers, "X-RateLimit-Limit", "RateLimit-Limit")
+        reset = _get_header(headers, "X-RateLimit-Reset", "RateLimit-Reset")
+        retry_after = headers.get("Retry-After")
+        now = self.clock()
+        with self._lock:
+            budget = self.budgets.setdefault(key, Budget())
+            if remaining is not None and remaining.isdigit():
+                budget.remaining = int(remaining)
+            if limit is not None and limit.isdigit():
+                budget.limit = int(limit)
+            if reset is not None and reset.isdigit():
+                budget.reset = float(reset)
+            if response.status_code not in (403, 429):
+                return None
+            if retry_after is not None and retry_after.isdigit():
+                budget.blocked_until = now + int(retry_after)
+                return float(retry_after)
+            if budget.remaining == 0 and budget.reset is not None:
+                return max(budget.reset - now, 0.0)
+        return None
+
+    def send(self, send, adapter, request, **kwargs):
+        """
+        Send the request within the rate limits, retry it when it's rejected by one.
+
+        :param send: function sending the request over the network
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            self.before_send(request)
+            response = send(adapter, request, **kwargs)
+            delay = self.after_send(request, response)
+            if delay is None or attempt == MAX_RETRIES:
+                return response
+            response.close()
+            self._wait(delay, f"Request to {request.url} rejected by a rate limit")
+        return response
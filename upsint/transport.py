@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+HTTP transport shared by all the forge clients.
+
+PyGithub, python-gitlab and our own GitHub client each create their own
+requests session and so their own connection pools. The transport hooks into
+requests' HTTPAdapter.send, so every session of the process sends through
+one pool manager. Connections (and TLS sessions) are then reused across
+services and threads.
+
+The transport also applies the default timeouts, asks for compressed
+responses, routes GET requests through the HTTP cache, keeps the requests
+within the rate limits and reports the duration of every request sent
+over the network to the timing hooks.
+"""
+
+import logging
+import socket
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.poolmanager import PoolManager
+
+from upsint.constant import (
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_POOL_MAXSIZE,
+    HTTP_POOL_NUM,
+    HTTP_READ_TIMEOUT,
+)
+
+from upsint.ratelimit import RateLimiter
+
+if TYPE_CHECKING:
+    from upsint.cache import HTTPCache
+
+logger = logging.getLogger(__name__)
+
+TimingHook = Callable[[requests.PreparedRequest, requests.Response, float], None]
+
+
+class SharedPoolManager(PoolManager):
+    """
+    Pool manager shared by all the adapters: pools can be sized per host
+    and closing a session doesn't close the connections of the others.
+    """
+
+    def __init__(self, pool_sizes: Optional[Dict[str, int]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.pool_sizes = pool_sizes or {}
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        if request_context is None:
+            request_context = self.connection_pool_kw.copy()
+        if host in self.pool_sizes:
+            request_context = dict(request_context, maxsize=self.pool_sizes[host])
+        return super()._new_pool(scheme, host, port, request_context=request_context)
+
+    def clear(self):
+        """ called by HTTPAdapter.close(), the pools are still used by others """
+
+    def close(self):
+        super().clear()
+
+
+class Transport:
+    def __init__(
+        self,
+        cache: Optional["HTTPCache"] = None,
+        pool_maxsize: int = HTTP_POOL_MAXSIZE,
+        pool_sizes: Optional[Dict[str, int]] = None,
+        num_pools: int = HTTP_POOL_NUM,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = HTTP_READ_TIMEOUT,
+        keep_alive: bool = True,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        """
+        :param cache: route GET requests through this cache
+        :param pool_maxsize: connections kept open per host
+        :param pool_sizes: {hostname: connections} for hosts needing a different size
+        :param num_pools: how many hosts to keep connections to
+        :param connect_timeout: default timeout for connecting, in seconds
+        :param read_timeout: default timeout for a response, in seconds
+        :param keep_alive: enable TCP keep-alive, so idle connections survive
+                           between the requests
+        :param rate_limiter: schedules the requests within the rate limits
+        """
+        self.cache = cache
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        socket_options = list(HTTPConnection.default_socket_options)
+        if keep_alive:
+            socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        self.poolmanager = SharedPoolManager(
+            pool_sizes=pool_sizes,
+            num_pools=num_pools,
+            maxsize=pool_maxsize,
+            socket_options=socket_options,
+        )
+        self.hooks: List[TimingHook] = []
+        self.requests_sent = 0
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: TimingHook):
+        """ call hook(request, response, seconds) after every request sent """
+        self.hooks.append(hook)
+
+    def _send(self, send, adapter: HTTPAdapter, request, **kwargs):
+        start = time.monotonic()
+        response = send(adapter, request, **kwargs)
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self.requests_sent += 1
+        for hook in self.hooks:
+            hook(request, response, elapsed)
+        return response
+
+    def send(self, send, adapter: HTTPAdapter, request, **kwargs):
+        """
+        Send the request through the shared pools.
+
+        :param send: the original HTTPAdapter.send
+        """
+        if adapter.poolmanager is not self.poolmanager:
+            # the adapter keeps its retry and proxy settings
+            adapter.poolmanager = self.poolmanager
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        request.headers.setdefault("Accept-Encoding", "gzip, deflate")
+
+        def timed_send(adapter, request, **kwargs):
+            return self._send(send, adapter, request, **kwargs)
+
+        def network_send(adapter, request, **kwargs):
+            return self.rate_limiter.send(timed_send, adapter, request, **kwargs)
+
+        if self.cache is not None:
+            return self.cache.send(network_send, adapter, request, **kwargs)
+        return network_send(adapter, request, **kwargs)
+
+    def close(self):
+        self.poolmanager.close()
+
+
+_original_send = None
+_transport: Optional[Transport] = None
+
+
+def install_transport(transport: Transport):
+    """
+    Send all requests made through requests' HTTPAdapter (and its subclasses)
+    via the transport. Any session created by ogr, PyGithub or python-gitlab is covered.
+    """
+    global _original_send, _transport
+    if _original_send is None:
+        _original_send = HTTPAdapter.send
+    _transport = transport
+
+    def send(adapter, request, **kwargs):
+        return transport.send(_original_send, adapter, request, **kwargs)
+
+    # patching the class covers the adapters of sessions created by the libraries
+    HTTPAdapter.send = send  # type: ignore[method-assign,assignment]
+
+
+def uninstall_transport():
+    global _original_send, _transport
+    if _original_send is not None:
+        HTTPAdapter.send = _original_send
+        _original_send = None
+    _transport = None
+
+
+def get_installed_transport() -> Optional[Transport]:
+    return _transport
@@ -20,11 +20,22 @@ import os
 import re
 import subprocess
 import datetime
+import itertools
 from dataclasses import dataclass
 from time import sleep
-from typing import Iterable, Dict, List, Optional
+from typing import (
+    IO,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
 
 from upsint.constant import CLONE_TIMEOUT
+from upsint.exceptions import UpsintException
 
 logger = logging.getLogger(__name__)
 
@@ -145,50 +156,155 @@ def prompt_for_pr_content(template: str):
     return title, body.strip()
 
 
-def list_local_branches(merged_with: str) -> Iterable[Dict]:
+class Branch(NamedTuple):
+    """ a local branch with additional metadata """
+
+    name: str
+    remote_tracking: str
+    # ISO 8601, parsed only when needed
+    authordate: str
+    tracking_status: str
+    merged: str
+    sha: str
+
+    @property
+    def date(self) -> datetime.datetime:
+        """ timezone-aware author date of the top commit """
+        return datetime.datetime.fromisoformat(self.authordate)
+
+    def as_row(self) -> Tuple[str, str, datetime.datetime, str, str]:
+        """ fields displayed to users """
+        return (
+            self.name,
+            self.remote_tracking,
+            self.date,
+            self.tracking_status,
+            self.merged,
+        )
+
+
+def _for_each_ref(atoms: List[str], *options: str) -> Iterator[List[str]]:
     """
-    provide a list of local git branches with additional metadata
+    run `git for-each-ref` over local branches and stream its output
+
+    :param atoms: format atoms, one per field
+    :param options: additional options such as --merged
+    :return: generator of fields for every branch
+    """
+    cmd = [
+        "git",
+        "for-each-ref",
+        "--format",
+        "%00".join(atoms),
+        *options,
+        "refs/heads/",
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for line in proc.stdout:
+            yield line.decode("utf-8").rstrip("\n").split("\0")
+    finally:
+        proc.stdout.close()
+        stderr = proc.stderr.read()
+        proc.stderr.close()
+        retcode = proc.wait()
+    if retcode:
+        raise subprocess.CalledProcessError(retcode, cmd, stderr=stderr)
+
+
+def iter_local_branches(
+    merged_with: str, limit: Optional[int] = None
+) -> Iterator[Branch]:
+    """
+    stream local git branches with additional metadata, most recent first
+
+    Git >= 2.41 computes everything in a single for-each-ref pass,
+    older versions need one more to find out which branches were merged.
 
     :param merged_with: was a branch merged into this one?
-    :return: list of dicts
+    :param limit: provide only this many most recent branches
+    :return: generator of branches
     """
-    fmt = (
-        "%(refname:short);%(upstream:short);%(authordate:iso-strict);%(upstream:track)"
+    atoms = [
+        "%(refname:short)",
+        "%(upstream:short)",
+        "%(authordate:iso-strict)",
+        "%(upstream:track)",
+        "%(objectname)",
+    ]
+    # git sorts (and cuts) the list for us, so there is nothing to collect here
+    options = ["--sort=-authordate"]
+    if limit:
+        options.append(f"--count={limit}")
+
+    for_each_ref = _for_each_ref(atoms + [f"%(ahead-behind:{merged_with})"], *options)
+    try:
+        # git validates the format before printing anything
+        first = next(for_each_ref, None)
+    except subprocess.CalledProcessError as ex:
+        if b"ahead-behind" not in ex.stderr:
+            raise
+        logger.debug("git is too old for %(ahead-behind), using --merged")
+        was_merged = {
+            fields[0]
+            for fields in _for_each_ref(["%(refname:short)"], f"--merged={merged_with}")
+        }
+        for fields in _for_each_ref(atoms, *options):
+            yield _branch_from_fields(fields, merged=fields[0] in was_merged)
+        return
+
+    if first is None:
+        return
+    for fields in itertools.chain([first], for_each_ref):
+        # "<ahead> <behind>", a branch is merged when it's not ahead
+        yield _branch_from_fields(fields, merged=fields[5].split(" ")[0] == "0")
+
+
+def _branch_from_fields(fields: List[str], merged: bool) -> Branch:
+    return Branch(
+        name=fields[0],
+        remote_tracking=fields[1],
+        authordate=fields[2],
+        tracking_status=fields[3],
+        merged="merged" if merged else "",
+        sha=fields[4],
     )
-    for_each_ref = (
-        subprocess.check_output(["git", "for-each-ref", "--format", fmt, "refs/heads/"])
+
+
+def list_local_branches(merged_with: str) -> List[Branch]:
+    """
+    provide a list of local git branches with additional metadata
+
+    :param merged_with: was a branch merged into this one?
+    :return: list of branches, most recent first
+    """
+    return list(iter_local_branches(merged_with))
+
+
+def get_current_branch_name():
+    return (
+        subprocess.check_output(["git", "rev-parse", "--abbrev-ref", "HEAD"])
         .decode("utf-8")
         .strip()
-        .split("\n")
     )
-    response = []
-    was_merged = (
+
+
+def rev_parse(revision: str) -> str:
+    """ resolve a revision to a commit hash """
+    return (
         subprocess.check_output(
-            ["git", "branch", "--merged", merged_with, "--format", "%(refname:short)"]
+            ["git", "rev-parse", "--verify", f"{revision}^{{commit}}"]
         )
         .decode("utf-8")
         .strip()
-        .split("\n")
     )
-    for li in for_each_ref:
-        fields = li.split(";")
-        response.append(
-            {
-                "name": fields[0],
-                "remote_tracking": fields[1],
-                "date": datetime.datetime.strptime(fields[2][:-6], "%Y-%m-%dT%H:%M:%S"),
-                "tracking_status": fields[3],
-                "merged": "merged" if fields[0] in was_merged else "",
-            }
-        )
-    return response
 
 
-def get_current_branch_name():
+def is_ancestor(ancestor: str, descendant: str) -> bool:
+    """ is commit `ancestor` reachable from `descendant`? """
     return (
-        subprocess.check_output(["git", "rev-parse", "--abbrev-ref", "HEAD"])
-        .decode("utf-8")
-        .strip()
+        subprocess.call(["git", "merge-base", "--is-ancestor", ancestor, descendant])
+        == 0
     )
 
 
@@ -212,6 +328,213 @@ def git_branch_d(branch_name: str):
     return subprocess.check_call(["git", "branch", "--delete", branch_name])
 
 
+def get_checked_out_branches() -> Set[str]:
+    """ branches checked out in any of the worktrees """
+    output = subprocess.check_output(["git", "worktree", "list", "--porcelain"])
+    prefix = "branch refs/heads/"
+    return {
+        line.split(prefix, 1)[1]
+        for line in output.decode("utf-8").splitlines()
+        if line.startswith(prefix)
+    }
+
+
+def git_delete_branches(branches: Dict[str, str]) -> Dict[str, str]:
+    """
+    delete local branches in a single ref transaction
+
+    The transaction checks every branch still points to the expected commit,
+    so a branch which was updated in the meantime is not lost. If a branch
+    can't be deleted, it's left out and the transaction is retried for the rest.
+
+    :param branches: {branch name: expected commit}
+    :return: {branch name: reason} for branches which were not deleted
+    """
+    failures = {
+        name: "checked out in a worktree"
+        for name in get_checked_out_branches()
+        if name in branches
+    }
+    to_delete = {n: c for n, c in branches.items() if n not in failures}
+    while to_delete:
+        transaction = "".join(
+            f"delete refs/heads/{name}\0{commit}\0"
+            for name, commit in to_delete.items()
+        )
+        proc = subprocess.run(
+            ["git", "update-ref", "--stdin", "-z"],
+            input=transaction.encode("utf-8"),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=False,
+        )
+        if proc.returncode == 0:
+            break
+        error = proc.stderr.decode("utf-8").strip()
+        failed = re.search(r"'refs/heads/(.+?)'", error)
+        if not failed or failed.group(1) not in to_delete:
+            # we can't tell which one, nothing was deleted
+            failures.update({name: error for name in to_delete})
+            return failures
+        logger.debug("cannot delete branch %s: %s", failed.group(1), error)
+        failures[failed.group(1)] = error
+        del to_delete[failed.group(1)]
+
+    # `git branch -d` also removes the configuration of the branch
+    deleted = set(to_delete)
+    try:
+        config = subprocess.check_output(
+            ["git", "config", "--name-only", "--get-regexp", r"^branch\."]
+        ).decode("utf-8")
+    except subprocess.CalledProcessError:
+        # no branch configuration at all
+        config = ""
+    sections = {key.rsplit(".", 1)[0] for key in config.splitlines()}
+    for section in sections:
+        if section.split(".", 1)[1] in deleted:
+            subprocess.check_call(["git", "config", "--remove-section", section])
+    return failures
+
+
+COMMIT_LOG_FIELDS = ("%H", "%P", "%s", "%b")
+# fields are separated by NUL and "-z" terminates every record with NUL as well,
+# so the output is a flat stream of NUL-terminated fields, 4 per commit
+COMMIT_LOG_FORMAT = "%x00".join(COMMIT_LOG_FIELDS)
+
+
+@dataclass
+class CommitMetadata:
+    hash: str
+    parents: List[str]
+    message: str
+    body: str
+
+    @property
+    def is_merge(self) -> bool:
+        return len(self.parents) > 1
+
+
+def parse_commit_log(
+    stream: IO[bytes], chunk_size: int = 64 * 1024
+) -> Iterator[CommitMetadata]:
+    """
+    parse output of `git log -z --format=COMMIT_LOG_FORMAT` incrementally
+
+    :param stream: binary stream with the git log output
+    :param chunk_size: how many bytes to read at once
+    :return: generator of commit metadata, in the order git printed them
+    """
+    fields_count = len(COMMIT_LOG_FIELDS)
+    fields: List[bytes] = []
+    buffer = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        *complete, buffer = buffer.split(b"\0")
+        for field in complete:
+            fields.append(field)
+            if len(fields) == fields_count:
+                yield _commit_metadata_from_fields(fields)
+                fields = []
+    if fields or buffer.strip():
+        raise UpsintException(
+            f"Unexpected end of git log output, incomplete record: {fields + [buffer]}"
+        )
+
+
+def _commit_metadata_from_fields(fields: List[bytes]) -> CommitMetadata:
+    commit_hash, parents, subject, body = (
+        f.decode("utf-8", errors="replace") for f in fields
+    )
+    # "-z" separates records with NUL only, the newline git adds after the body
+    # of the previous commit ends up at the start of the hash field
+    return CommitMetadata(
+        hash=commit_hash.strip(),
+        parents=parents.split(),
+        message=subject.strip(),
+        body=re.sub(r"Reviewed\-by:.+", "", body, flags=re.DOTALL).strip(),
+    )
+
+
+def iter_commits(
+    *revisions: str, first_parent: bool = False
+) -> Iterator[CommitMetadata]:
+    """
+    walk the history with a single `git log` call and yield parsed commits
+
+    :param revisions: revisions (or ranges) passed to git log
+    :param first_parent: follow only the first parent of merge commits
+    :return: generator of commit metadata
+    """
+    # "--" - to separate revisions from paths
+    cmd = ["git", "log", "-z", f"--format={COMMIT_LOG_FORMAT}"]
+    if first_parent:
+        cmd.append("--first-parent")
+    cmd += [*revisions, "--"]
+    logger.debug("walking history: %s", cmd)
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    try:
+        yield from parse_commit_log(proc.stdout)
+    finally:
+        # closing the pipe makes git exit if the generator was not exhausted
+        proc.stdout.close()
+        retcode = proc.wait()
+    if retcode:
+        raise subprocess.CalledProcessError(retcode, cmd)
+
+
+def get_merge_history(
+    lower_bound: str, upper_bound: str = "HEAD"
+) -> List[Tuple[CommitMetadata, List[CommitMetadata]]]:
+    """
+    get first-parent history of a range together with the commits
+    each of the first-parent commits brought in (via merge)
+
+    The whole range is read in a single git call.
+
+    :param lower_bound: commits starting here
+    :param upper_bound: and ending here
+    :return: list of (commit, merged commits), newest first
+    """
+    commits = list(iter_commits(f"{lower_bound}..{upper_bound}"))
+    if not commits:
+        return []
+    by_hash = {c.hash: c for c in commits}
+    order = {c.hash: idx for idx, c in enumerate(commits)}
+
+    # the tip is the only commit in the range which is not a parent of any other
+    parents = {p for c in commits for p in c.parents}
+    tip = next(c for c in commits if c.hash not in parents)
+    first_parent_chain = [tip]
+    while first_parent_chain[-1].parents:
+        parent = by_hash.get(first_parent_chain[-1].parents[0])
+        if parent is None:
+            break
+        first_parent_chain.append(parent)
+
+    # everything reachable from the first parent of a commit was claimed
+    # by the older commits of the chain, so walking from the oldest one,
+    # each commit claims what it can reach via its other parents
+    claimed = {c.hash for c in first_parent_chain}
+    history = []
+    for commit in reversed(first_parent_chain):
+        merged = []
+        stack = list(commit.parents[1:])
+        while stack:
+            commit_hash = stack.pop()
+            if commit_hash in claimed or commit_hash not in by_hash:
+                continue
+            claimed.add(commit_hash)
+            merged.append(by_hash[commit_hash])
+            stack.extend(by_hash[commit_hash].parents)
+        merged.sort(key=lambda c: order[c.hash])
+        history.append((commit, merged))
+    history.reverse()
+    return history
+
+
 def get_commits_in_range(lower_bound: str, upper_bound: str = "HEAD") -> List[str]:
     """
     get commits in a range of commits
@@ -220,18 +543,9 @@ def get_commits_in_range(lower_bound: str, upper_bound: str = "HEAD") -> List[st
     :param upper_bound: and ending here
     :return: list of commit hashes
     """
-    # "--" - to separate reviions from paths
-    cmd = [
-        "git",
-        "log",
-        "--pretty=format:%H",
-        "--first-parent",
-        f"{lower_bound}..{upper_bound}",
-        "--",
+    return [
+        c.hash for c in iter_commits(f"{lower_bound}..{upper_bound}", first_parent=True)
     ]
-    out: str = subprocess.check_output(cmd).decode()
-    commit_list: List[str] = out.strip().split("\n")
-    return commit_list
 
 
 def get_commits_in_a_merge(commit_hash: str) -> List[str]:
@@ -241,29 +555,10 @@ def get_commits_in_a_merge(commit_hash: str) -> List[str]:
     :param commit_hash: a pony
     :return: list of commit hashes
     """
-    # "--" - to separate reviions from paths
-    cmd = ["git", "log", "--pretty=format:%H", f"{commit_hash}^..{commit_hash}", "--"]
-    out: str = subprocess.check_output(cmd).decode()
-    commit_list: List[str] = out.strip().split("\n")
+    commit_list = [c.hash for c in iter_commits(f"{commit_hash}^..{commit_hash}")]
     # the first one is the merge commit, we don't care about that
     return commit_list[1:]
 
 
-@dataclass
-class CommitMetadata:
-    message: str
-    body: str
-
-
 def get_commit_metadata(commit_hash: str) -> CommitMetadata:
-    commit_subject = (
-        subprocess.check_output(["git", "show", "--quiet", "--format=%s", commit_hash])
-        .decode()
-        .strip()
-    )
-    commit_body = subprocess.check_output(
-        ["git", "show", "--quiet", "--format=%b", commit_hash]
-    ).decode()
-    reg = r"Reviewed\-by:.+"
-    commit_body = re.sub(reg, "", commit_body, flags=re.DOTALL).strip()
-    return CommitMetadata(message=commit_subject, body=commit_body)
+    return next(iter_commits("-1", commit_hash))